@@ -0,0 +1,138 @@
+import re
+import json
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from kubernetes.client.rest import ApiException
+
+from .k8s_api import v1_api
+from .state_store import MAX_CONFLICT_RETRIES
+
+HISTORY_KEY = 'history'
+# Latest deployment of each RUN_ID is indexed under `run.<RUN_ID>` key
+INDEX_KEY_PREFIX = 'run.'
+MAX_HISTORY_LENGTH = 50
+
+
+class DeploymentHistory(ABC):
+    '''
+    Deployments (RUN_ID and Knative revision serving it) of every InferenceService,
+    shared by all Pull Requests. Entries are dicts with `run_id`, `revision`,
+    `previous_revision`, `time` and `retain_until` keys.
+    '''
+    @abstractmethod
+    def entries(self, namespace: str, name: str) -> List[Dict]:
+        'Returns deployments of InferenceService `name` (oldest first)'
+        pass
+
+    @abstractmethod
+    def find(self, namespace: str, name: str, run_id: str) -> Optional[Dict]:
+        'Returns the latest deployment of `run_id` or None'
+        pass
+
+    @abstractmethod
+    def record(self, namespace: str, name: str, entry: Dict) -> None:
+        pass
+
+
+class DevelopmentDummyDeploymentHistory(DeploymentHistory):
+    def __init__(self):
+        self._entries = {}
+
+    def entries(self, namespace: str, name: str) -> List[Dict]:
+        return self._entries.get((namespace, name), [])
+
+    def find(self, namespace: str, name: str, run_id: str) -> Optional[Dict]:
+        matching = [e for e in self.entries(namespace, name) if e['run_id'] == run_id]
+        return matching[-1] if matching else None
+
+    def record(self, namespace: str, name: str, entry: Dict) -> None:
+        self._entries.setdefault((namespace, name), []).append(
+            dict(entry, time=datetime.utcnow().isoformat()))
+
+
+class ConfigMapDeploymentHistory(DeploymentHistory):
+    '''
+    Keeps history of each InferenceService in a ConfigMap (in kfops namespace) named
+    after its namespace and name. Lookups are a single read.
+    '''
+    def __init__(self, namespace: str = 'kfops'):
+        self.logger = logging.getLogger('kfops')
+        self.namespace = namespace
+        self._data = {}
+
+    @staticmethod
+    def configmap_name(namespace: str, name: str) -> str:
+        name = 'kfops-deployments-%s-%s' % (namespace, name)
+        name = re.sub(r'[^a-z0-9-]', '-', name.lower())
+        return name[:253].strip('-')
+
+    def _read(self, name: str):
+        try:
+            return v1_api.read_namespaced_config_map(name=name, namespace=self.namespace)
+        except ApiException as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def _data_of(self, namespace: str, name: str) -> Dict:
+        configmap_name = self.configmap_name(namespace, name)
+        if configmap_name not in self._data:
+            configmap = self._read(configmap_name)
+            self._data[configmap_name] = (configmap.data or {}) if configmap else {}
+        return self._data[configmap_name]
+
+    def entries(self, namespace: str, name: str) -> List[Dict]:
+        return json.loads(self._data_of(namespace, name).get(HISTORY_KEY, '[]'))
+
+    def find(self, namespace: str, name: str, run_id: str) -> Optional[Dict]:
+        entry = self._data_of(namespace, name).get(INDEX_KEY_PREFIX + run_id)
+        return json.loads(entry) if entry else None
+
+    def record(self, namespace: str, name: str, entry: Dict) -> None:
+        configmap_name = self.configmap_name(namespace, name)
+        entry = dict(entry, time=datetime.utcnow().isoformat())
+
+        for _ in range(MAX_CONFLICT_RETRIES):
+            configmap = self._read(configmap_name)
+            data = (configmap.data or {}) if configmap else {}
+
+            history = json.loads(data.get(HISTORY_KEY, '[]')) + [entry]
+            data = dict(data)
+            data[HISTORY_KEY] = json.dumps(history[-MAX_HISTORY_LENGTH:])
+            data[INDEX_KEY_PREFIX + entry['run_id']] = json.dumps(entry)
+
+            try:
+                if configmap:
+                    configmap.data = data
+                    v1_api.replace_namespaced_config_map(
+                        name=configmap_name, namespace=self.namespace, body=configmap)
+                else:
+                    v1_api.create_namespaced_config_map(
+                        namespace=self.namespace, body=self._manifest(configmap_name, namespace, name, data))
+                self._data[configmap_name] = data
+                return
+            except ApiException as e:
+                # Modified (409 on replace) or created (409 on create) concurrently, retry
+                if e.status != 409:
+                    raise
+        raise Exception('Could not store deployment history in ConfigMap %s' % configmap_name)
+
+    def _manifest(self, configmap_name: str, namespace: str, name: str, data: Dict) -> Dict:
+        return {
+            'apiVersion': 'v1',
+            'kind': 'ConfigMap',
+            'metadata': {
+                'name': configmap_name,
+                'labels': {
+                    'app.kubernetes.io/managed-by': 'kfops',
+                    'kfops/deployment-history': 'true'
+                },
+                'annotations': {
+                    'kfops/inference-service': '%s/%s' % (namespace, name)
+                }
+            },
+            'data': data
+        }
@@ -0,0 +1,88 @@
+import os
+import json
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Phases of deployment, in order. Pod phases are measured on the first ready pod of the new revision.
+PHASES = [
+    ('scheduling', 'Scheduling'),
+    ('image_pull', 'Image pull'),
+    ('storage_initializer', 'Storage initializer (model download)'),
+    ('model_load', 'Model load (container start to ready)'),
+    ('ready', 'Revision ready'),
+    ('checks', 'Checks (sample input, load tests, warmup)'),
+    ('traffic_shift', 'Traffic shift')
+]
+PREDICTOR_CONTAINER = 'kserve-container'
+
+_history_lock = threading.Lock()
+
+
+def seconds(start: Optional[datetime], end: Optional[datetime]) -> Optional[float]:
+    if start is None or end is None:
+        return None
+    return max((end - start).total_seconds(), 0)
+
+
+def event_time(event) -> Optional[datetime]:
+    return event.last_timestamp or event.event_time or event.first_timestamp
+
+
+def pod_ready_time(pod) -> Optional[datetime]:
+    return next((c.last_transition_time for c in pod.status.conditions or []
+                 if c.type == 'Ready' and c.status == 'True'), None)
+
+
+def image_pull_seconds(events) -> float:
+    'Time between "Pulling" and "Pulled" events of the pod (images already present take no time)'
+    total, pulling = 0, []
+    for e in sorted([e for e in events if event_time(e)], key=event_time):
+        if e.reason == 'Pulling':
+            pulling.append(event_time(e))
+        elif e.reason == 'Pulled' and pulling:
+            total += seconds(pulling.pop(0), event_time(e))
+    return total
+
+
+def pod_phases(pod, events) -> Dict[str, Optional[float]]:
+    'Scheduling, image pull, storage initializer and model load durations of `pod`'
+    scheduled = next((c.last_transition_time for c in pod.status.conditions or []
+                      if c.type == 'PodScheduled' and c.status == 'True'), None)
+
+    storage_initializer = 0
+    for container in pod.status.init_container_statuses or []:
+        terminated = container.state.terminated if container.state else None
+        if container.name == 'storage-initializer' and terminated:
+            storage_initializer = seconds(terminated.started_at, terminated.finished_at)
+
+    statuses = [c for c in pod.status.container_statuses or [] if c.name != 'queue-proxy']
+    predictor = next((c for c in statuses if c.name == PREDICTOR_CONTAINER), statuses[0] if statuses else None)
+    running = predictor.state.running if predictor and predictor.state else None
+
+    return {
+        'scheduling': seconds(pod.metadata.creation_timestamp, scheduled),
+        'image_pull': image_pull_seconds(events),
+        'storage_initializer': storage_initializer,
+        'model_load': seconds(running.started_at if running else None, pod_ready_time(pod))
+    }
+
+
+def phase_table(phases: Dict[str, Optional[float]], total: float) -> str:
+    rows = ['<tr><td>%s</td><td>%s</td></tr>' % (
+        name, '-' if phases.get(phase) is None else '%.1fs' % phases[phase]) for phase, name in PHASES]
+    rows.append('<tr><td><b>Total</b></td><td><b>%.1fs</b></td></tr>' % total)
+    return '<table><tr><td>Phase</td><td>Time</td></tr>%s</table>' % ''.join(rows)
+
+
+def default_history_path() -> Optional[str]:
+    'JSONL file (e.g. on volume shared between workflows) collecting deployment timings'
+    return os.environ.get('DEPLOYMENT_TIMING_PATH')
+
+
+def append_history(path: str, entry: Dict) -> None:
+    'Appends `entry` as a single line, deployments of all targets share the file'
+    with _history_lock:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Optional
+from urllib.parse import quote
+from urllib.request import urlopen
+from urllib.error import HTTPError
+
+from fastcore.net import urlrequest
+from fastcore.utils import dict2obj
+from ghapi.all import GhApi
+
+GH_HOST = os.environ.get('GH_HOST', 'https://api.github.com')
+CACHED_HEADERS = ['ETag', 'Last-Modified', 'Link']
+MUTATING_VERBS = ['POST', 'PATCH', 'PUT', 'DELETE']
+RATE_LIMIT_STATUSES = [403, 429]
+MAX_RATE_LIMIT_RETRIES = 3
+
+
+class ResponseCache(ABC):
+    '''
+    Stores last response (body and validators: ETag, Last-Modified) per request.
+    Used to send conditional requests, which GitHub doesn't count against the
+    rate limit when answered with "304 Not Modified".
+    '''
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, entry: Dict) -> None:
+        pass
+
+
+class MemoryResponseCache(ResponseCache):
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self.entries.get(key)
+
+    def set(self, key: str, entry: Dict) -> None:
+        self.entries[key] = entry
+
+
+class FileResponseCache(ResponseCache):
+    'Keeps one JSON file per request in `path` (e.g. on volume shared between workflows)'
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file_path(self, key: str) -> str:
+        return os.path.join(self.path, '%s.json' % key)
+
+    def get(self, key: str) -> Optional[Dict]:
+        try:
+            with open(self._file_path(key), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def set(self, key: str, entry: Dict) -> None:
+        # Write and rename, so concurrent readers never see partially written file
+        tmp_path = '%s.%s.tmp' % (self._file_path(key), os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self._file_path(key))
+
+
+def default_response_cache() -> ResponseCache:
+    cache_path = os.environ.get('GITHUB_CACHE_PATH')
+    return FileResponseCache(cache_path) if cache_path else MemoryResponseCache()
+
+
+def is_mutation(path: str, verb: str, data=None) -> bool:
+    'GraphQL queries are sent with POST as well, only GraphQL mutations create content'
+    if verb.upper() not in MUTATING_VERBS:
+        return False
+    if path.split('?')[0].rstrip('/').endswith('/graphql'):
+        query = data.get('query', '') if isinstance(data, dict) else ''
+        return query.lstrip().startswith('mutation')
+    return True
+
+
+class RateLimiter:
+    '''
+    Paces requests made with a single Github token. Remaining budget (`X-RateLimit-*`
+    response headers) is spread evenly until the limit resets: token bucket refilled at
+    `remaining / seconds to reset` tokens per second, allowing bursts of `burst` requests.
+
+    Content creating requests are serialized and spaced by `mutation_interval` seconds,
+    as recommended by Github to avoid secondary rate limits. All requests are paused
+    when Github rejects a request with `Retry-After` header or exhausted primary limit.
+    '''
+    def __init__(self, burst: int = 20, mutation_interval: float = 1.0):
+        self.logger = logging.getLogger('kfops')
+        self.burst = burst
+        self.mutation_interval = mutation_interval
+        self.tokens = burst
+        # Refill rate (tokens per second), unknown until first response
+        self.rate = None
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0
+        self.last_mutation = None
+        self.remaining = None
+        self.limit = None
+        self.reset = None
+        self.throttled_seconds = 0.0
+        self.rate_limited_responses = 0
+        self._lock = threading.Lock()
+        self._mutation_lock = threading.Lock()
+
+    def _sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+    def _reserve(self) -> float:
+        'Takes a token from the bucket and returns number of seconds to wait before request'
+        with self._lock:
+            now = time.monotonic()
+            if self.rate is not None:
+                self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            self.tokens -= 1
+
+            delay = max(self.blocked_until - now, 0)
+            if self.tokens < 0 and self.rate:
+                delay = max(delay, -self.tokens / self.rate)
+            return delay
+
+    def _wait(self, delay: float) -> None:
+        if delay > 0:
+            self.throttled_seconds += delay
+            self._sleep(delay)
+
+    @contextmanager
+    def request(self, verb: str, mutation: Optional[bool] = None):
+        '''Waits until request with HTTP method `verb` can be sent. Request is treated as
+        content creating if `mutation` is True (defaults to mutating HTTP methods).
+        '''
+        if mutation is None:
+            mutation = verb.upper() in MUTATING_VERBS
+        if not mutation:
+            self._wait(self._reserve())
+            yield
+            return
+
+        with self._mutation_lock:
+            delay = self._reserve()
+            if self.last_mutation is not None:
+                delay = max(delay, self.last_mutation + self.mutation_interval - time.monotonic())
+            self._wait(delay)
+            try:
+                yield
+            finally:
+                self.last_mutation = time.monotonic()
+
+    def update(self, headers) -> None:
+        'Reads remaining budget from response headers'
+        if not headers or 'X-RateLimit-Remaining' not in headers:
+            return
+        with self._lock:
+            self.remaining = int(headers['X-RateLimit-Remaining'])
+            self.limit = int(headers.get('X-RateLimit-Limit', self.remaining))
+            self.reset = int(headers.get('X-RateLimit-Reset', time.time()))
+            seconds_to_reset = max(self.reset - time.time(), 1)
+            self.rate = self.remaining / seconds_to_reset
+            if self.remaining == 0:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + seconds_to_reset)
+
+    def rate_limited(self, error: HTTPError) -> bool:
+        '''Returns True if request has been rejected by primary or secondary rate limit.
+        Following requests wait until the limit resets.
+        '''
+        headers = error.headers or {}
+        if error.code not in RATE_LIMIT_STATUSES:
+            return False
+        if headers.get('Retry-After') is not None:
+            delay = float(headers['Retry-After'])
+        elif headers.get('X-RateLimit-Remaining') == '0':
+            delay = max(int(headers.get('X-RateLimit-Reset', 0)) - time.time(), 1)
+        else:
+            # Forbidden for other reasons (e.g. missing permissions)
+            return False
+
+        with self._lock:
+            self.rate_limited_responses += 1
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        self.logger.warning('Github API rate limit exceeded, pausing requests for %ss' % round(delay))
+        return True
+
+    def metrics(self) -> Dict:
+        return {
+            'rate_limit_remaining': self.remaining,
+            'rate_limit_limit': self.limit,
+            'rate_limit_reset': self.reset,
+            'throttled_seconds': round(self.throttled_seconds, 3),
+            'rate_limited_responses': self.rate_limited_responses
+        }
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def shared_rate_limiter(token: Optional[str]) -> RateLimiter:
+    'Returns rate limiter shared by all clients using `token` (within the process)'
+    key = hashlib.sha256((token or '').encode()).hexdigest()
+    with _rate_limiters_lock:
+        if key not in _rate_limiters:
+            _rate_limiters[key] = RateLimiter()
+        return _rate_limiters[key]
+
+
+class GithubClient(GhApi):
+    '''
+    GhApi with conditional requests. GET responses are cached in `cache` and revalidated
+    with If-None-Match / If-Modified-Since headers. Number of requests answered from
+    the cache (304) is available in `cache_hits`, others in `cache_misses`.
+
+    Parameters:
+        cache: Response cache. Defaults to `FileResponseCache` if GITHUB_CACHE_PATH
+               environment variable is set, otherwise to in-memory cache.
+        gh_host: Github API URL (e.g. fake server in tests).
+        rate_limiter: Paces requests according to Github rate limits. Defaults to limiter
+                      shared by all clients using the same token.
+
+    Requests rejected by rate limits are retried (up to MAX_RATE_LIMIT_RETRIES times)
+    after the limit resets. Client can be shared between threads, `recv_hdrs` holds headers of the last response
+    received by the calling thread.
+    '''
+    def __init__(self, owner=None, repo=None, token=None, cache: Optional[ResponseCache] = None,
+                 gh_host: str = GH_HOST, rate_limiter: Optional[RateLimiter] = None, **kwargs):
+        self._local = threading.local()
+        super().__init__(owner=owner, repo=repo, token=token, **kwargs)
+        self.logger = logging.getLogger('kfops')
+        self.cache = cache if cache is not None else default_response_cache()
+        self.gh_host = gh_host
+        self.rate_limiter = rate_limiter or shared_rate_limiter(self.headers.get('Authorization'))
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @property
+    def recv_hdrs(self):
+        return getattr(self._local, 'recv_hdrs', None)
+
+    @recv_hdrs.setter
+    def recv_hdrs(self, headers):
+        self._local.recv_hdrs = headers
+
+    def _cache_key(self, url: str, headers: Dict) -> str:
+        key = '%s %s %s' % (url, headers.get('Accept'), headers.get('Authorization'))
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def __call__(self, path: str, verb: str = None, headers: Dict = None, route: Dict = None,
+                 query: Dict = None, data=None):
+        if verb is None:
+            verb = 'POST' if data else 'GET'
+        headers = {**self.headers, **(headers or {})}
+        if path[:7] not in ('http://', 'https:/'):
+            path = self.gh_host + path
+        if route:
+            # Same as GhApi, route params (e.g. label names) may contain spaces or '#'
+            route = {k: quote(str(v)) for k, v in route.items()}
+
+        request = urlrequest(path, verb, headers, route=route or None, query=query or None,
+                             data=data or None)
+        mutation = is_mutation(path, verb, data)
+
+        cache_key, cached = None, None
+        if verb.upper() == 'GET':
+            cache_key = self._cache_key(request.full_url, headers)
+            cached = self.cache.get(cache_key)
+            if cached:
+                if cached['headers'].get('ETag'):
+                    request.add_header('If-None-Match', cached['headers']['ETag'])
+                if cached['headers'].get('Last-Modified'):
+                    request.add_header('If-Modified-Since', cached['headers']['Last-Modified'])
+
+        try:
+            body, response_headers = self._send(request, verb, mutation)
+        except HTTPError as e:
+            if e.code != 304 or not cached:
+                raise
+            self.cache_hits += 1
+            self.recv_hdrs = e.headers
+            for header, value in cached['headers'].items():
+                if header not in self.recv_hdrs:
+                    self.recv_hdrs[header] = value
+            self._update_rate_limit()
+            return self._parse(cached['body'])
+
+        self.recv_hdrs = response_headers
+        self._update_rate_limit()
+
+        if cache_key:
+            self.cache_misses += 1
+            if response_headers.get('ETag') or response_headers.get('Last-Modified'):
+                self.cache.set(cache_key, {
+                    'headers': {h: response_headers[h] for h in CACHED_HEADERS if response_headers.get(h)},
+                    'body': body
+                })
+        return self._parse(body)
+
+    def _send(self, request, verb: str, mutation: bool):
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            with self.rate_limiter.request(verb, mutation):
+                try:
+                    with urlopen(request) as response:
+                        self.rate_limiter.update(response.headers)
+                        return response.read().decode(), response.headers
+                except HTTPError as e:
+                    self.rate_limiter.update(e.headers)
+                    if attempt == MAX_RATE_LIMIT_RETRIES or not self.rate_limiter.rate_limited(e):
+                        raise
+
+    def metrics(self) -> Dict:
+        'Remaining rate limit budget and request statistics'
+        return dict(self.rate_limiter.metrics(), cache_hits=self.cache_hits,
+                    cache_misses=self.cache_misses)
+
+    def _parse(self, body: str):
+        return dict2obj(json.loads(body)) if body else {}
+
+    def _update_rate_limit(self):
+        if 'X-RateLimit-Remaining' in self.recv_hdrs:
+            newlim = self.recv_hdrs['X-RateLimit-Remaining']
+            if self.limit_cb is not None and newlim != self.limit_rem:
+                self.limit_cb(int(newlim), int(self.recv_hdrs['X-RateLimit-Limit']))
+            self.limit_rem = newlim
@@ -3,6 +3,9 @@ import sys
 import re
 import yaml
 import json
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from kfp import Client
 from shutil import copyfile
 
@@ -10,11 +13,27 @@ from .config import set_config, Config
 default_config = set_config()
 
 from .pipeline_manager import PipelineBuilder, PipelineRunner
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
-from .kserve_deployer import IsvcDeployer
+from .kserve_deployer import IsvcDeployer, RawIsvcDeployer
 from .messengers import TerminalMessenger, VersionControlMessenger
 from .version_control_manager import GithubManager
+from .state_store import StateStore
+from .deployment_history import DeploymentHistory
+
+DeploymentTarget = namedtuple('DeploymentTarget', [
+    'namespace',
+    # Model variant settings (`deployment.variants` in config.yaml), None for the main model
+    'model'
+])
+
+DeploymentResult = namedtuple('DeploymentResult', [
+    'target',
+    'deployer',
+    # Seconds
+    'duration',
+    'error'
+])
 
 
 class BaseHandler:
@@ -29,15 +48,22 @@ class BaseHandler:
             exit(0)
 
     def exec_command(self):
-        if self.command == 'build':
-            self.build()
-        elif self.command == 'run':
-            self.run()
-        elif self.command == 'build_run':
-            self.build_run()
-        elif self.command == 'deploy' or self.command == 'staging_deploy':
-            environment = 'production' if self.command == 'deploy' else 'staging'
-            self.deploy(environment=environment)
+        try:
+            if self.command == 'build':
+                self.build()
+            elif self.command == 'run':
+                self.run()
+            elif self.command == 'build_run':
+                self.build_run()
+            elif self.command == 'deploy' or self.command == 'staging_deploy':
+                environment = 'production' if self.command == 'deploy' else 'staging'
+                self.deploy(environment=environment)
+            elif self.command == 'profile_deploy':
+                self.deploy(environment=self._profiling_environment(), profile=True)
+            elif self.command == 'rollback':
+                self.rollback()
+        finally:
+            self.messenger.flush()
 
     def build(self, build_only=True):
         pb = PipelineBuilder(client=self.client, config=self.config)
@@ -66,6 +92,7 @@ class BaseHandler:
             self.messenger.generic_error_message('Kubeflow pipeline run failed. Check run for defails.')
         else:
             self.messenger.pipeline_run_completed(run_id=run_id, run_time=results['run_time'])
+        return results
 
 
 class TerminalHandler(BaseHandler):
@@ -89,16 +116,35 @@ class VersionControlHandler(BaseHandler):
         self, client: Client, command: str, 
         pr_number: int, VCManager: 'VersionControlManager',
         command_params: Dict = {},
-        config: Config = default_config
+        config: Config = default_config,
+        state_store: Optional[StateStore] = None,
+        status_update_interval: float = 0,
+        deployment_history: Optional[DeploymentHistory] = None
     ) -> None:
 
         super().__init__(client, command, command_params, config)
         self.pr_number = pr_number
+        self.state_store = state_store
+        self.deployment_history = deployment_history
+        self._extracted_vars = None
 
         self.vc_manager = VCManager(self.pr_number)        
         self.messenger = VersionControlMessenger(
             issue_number=self.pr_number,
-            vc_manager=self.vc_manager)
+            vc_manager=self.vc_manager,
+            min_update_interval=status_update_interval)
+
+    def build(self, build_only=True):
+        pipeline_info = super().build(build_only=build_only)
+        if self.state_store:
+            self.state_store.set({'VERSION_ID': pipeline_info['version_id']})
+        return pipeline_info
+
+    def _wait_completed(self, run_data):
+        results = super()._wait_completed(run_data)
+        if self.state_store and results['run_status'] != 'Failed':
+            self.state_store.set({'RUN_ID': run_data['run_info'].id})
+        return results
 
     def run(self, version_id: Optional[str] = None):
         if not version_id:
@@ -124,11 +170,39 @@ class VersionControlHandler(BaseHandler):
                 '<code>&#47;deploy --force</code>')
 
     def _extract_vars(self, var_name):
-        extracted_vars = self.vc_manager.extract_hidden_variables(
-            variables=['VERSION_ID', 'RUN_ID'], prefix='KFOPS')
-        return extracted_vars.get(var_name)
+        if self.state_store:
+            value = self.state_store.get(var_name)
+            if value:
+                return value
+
+        # Fallback for Pull Requests created before state store was introduced.
+        # Variables found in PR comments and missing from the store are migrated into it.
+        if self._extracted_vars is None:
+            self._extracted_vars = self.vc_manager.extract_hidden_variables(
+                variables=['VERSION_ID', 'RUN_ID'], prefix='KFOPS')
+            if self.state_store:
+                missing = {name: value for name, value in self._extracted_vars.items()
+                           if not self.state_store.get(name)}
+                if missing:
+                    self.state_store.set(missing)
+        return self._extracted_vars.get(var_name)
+
+    def _profiling_environment(self) -> str:
+        '''
+        Environment of /profile_deploy: --env parameter, deployment.profiling.environment
+        or staging if configured (production otherwise)
+        '''
+        deployment = self.config.deployment or {}
+        environment = self.command_params.get('env') or \
+            (deployment.get('profiling') or {}).get('environment')
+        if not environment:
+            environment = 'staging' if deployment.get('staging') else 'production'
+        if environment not in ('staging', 'production'):
+            self.messenger.generic_error_message(
+                'Unknown environment "%s". Use --env=staging or --env=production.' % environment)
+        return environment
 
-    def deploy(self, environment: str):
+    def deploy(self, environment: str, profile: bool = False):
         run_id = self.command_params.get('run-id')
 
         if not run_id:
@@ -143,7 +217,8 @@ class VersionControlHandler(BaseHandler):
                 'Could not find deployment settings in config.yaml. Stopping deployment.')
 
         # TODO: Check if RUN ID extist in Kubeflow and report error if doesn't
-        namespace = self.config.deployment.get(environment, {}).get('namespace')
+        environment_settings = self.config.deployment.get(environment, {})
+        namespace = environment_settings.get('namespace')
         if not namespace:
             self.messenger.generic_error_message(
                 'Namespace not defined in deployment settings (config.yaml). Stopping deployment.')
@@ -169,25 +244,151 @@ class VersionControlHandler(BaseHandler):
         else:
             sample_input = None
 
-        deployer = IsvcDeployer(run_id, namespace, config=self.config, sample_input=sample_input)
-        deployer.deploy()
-        if deployer.error:
-            self.messenger.generic_error_message(deployer.error)
+        namespaces = [namespace] + list(environment_settings.get('additional_namespaces') or [])
+        targets = self._deployment_targets(namespaces)
+
+        results = self._deploy_targets(run_id, targets, environment, sample_input=sample_input, profile=profile)
+        tuning = [r.deployer.batcher_tuning for r in results if r.deployer.batcher_tuning]
+        if tuning and self.state_store:
+            self.state_store.set({'BATCHER_TUNING': json.dumps(self._batcher_tuning_results(tuning))})
+
+        failed = [r for r in results if r.error]
+        if failed:
+            if len(results) == 1:
+                self.messenger.generic_error_message(failed[0].error)
+            else:
+                self.messenger.generic_error_message(
+                    'Deployment of model from RUN_ID: %s failed for %s of %s targets:<br/>%s' % (
+                        run_id, len(failed), len(results), self._deployment_summary(results)))
+            return
+
+        if len(results) == 1:
+            self.messenger.generic_message(
+                '<br/>'.join(['Model from RUN_ID: %s has been successfuly deployed to namespace: %s' %
+                              (run_id, namespace)] + results[0].deployer.reports))
+        else:
+            self.messenger.generic_message(
+                'Model from RUN_ID: %s has been successfuly deployed to %s targets:<br/>%s' % (
+                    run_id, len(results), self._deployment_summary(results)))
+
+        # PR is labelled only when the model has been deployed to every target
+        for n in namespaces:
+            self.vc_manager.add_label('Deployed-to-%s' % n)
+
+        if environment == 'production':
+            if not self.vc_manager.is_pr_mergeable():
+                self.messenger.generic_error_message('PR is not mergeable. Fix merge conflicts and try again.')
+
+            merge_ok, err = self.vc_manager.merge_pr()
+            if not merge_ok:
+                self.messenger.generic_error_message('Failed while trying to merge PR: %s' % err)
+
+            close_pr_ok, err = self.vc_manager.close_pr()
+            if not close_pr_ok:
+                self.messenger.generic_error_message('Failed while trying to close PR: %s' % err)
+
+    def rollback(self):
+        '''Routes production traffic back to the previously deployed model (or to the model
+        from `--run-id`) in every production namespace and variant.
+        '''
+        if not self.config.deployment:
+            self.messenger.generic_error_message(
+                'Could not find deployment settings in config.yaml. Stopping rollback.')
+
+        environment_settings = self.config.deployment.get('production', {})
+        namespace = environment_settings.get('namespace')
+        if not namespace:
+            self.messenger.generic_error_message(
+                'Namespace not defined in deployment settings (config.yaml). Stopping rollback.')
+
+        namespaces = [namespace] + list(environment_settings.get('additional_namespaces') or [])
+        run_id = self.command_params.get('run-id')
+        results = self._deploy_targets(run_id, self._deployment_targets(namespaces), 'production', rollback=True)
+
+        failed = [r for r in results if r.error]
+        if failed:
+            if len(results) == 1:
+                self.messenger.generic_error_message(failed[0].error)
+            else:
+                self.messenger.generic_error_message(
+                    'Rollback failed for %s of %s targets:<br/>%s' % (
+                        len(failed), len(results), self._deployment_summary(results, status='Rolled back')))
+            return
+
+        if len(results) == 1:
+            self.messenger.generic_message(
+                '<br/>'.join(['Model in namespace: %s has been rolled back to RUN_ID: %s' %
+                              (namespace, results[0].deployer.run_id)] + results[0].deployer.reports))
         else:
             self.messenger.generic_message(
-                'Model from RUN_ID: %s has been successfuly deployed to namespace: %s' %
-                (run_id, namespace))
-            
-            self.vc_manager.add_label('Deployed-to-%s' % namespace)
-            
-            if environment == 'production':
-                if not self.vc_manager.is_pr_mergeable():
-                    self.messenger.generic_error_message('PR is not mergeable. Fix merge conflicts and try again.')
-
-                merge_ok, err = self.vc_manager.merge_pr()
-                if not merge_ok:
-                    self.messenger.generic_error_message('Failed while trying to merge PR: %s' % err)
-
-                close_pr_ok, err = self.vc_manager.close_pr()
-                if not close_pr_ok:
-                    self.messenger.generic_error_message('Failed while trying to close PR: %s' % err)
+                'Model has been rolled back in %s targets:<br/>%s' % (
+                    len(results), self._deployment_summary(results, status='Rolled back')))
+
+    def _deployment_targets(self, namespaces: List[str]) -> List[DeploymentTarget]:
+        'Every model variant (`deployment.variants`) in every namespace'
+        models = [None] + list(self.config.deployment.get('variants') or [])
+        return [DeploymentTarget(n, m) for n in namespaces for m in models]
+
+    def _deploy_targets(self, run_id: Optional[str], targets: List[DeploymentTarget], environment: str,
+                        sample_input: Optional[Dict] = None, profile: bool = False,
+                        rollback: bool = False) -> List[DeploymentResult]:
+        '''Deploys the model (or rolls it back) to all targets, at most
+        `deployment.max_parallel_deployments` (default: 4) at a time. Failure of one
+        target doesn't stop the others. Deployment history is kept for production only,
+        the only environment /rollback supports.
+        '''
+        history = self.deployment_history if environment == 'production' else None
+
+        def create_deployer(target):
+            # Serving mode of the variant defaults to `deployment.mode`
+            mode = (target.model or {}).get('mode') or self.config.deployment.get('mode')
+            deployer_class = RawIsvcDeployer if mode == 'raw' else IsvcDeployer
+            return deployer_class(run_id, target.namespace, config=self.config, sample_input=sample_input,
+                                  profile=profile, model=target.model, history=history)
+
+        # Deployers (and inference service functions) are loaded one by one, imports aren't thread safe
+        deployers = [create_deployer(t) for t in targets]
+
+        def deploy(target, deployer):
+            start = time.monotonic()
+            try:
+                if rollback:
+                    deployer.rollback(run_id)
+                else:
+                    deployer.deploy()
+                error = deployer.error
+            except Exception as e:
+                error = '%s failed with exception: %s' % ('Rollback' if rollback else 'Deployment', e)
+            return DeploymentResult(target, deployer, time.monotonic() - start, error)
+
+        max_workers = self.config.deployment.get('max_parallel_deployments', 4)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(deploy, targets, deployers))
+
+    def _batcher_tuning_results(self, tuning: List[Dict]) -> Dict:
+        '''Stored batcher tuning results extended with `tuning`, keyed by
+        "<namespace>/<inference service name>/<RUN_ID>"
+        '''
+        try:
+            results = json.loads(self.state_store.get('BATCHER_TUNING') or '{}')
+        except ValueError:
+            results = {}
+        if 'trials' in results:
+            # Single result stored by previous versions
+            results = {'%s/%s/%s' % (results.get('namespace'), results.get('inference_service_name'),
+                                     results.get('run_id')): results}
+        for t in tuning:
+            results['%s/%s/%s' % (t['namespace'], t['inference_service_name'], t['run_id'])] = t
+        return results
+
+    def _deployment_summary(self, results: List[DeploymentResult], status: str = 'Deployed') -> str:
+        rows = ['<tr><td>Namespace</td><td>InferenceService</td><td>Status</td><td>Time</td></tr>']
+        details = []
+        for r in results:
+            name = r.deployer.inference_service_name
+            rows.append('<tr><td>%s</td><td>%s</td><td>%s</td><td>%.0fs</td></tr>' % (
+                r.target.namespace, name, 'Failed' if r.error else status, r.duration))
+            messages = [r.error] if r.error else r.deployer.reports
+            if messages:
+                details.append('<b>%s/%s</b><br/>%s' % (r.target.namespace, name, '<br/>'.join(messages)))
+        return '<br/>'.join(['<table>%s</table>' % ''.join(rows)] + details)
@@ -66,10 +66,17 @@ def merge_parameters(params_list):
 def parse_pr_comment(comment):
     '''
     Parse comment sent from Pull Request
+
+    Usage:
+        /build, /run, /build_run
+        /deploy [--run-id=<run_id>] [--force]
+        /staging_deploy [--run-id=<run_id>] [--force]
+        /profile_deploy [--run-id=<run_id>] [--env=<staging|production>] [--force]
+        /rollback [--run-id=<run_id>]
     '''
     comment = comment.replace('\r', '')
     
-    commands = ['build_run', 'build', 'run', 'staging_deploy', 'deploy']
+    commands = ['build_run', 'build', 'run', 'staging_deploy', 'profile_deploy', 'deploy', 'rollback']
 
     pattern = re.compile(r"^.*?(:?%s)(:?\s|\r?\n?|.+?)$" % "|".join(['/' + c for c in commands]), re.MULTILINE)
     command, command_params = re.findall(pattern, comment)[0]
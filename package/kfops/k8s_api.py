@@ -27,6 +27,7 @@ def setup_k8s_api():
 
 k8s_client = setup_k8s_api()
 v1_api = k8s_client.api.core_v1_api.CoreV1Api()
+batch_v1_api = k8s_client.BatchV1Api()
 
 def create_pod(pod_manifest, namespace):
     resp = v1_api.create_namespaced_pod(body=pod_manifest, namespace=namespace)
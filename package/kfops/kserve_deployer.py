@@ -1,97 +1,526 @@
 import sys
 import os
+import json
+import time
+import hashlib
+import threading
+import importlib.util
+import multiprocessing
 import yaml
 import requests
 import logging
-from time import sleep
-from typing import Callable, Optional, Dict
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional, Dict, List
 from requests.exceptions import HTTPError, ConnectTimeout, ConnectionError
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+from kubernetes.utils import parse_quantity
 from kserve import KServeClient
 from kserve import V1beta1InferenceService
+from kserve import V1beta1Batcher
+from kserve import constants as kserve_constants
 
 from .config import set_config, Config
+from .deployment_history import DeploymentHistory
+from .model_storage import model_storage, ModelStorageException
+from .deployment_timing import pod_phases, pod_ready_time, seconds, phase_table, default_history_path, \
+    append_history
+from .serving_metrics import metrics_source, check_revision_metrics, MetricsSourceException
+from .load_test import LoadTester, load_samples, check_thresholds, report_table, \
+    compare_latency, is_regression, comparison_table, warm_up, concurrency_sweep, find_knee, \
+    recommend_autoscaling, sweep_table, recommendation_table, DEFAULT_CONCURRENCY_LEVELS, \
+    summary, BatcherTrial, select_batcher, batcher_table
 default_config = set_config()
 
-def read_function_from_file(file_path, function_name='inference_service_instance'):
-    sys.path.insert(0, os.path.dirname(file_path))
-    try:
-        filename = os.path.basename(file_path)
+# Loaded inference service function modules: absolute path -> (mtime, digest of content, module)
+_modules = {}
+_modules_lock = threading.Lock()
 
-        try:
-            module = __import__(os.path.splitext(filename)[0])
-        except ModuleNotFoundError as e:
-            msg = 'Invalid deployment setup. Make sure config.yaml has ' +\
-                  '"inference_service_function_path" set and it is pointing at file ' +\
-                  'with function "inference_service_instance" implementation'
-            raise ModuleNotFoundError(msg)
 
+def load_module(file_path: str):
+    '''Loads Python file as a module named after its path and content, so files with the same
+    name (e.g. `deployment.py` of different repositories) never shadow each other. Module is
+    loaded again only when the file changes.
+    '''
+    path = os.path.abspath(file_path)
+    with _modules_lock:
+        mtime = os.stat(path).st_mtime_ns
+        cached = _modules.get(path)
+        if cached and cached[0] == mtime:
+            return cached[2]
+
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        if cached and cached[1] == digest:
+            _modules[path] = (mtime, digest, cached[2])
+            return cached[2]
+
+        module_name = 'kfops_isvc_%s' % hashlib.sha256((path + digest).encode()).hexdigest()[:16]
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        # Modules next to the file can be imported by it
+        sys.path.insert(0, os.path.dirname(path))
         try:
-            func = getattr(module, function_name)
-        except AttributeError as e:
-            msg = 'Invalid deployment setup. Make sure deployment ' +\
-                  'function in is called "inference_service_instance"'
-            raise AttributeError(msg)
-        return func
+            spec.loader.exec_module(module)
+        finally:
+            sys.path.remove(os.path.dirname(path))
+        sys.modules[module_name] = module
+        _modules[path] = (mtime, digest, module)
+        return module
+
+
+def _load_function(file_path: str, function_name: str) -> Callable:
+    try:
+        module = load_module(file_path)
+    except FileNotFoundError as e:
+        msg = 'Invalid deployment setup. Make sure config.yaml has ' +\
+              '"inference_service_function_path" set and it is pointing at file ' +\
+              'with function "inference_service_instance" implementation'
+        raise ModuleNotFoundError(msg)
+
+    try:
+        return getattr(module, function_name)
+    except AttributeError as e:
+        msg = 'Invalid deployment setup. Make sure deployment ' +\
+              'function in is called "inference_service_instance"'
+        raise AttributeError(msg)
+
+
+def _call_and_send(file_path, function_name, args, kwargs, connection):
+    try:
+        func = _load_function(file_path, function_name)
+        connection.send((True, func(*args, **kwargs)))
+    except Exception as e:
+        connection.send((False, e))
     finally:
-        del sys.path[0]
+        connection.close()
+
+
+def isolated(file_path: str, function_name: str) -> Callable:
+    '''Calls function `function_name` of file `file_path` in a separate process, so side effects
+    of user code (global state, monkey patching, leaked resources) stay out of kfops process.
+    Processes are started by a forkserver (kfops runs deployments in threads, forking it isn't
+    safe) and load the file themselves. Result has to be picklable.
+    '''
+    def wrapper(*args, **kwargs):
+        context = multiprocessing.get_context('forkserver')
+        # Forkserver imports kfops once, processes forked from it don't import it again
+        context.set_forkserver_preload([__name__])
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_call_and_send, daemon=True,
+                                  args=(file_path, function_name, args, kwargs, sender))
+        process.start()
+        sender.close()
+        try:
+            ok, result = receiver.recv()
+        except EOFError:
+            process.join()
+            raise RuntimeError('Process calling %s exited with code %s' % (function_name, process.exitcode))
+        process.join()
+        if not ok:
+            raise result
+        return result
+    wrapper.__name__ = function_name
+    return wrapper
+
+
+def read_function_from_file(file_path, function_name='inference_service_instance', isolate: bool = False):
+    if isolate:
+        # User code is loaded only by the isolated process, missing file is reported right away
+        if not os.path.isfile(file_path):
+            _load_function(file_path, function_name)
+        return isolated(os.path.abspath(file_path), function_name)
+    return _load_function(file_path, function_name)
+
+
+READY_TIMEOUT = 600
+REPLICAS_TIMEOUT = 300
+# How often pods are checked when InferenceService status doesn't change
+POD_CHECK_INTERVAL = 10
+# Container states after which revision won't become ready without user intervention
+TERMINAL_REASONS = [
+    'ErrImagePull', 'ImagePullBackOff', 'InvalidImageName', 'CrashLoopBackOff',
+    'CreateContainerConfigError', 'CreateContainerError', 'RevisionFailed'
+]
+# Deployment mode annotation of InferenceService and its value selecting raw deployment mode
+DEPLOYMENT_MODE_ANNOTATION = 'serving.kserve.io/deploymentMode'
+RAW_DEPLOYMENT = 'RawDeployment'
+# Annotation of InferenceService recording autoscaling settings applied by /profile_deploy
+PROFILED_AUTOSCALING_ANNOTATION = 'kfops/profiled-autoscaling'
+# Predictor attributes set by profiling
+AUTOSCALING_ATTRIBUTES = ['container_concurrency', 'scale_metric', 'scale_target', 'min_replicas', 'max_replicas']
+# Shadow InferenceService testing the new model in raw deployment mode is named `<name><suffix>`
+CANDIDATE_SUFFIX = '-candidate'
+ROLLOUT_CHECK_INTERVAL = 2
+
+
+ReplicaStartup = namedtuple('ReplicaStartup', [
+    'replicas',
+    # Average seconds spent by storage initializer (model download) and from pod creation to ready
+    'download_seconds',
+    'ready_seconds'
+])
+
+
+class IsvcNotReadyException(Exception):
+    pass
+
+
+# Fields of InferenceService spec filled in by KServe when not set, with their default values
+CLUSTER_DEFAULTS = {
+    'name': 'kserve-container',
+    'protocolVersion': 'v1',
+    'minReplicas': 1,
+    'resources': {'requests': {'cpu': '1', 'memory': '2Gi'}, 'limits': {'cpu': '1', 'memory': '2Gi'}}
+}
+
+
+def is_equivalent(desired, live) -> bool:
+    '''True if `desired` and `live` have the same fields with the same values. Fields not set
+    (missing, None or empty string) in `desired` have to be unset in `live` too, unless live value
+    is the cluster default (`CLUSTER_DEFAULTS`). Quantities are compared by value (e.g. 0.5 and "500m").
+    '''
+    if isinstance(desired, dict) or isinstance(live, dict):
+        if not isinstance(desired, dict) or not isinstance(live, dict):
+            return False
+        desired = {k: v for k, v in desired.items() if v not in (None, '')}
+        live = {k: v for k, v in live.items() if v not in (None, '')}
+        for k in set(desired) | set(live):
+            if k not in desired:
+                if k not in CLUSTER_DEFAULTS or not is_equivalent(CLUSTER_DEFAULTS[k], live[k]):
+                    return False
+            elif not is_equivalent(desired[k], live.get(k)):
+                return False
+        return True
+    if isinstance(desired, list):
+        return isinstance(live, list) and len(desired) == len(live) and \
+            all(is_equivalent(d, l) for d, l in zip(desired, live))
+    if isinstance(desired, bool) or isinstance(live, bool):
+        return desired is live
+    if desired == live:
+        return True
+    try:
+        return parse_quantity(str(desired)) == parse_quantity(str(live))
+    except (ValueError, TypeError):
+        return False
+
+
+def predictor_name(isvc_name: str) -> str:
+    'Name of Deployment and Service of the predictor in raw deployment mode'
+    return '%s-predictor' % isvc_name
+
+
+def is_rolled_out(deployment) -> bool:
+    'All replicas of Deployment run its latest spec and are available (as in `kubectl rollout status`)'
+    status = deployment.status
+    replicas = deployment.spec.replicas if deployment.spec.replicas is not None else 1
+    updated = status.updated_replicas or 0
+    return (status.observed_generation or 0) >= (deployment.metadata.generation or 0) and \
+        updated >= replicas and (status.replicas or 0) <= updated and \
+        (status.available_replicas or 0) >= updated
+
+
+def replica_startup(pods) -> Optional[ReplicaStartup]:
+    'Average startup times of ready pods, None if there are none'
+    downloads, ready = [], []
+    for pod in pods:
+        ready_at = next((c.last_transition_time for c in pod.status.conditions or []
+                         if c.type == 'Ready' and c.status == 'True'), None)
+        if not ready_at:
+            continue
+        ready.append((ready_at - pod.metadata.creation_timestamp).total_seconds())
+        download = 0
+        for container in pod.status.init_container_statuses or []:
+            terminated = container.state.terminated if container.state else None
+            if container.name == 'storage-initializer' and terminated:
+                download = (terminated.finished_at - terminated.started_at).total_seconds()
+        downloads.append(download)
+    if not ready:
+        return None
+    return ReplicaStartup(len(ready), sum(downloads) / len(downloads), sum(ready) / len(ready))
+
+
+def traffic_percent(spec: Dict) -> int:
+    'Percent of traffic routed to the latest revision'
+    percent = spec.get('predictor', {}).get('canaryTrafficPercent')
+    return 100 if percent is None else percent
+
+
+def without_traffic(spec: Dict) -> Dict:
+    predictor = {k: v for k, v in spec.get('predictor', {}).items() if k != 'canaryTrafficPercent'}
+    return dict(spec, predictor=predictor)
+
+
+class IsvcReadinessWatcher:
+    '''
+    Waits until InferenceService (and its latest Knative revision) is ready by watching it,
+    returns as soon as it reports "Ready". Fails fast if pods of the new revision
+    can't start (image pull errors, crash loops). Status changes seen while waiting
+    are kept in `events`.
+    '''
+    def __init__(self, kfs: KServeClient, name: str, namespace: str, timeout: int = READY_TIMEOUT,
+                 pod_selector: Optional[str] = None, replaced_revision: Optional[str] = None):
+        self.kfs = kfs
+        self.name = name
+        self.namespace = namespace
+        self.timeout = timeout
+        # Label selector of checked pods, defaults to pods of the latest revision
+        self.pod_selector = pod_selector
+        # Latest revision before the spec was replaced, its status is not relevant
+        self.replaced_revision = replaced_revision
+        self.events = []
+        self.revision = None
+        # Last seen state of InferenceService
+        self.isvc = None
+        self._seen_conditions = set()
+
+    def _record(self, message: str) -> None:
+        self.events.append('%s %s' % (datetime.utcnow().strftime('%H:%M:%S'), message))
+
+    def check(self, isvc: Dict) -> bool:
+        '''Returns True if InferenceService is ready.
+        Raises IsvcNotReadyException if it's not going to become ready.
+        '''
+        self.isvc = isvc
+        metadata, status = isvc.get('metadata', {}), isvc.get('status', {})
+        # Status of the previous spec (e.g. right after replace) is not relevant. Without
+        # observedGeneration, status is new once the replaced spec created another revision.
+        latest_revision = status.get('components', {}).get('predictor', {}).get('latestCreatedRevision')
+        observed_generation = status.get('observedGeneration')
+        if observed_generation is not None:
+            if observed_generation < metadata.get('generation', 0):
+                return False
+        elif self.replaced_revision and latest_revision in (None, self.replaced_revision):
+            return False
+
+        self.revision = latest_revision or self.revision
+
+        conditions = {c['type']: c for c in status.get('conditions', [])}
+        for c in conditions.values():
+            key = (c['type'], c['status'], c.get('reason'))
+            if key not in self._seen_conditions:
+                self._seen_conditions.add(key)
+                self._record('%s=%s %s %s' % (
+                    c['type'], c['status'], c.get('reason') or '', c.get('message') or ''))
+
+        if conditions.get('Ready', {}).get('status') == 'True':
+            return True
+
+        for c in conditions.values():
+            if c['status'] == 'False' and c.get('reason') in TERMINAL_REASONS:
+                raise IsvcNotReadyException('%s: %s' % (c['reason'], c.get('message')))
+
+        self.check_pods()
+        return False
+
+    def check_pods(self) -> None:
+        'Raises IsvcNotReadyException if any container of the latest revision is in terminal state'
+        selector = self.pod_selector
+        if not selector and self.revision:
+            selector = 'serving.knative.dev/revision=%s' % self.revision
+        if not selector:
+            return
+        pods = self.kfs.core_api.list_namespaced_pod(self.namespace, label_selector=selector)
+        for pod in pods.items:
+            statuses = (pod.status.init_container_statuses or []) + (pod.status.container_statuses or [])
+            for container in statuses:
+                waiting = container.state.waiting if container.state else None
+                if waiting and waiting.reason in TERMINAL_REASONS:
+                    self._record('Pod %s, container %s: %s' % (
+                        pod.metadata.name, container.name, waiting.reason))
+                    raise IsvcNotReadyException('Container "%s" of pod %s: %s %s' % (
+                        container.name, pod.metadata.name, waiting.reason, waiting.message or ''))
+
+    def kubernetes_events(self) -> List[str]:
+        'Warning events of InferenceService and its latest revision'
+        events = []
+        for name in [self.name, self.revision]:
+            if not name:
+                continue
+            res = self.kfs.core_api.list_namespaced_event(
+                self.namespace, field_selector='involvedObject.name=%s,type=Warning' % name)
+            events += ['%s %s: %s' % (e.involved_object.kind, e.reason, e.message) for e in res.items]
+        return events
+
+    def wait(self) -> None:
+        deadline = time.monotonic() + self.timeout
+        w = watch.Watch()
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise IsvcNotReadyException(
+                    'Timed out waiting for deployment becoming ready (%ss)' % self.timeout)
+
+            for event in w.stream(
+                    self.kfs.api_instance.list_namespaced_custom_object,
+                    kserve_constants.KSERVE_GROUP, kserve_constants.KSERVE_V1BETA1_VERSION,
+                    self.namespace, kserve_constants.KSERVE_PLURAL,
+                    field_selector='metadata.name=%s' % self.name,
+                    timeout_seconds=max(int(min(POD_CHECK_INTERVAL, remaining)), 1)):
+                if self.check(event['object']):
+                    w.stop()
+                    return
+            # No status change within interval, pods can still be crash looping
+            self.check_pods()
 
 
 class IsvcDeployer:
     def __init__(self, run_id: str, namespace: str, config: Config = default_config,
-                 sample_input: Optional[Dict] = None):
+                 sample_input: Optional[Dict] = None, profile: bool = False, model: Optional[Dict] = None,
+                 history: Optional[DeploymentHistory] = None):
         self.logger = logging.getLogger('kfops')
         self.config = config                 
+        # Model variant (`deployment.variants` in config.yaml), defaults to the main model
+        model = model or self.config.deployment
         self.isvc_func = read_function_from_file(
-            self.config.deployment.inference_service_function_path)
-        self.inference_service_name = self.config.deployment.inference_service_name
+            model.get('inference_service_function_path', self.config.deployment.inference_service_function_path),
+            isolate=self.config.deployment.get('isolate_inference_service_function', False))
+        self.inference_service_name = model.inference_service_name
 
         self.run_id = run_id
         self.namespace = namespace
         self.sample_input = sample_input
+        # Profile the new model and recommend autoscaling settings (/profile_deploy)
+        self.profile = profile
+        # Predictor attributes overriding those set by inference service function
+        # (autoscaling settings from profiling, batcher selected by tuning)
+        self.predictor_overrides = {}
+        # Autoscaling settings applied by earlier /profile_deploy, kept by later deployments
+        # unless set by inference service function
+        self.profiled_autoscaling = {}
+        # Results of batcher tuning, recorded per model version (RUN_ID)
+        self.batcher_tuning = None
+        # Last seen state of InferenceService, see `isvc`
+        self._isvc = None
+        # Latest revision before the last replace, until readiness of the new spec is waited for
+        self._replaced_revision = None
+        # Revisions serving each RUN_ID, used by `rollback`
+        self.history = history
+        self.model_storage = model_storage(self.config.deployment.get('model_storage'), namespace)
+        # When deployment started, new revision became ready, checks finished and deployment finished
+        self.timestamps = {}
 
         self._error = None
+        # Deployment details (e.g. load test results) reported together with deployment status
+        self.reports = []
         self.kfs = KServeClient()
 
     @property
     def error(self):
         return self._error
 
-    def get_isvc(self, canary_traffic_percent=None):
+    def get_isvc(self, canary_traffic_percent=None, name: Optional[str] = None):
         try:
             isvc = self.isvc_func(
-                name=self.inference_service_name,
-                storage_uri='s3://trained-models/%s/' % self.run_id,
+                name=name or self.inference_service_name,
+                storage_uri=self.model_storage.storage_uri(self.run_id),
                 canary_traffic_percent=canary_traffic_percent,
                 namespace=self.namespace)
-            return isvc
         except TypeError as e:
             error_msg = 'Invalid deployment setup. Make sure your function ' +\
                         '"inference_service_instance" has valid parameters. Exception details: %s'
             raise TypeError(error_msg % e)
 
+        profiled = {attr: value for attr, value in self.profiled_autoscaling.items()
+                    if getattr(isvc.spec.predictor, attr, None) is None}
+        profiled.update({attr: value for attr, value in self.predictor_overrides.items()
+                         if attr in AUTOSCALING_ATTRIBUTES})
+        for attr, value in dict(profiled, **self.predictor_overrides).items():
+            setattr(isvc.spec.predictor, attr, value)
+        if profiled:
+            isvc.metadata.annotations = dict(getattr(isvc.metadata, 'annotations', None) or {}, **{
+                PROFILED_AUTOSCALING_ANNOTATION: json.dumps(profiled, sort_keys=True)})
+        return isvc
+
+    def restore_profiled_autoscaling(self) -> None:
+        'Reads autoscaling settings applied by earlier /profile_deploy from the live InferenceService'
+        metadata = self.isvc.get('metadata', {}) if isinstance(self.isvc, dict) else {}
+        annotations = metadata.get('annotations') or {}
+        try:
+            profiled = json.loads(annotations.get(PROFILED_AUTOSCALING_ANNOTATION) or '{}')
+        except ValueError:
+            self.logger.warning('Ignoring invalid annotation %s of InferenceService %s' %
+                                (PROFILED_AUTOSCALING_ANNOTATION, self.inference_service_name))
+            return
+        self.profiled_autoscaling = {k: v for k, v in profiled.items() if k in AUTOSCALING_ATTRIBUTES}
+
     def deploy(self):
-        if self.check_isvc_exists():
-            self.replace_isvc()
-        else:
+        self.mark('started')
+        self.restore_profiled_autoscaling()
+        self.check_warmup_replicas()
+        if self.error:
+            return
+        self.stage_model()
+        if self.error:
+            return
+
+        created = not self.check_isvc_exists()
+        if created:
             isvc = self.get_isvc()
-            res = self.kfs.create(isvc, namespace=self.namespace)
+            self._isvc = self.kfs.create(isvc, namespace=self.namespace)
             self.wait_ready()
+            self.mark('revision_ready')
+            self.record_deployment(previous_revision=None)
+        elif self.is_up_to_date():
+            self.logger.info('InferenceService %s already serves the model, skipping rollout' %
+                             self.inference_service_name)
+            self.reports.append('Model is already deployed, InferenceService has not been changed.')
+        else:
+            previous_revision = self.get_rolled_out_revision()
+            startup = self.replica_startup(previous_revision) \
+                if self.config.deployment.get('model_storage') else None
+            self.replace_isvc()
+            self.record_deployment(previous_revision)
+            self.report_replica_startup(startup)
+            self.report_deployment_phases()
+            return
+
+        # New InferenceService (or unchanged one) is profiled while serving traffic
+        if self.profile and not self.error:
+            revision = self.get_latest_revision()
+            self.profile_autoscaling(revision, self.private_url(revision))
+            if self.predictor_overrides and not self.error and self.apply(self.get_isvc()):
+                self.wait_ready()
+
+        if created:
+            self.report_deployment_phases()
 
     def replace_isvc(self):
+        # Revision serving traffic before the new one is rolled out
+        current_revision = self.get_rolled_out_revision()
+
         isvc = self.get_isvc(canary_traffic_percent=0)
-        res = self.kfs.replace(self.inference_service_name, isvc)
+        self.apply(isvc)
         self.wait_ready()
 
         if self.error:
             return
+        self.mark('revision_ready')
 
-        if self.sample_input:
-            self.logger.info('Testing endpoint with sample input: %s' % self.sample_input)
+        self.test_model(self.get_latest_revision(), current_revision)
+        if self.error:
+            return
+        self.mark('checks_done')
 
-            revision = self.get_latest_revision()
-            url = 'http://%s-private.%s.svc.cluster.local/v1/models/%s:predict' % \
-                (revision, self.namespace, self.inference_service_name)
+        canary = self.config.deployment.get('canary')
+        if canary:
+            self.progressive_rollout(canary)
+        else:
+            self.set_traffic(100)
 
+    def test_model(self, revision: str, current_revision: Optional[str]) -> None:
+        '''Checks the new model (`revision`, not serving traffic yet) with sample input, load test,
+        latency comparison with `current_revision`, warmup and profiling, as configured.
+        '''
+        load_test = self.config.deployment.get('load_test')
+        latency_comparison = self.config.deployment.get('latency_comparison')
+        warmup = self.config.deployment.get('warmup')
+        batcher_tuning = self.config.deployment.get('batcher_tuning')
+        url = self.private_url(revision)
+
+        if self.sample_input:
+            self.logger.info('Testing endpoint with sample input: %s' % self.sample_input)
             self.logger.info('Test sample input on revision: %s. Endpoint: %s' % (revision, url))
 
             try:
@@ -103,42 +532,739 @@ class IsvcDeployer:
             if self.error:
                 return
 
-            if resp.status_code == 200:
-                isvc = self.get_isvc(canary_traffic_percent=100)
-                res = self.kfs.replace(self.inference_service_name, isvc)
-                self.wait_ready()
-            else:
+            if resp.status_code != 200:
                 self._error = 'New model is deployed (with traffic 0%) ' +\
                     'but test sample failed with status: ' +\
                     '%s.<br/>Response: <br/> %s' % (resp.status_code, resp.text)
+                return
+
+        if batcher_tuning:
+            revision = self.tune_batcher(revision, batcher_tuning)
+            if self.error:
+                return
+            url = self.private_url(revision)
+
+        if load_test:
+            self.run_load_test(url, load_test)
+            if self.error:
+                return
+
+        if latency_comparison and current_revision and current_revision != revision:
+            self.compare_latency(self.private_url(current_revision), url, latency_comparison)
+            if self.error:
+                return
+
+        if warmup:
+            self.warm_up(revision, url, warmup)
+            if self.error:
+                return
+
+        if self.profile:
+            self.profile_autoscaling(revision, url)
+
+    def stage_model(self) -> None:
+        'Copies the model to storage configured in `deployment.model_storage` (once per RUN_ID)'
+        start = time.monotonic()
+        try:
+            staged = self.model_storage.stage(self.run_id)
+        except ModelStorageException as e:
+            self._error = 'Could not stage the model in %s. Stopping deployment. Exception details: %s' % (
+                self.model_storage.storage_uri(self.run_id), e)
+            return
+        if staged:
+            self.reports.append('Model staged in %s in %.0fs.' % (
+                self.model_storage.storage_uri(self.run_id), time.monotonic() - start))
+
+    def replica_startup(self, revision: Optional[str]) -> Optional[ReplicaStartup]:
+        if not revision:
+            return None
+        pods = self.kfs.core_api.list_namespaced_pod(self.namespace, label_selector=self.pod_selector(revision))
+        return replica_startup(pods.items)
+
+    def report_replica_startup(self, previous: Optional[ReplicaStartup]) -> None:
+        '''Reports how long replicas of the new model take to become ready (time to scale out),
+        compared with the `previous` model
+        '''
+        if self.error or not self.config.deployment.get('model_storage'):
+            return
+        current = self.replica_startup(self.get_latest_revision())
+        if not current:
+            return
+        message = 'Replica startup: %.1fs (model download: %.1fs)' % (current.ready_seconds, current.download_seconds)
+        if previous:
+            message += ', previous model: %.1fs (model download: %.1fs)' % (
+                previous.ready_seconds, previous.download_seconds)
+        self.reports.append(message)
+
+    def mark(self, event: str) -> None:
+        self.timestamps[event] = datetime.now(timezone.utc)
+
+    def report_deployment_phases(self) -> None:
+        '''Reports how long each phase of the deployment took (see `deployment_timing.PHASES`) and
+        appends it to the timing history file (DEPLOYMENT_TIMING_PATH environment variable)
+        '''
+        if self.error:
+            return
+        self.mark('finished')
+        revision = self.get_latest_revision()
+        pods = self.kfs.core_api.list_namespaced_pod(self.namespace, label_selector=self.pod_selector(revision))
+        ready_pods = [p for p in pods.items if pod_ready_time(p)]
+
+        phases = {}
+        if ready_pods:
+            pod = min(ready_pods, key=pod_ready_time)
+            events = self.kfs.core_api.list_namespaced_event(
+                self.namespace, field_selector='involvedObject.name=%s' % pod.metadata.name)
+            phases = pod_phases(pod, events.items)
+            phases['ready'] = seconds(pod_ready_time(pod), self.timestamps.get('revision_ready'))
+        checks_done = self.timestamps.get('checks_done', self.timestamps.get('revision_ready'))
+        phases['checks'] = seconds(self.timestamps.get('revision_ready'), checks_done)
+        phases['traffic_shift'] = seconds(checks_done, self.timestamps['finished'])
+        total = seconds(self.timestamps['started'], self.timestamps['finished'])
+        self.reports.append('<b>Deployment time</b><br/>%s' % phase_table(phases, total))
+
+        path = default_history_path()
+        if path:
+            try:
+                append_history(path, {
+                    'time': self.timestamps['finished'].isoformat(),
+                    'run_id': self.run_id,
+                    'namespace': self.namespace,
+                    'inference_service_name': self.inference_service_name,
+                    'revision': revision,
+                    'phases': phases,
+                    'total': total
+                })
+            except OSError as e:
+                self.logger.warning('Could not write deployment timing to %s: %s' % (path, e))
+
+    def record_deployment(self, previous_revision: Optional[str]) -> None:
+        '''Records revision serving the model in deployment history. `previous_revision` is
+        eligible for instant rollback for `deployment.rollback.retain_previous_minutes`.
+        '''
+        if not self.history or self.error:
+            return
+        settings = self.config.deployment.get('rollback') or {}
+        retain_until = datetime.utcnow() + timedelta(minutes=settings.get('retain_previous_minutes', 60))
+        self.history.record(self.namespace, self.inference_service_name, {
+            'run_id': self.run_id,
+            'revision': self.get_rolled_out_revision(),
+            'previous_revision': previous_revision,
+            'retain_until': retain_until.isoformat() if previous_revision else None,
+            'rollback': False
+        })
+
+    def rollback(self, run_id: Optional[str] = None) -> None:
+        '''Routes traffic back to the model deployed before the current one (or to `run_id`).
+        If its revision is retained by KServe as the previously rolled out revision (and retention
+        window hasn't passed), only traffic split is patched. Otherwise the model is redeployed.
+        '''
+        entries = self.history.entries(self.namespace, self.inference_service_name) if self.history else []
+        if not entries:
+            self._error = 'Could not find deployment history of InferenceService %s in namespace %s.' % (
+                self.inference_service_name, self.namespace)
+            return
+
+        current = entries[-1]
+        if run_id:
+            target = self.history.find(self.namespace, self.inference_service_name, run_id)
         else:
-            isvc = self.get_isvc(canary_traffic_percent=100)
-            res = self.kfs.replace(self.inference_service_name, isvc)
+            target = next((e for e in reversed(entries) if e['run_id'] != current['run_id']), None)
+        if not target:
+            self._error = 'Could not find previous deployment%s of InferenceService %s in namespace %s.' % (
+                ' of RUN_ID: %s' % run_id if run_id else '', self.inference_service_name, self.namespace)
+            return
+        if target['run_id'] == current['run_id']:
+            self.reports.append('Model from RUN_ID: %s is already deployed, nothing to roll back.' % run_id)
+            return
+
+        start = time.monotonic()
+        predictor = self.isvc.get('status', {}).get('components', {}).get('predictor', {})
+        retained = predictor.get('previousRolledoutRevision') == target['revision'] and \
+            current.get('previous_revision') == target['revision'] and \
+            current.get('retain_until') and datetime.utcnow() < datetime.fromisoformat(current['retain_until'])
+
+        if retained:
+            self.logger.info('Routing traffic of %s back to retained revision %s' %
+                             (self.inference_service_name, target['revision']))
+            self.patch_traffic(0)
+            self.wait_ready()
+            if self.error:
+                return
+            self.run_id = target['run_id']
+            self.history.record(self.namespace, self.inference_service_name, {
+                'run_id': target['run_id'],
+                'revision': target['revision'],
+                'previous_revision': current['revision'],
+                'retain_until': None,
+                'rollback': True
+            })
+            self.reports.append('Traffic routed back to revision %s (RUN_ID: %s) in %.1fs.' % (
+                target['revision'], target['run_id'], time.monotonic() - start))
+            return
+
+        self.logger.info('Revision %s is not retained anymore, redeploying model from RUN_ID: %s' %
+                         (target['revision'], target['run_id']))
+        self.run_id = target['run_id']
+        self.deploy()
+        if not self.error:
+            self.reports.insert(0, 'Revision %s is not retained anymore, model from RUN_ID: %s ' % (
+                target['revision'], target['run_id']) + 'has been redeployed in %.1fs.' % (time.monotonic() - start))
+
+    def set_traffic(self, percent: int) -> None:
+        isvc = self.get_isvc(canary_traffic_percent=percent)
+        if self.apply(isvc):
             self.wait_ready()
 
-    def wait_ready(self):
-        sleep(10)
-        try:
-            self.kfs.wait_isvc_ready(
-                name=self.inference_service_name, namespace=self.namespace)
-        except RuntimeError as r:
-            kfs_get = self.kfs.get(
-                name=self.inference_service_name, namespace=self.namespace)
-            status = yaml.safe_dump(kfs_get['status'])
-            # TODO: (In beta release) Add event watch and report it as well
-            self._error = 'Error: Timed out waiting for deployment becoming ready. ' +\
+    def progressive_rollout(self, settings: Dict) -> None:
+        '''Shifts traffic to the new revision step by step (`settings.steps` percents).
+        Before each step, metrics of the new revision from previous `dwell_seconds` are checked.
+        If any threshold is exceeded, all traffic is routed back to the previous revision.
+        '''
+        source = metrics_source(settings.metrics)
+        steps = settings.get('steps')
+        steps = [10, 50] if steps is None else list(steps)
+        # Empty list promotes the new revision at once
+        if not steps or steps[-1] != 100:
+            steps.append(100)
+        dwell_seconds = settings.get('dwell_seconds', 60)
+
+        rows = []
+        for percent in steps:
+            self.set_traffic(percent)
+            if self.error or percent == 100:
+                break
+            # Applied autoscaling settings create another revision on the first step
+            revision = self.get_latest_revision()
+
+            self.logger.info('%s%% of traffic routed to revision %s, observing for %ss' %
+                             (percent, revision, dwell_seconds))
+            time.sleep(dwell_seconds)
+
+            try:
+                metrics = source.revision_metrics(self.namespace, revision, dwell_seconds)
+            except MetricsSourceException as e:
+                violations = [str(e)]
+            else:
+                violations = check_revision_metrics(metrics, settings)
+                rows.append('<tr><td>%s%%</td><td>%d</td><td>%.2f%%</td><td>%s</td></tr>' % (
+                    percent, metrics.requests, metrics.error_rate * 100,
+                    '-' if metrics.p95_latency_ms is None else '%.1f ms' % metrics.p95_latency_ms))
+
+            if violations:
+                self.logger.info('Rolling back revision %s: %s' % (revision, '; '.join(violations)))
+                self.set_traffic(0)
+                self._error = 'Canary rollout stopped at %s%% of traffic and rolled back ' % percent +\
+                    'to the previous model: %s.' % '; '.join(violations)
+                break
+
+        if rows:
+            table = '<table><tr><td>Traffic</td><td>Requests</td><td>Error rate</td>' +\
+                '<td>p95 latency</td></tr>%s</table>' % ''.join(rows)
+            if self.error:
+                self._error += '<br/>%s' % table
+            else:
+                self.reports.append('<b>Canary rollout</b><br/>%s' % table)
+
+    def private_url(self, revision: str) -> str:
+        'Predict endpoint of the revision, reachable regardless of traffic split'
+        return 'http://%s-private.%s.svc.cluster.local/v1/models/%s:predict' % \
+            (revision, self.namespace, self.inference_service_name)
+
+    def run_load_test(self, url: str, settings: Dict) -> None:
+        try:
+            samples = load_samples(settings.samples_path)
+        except (FileNotFoundError, ValueError) as e:
+            self._error = 'Invalid deployment settings. Check load_test.samples_path in config.yaml. ' +\
+                'Stopping deployment. Exception details: %s' % e
+            return
+
+        self.logger.info('Load testing endpoint: %s' % url)
+        report = LoadTester(
+            url, samples,
+            concurrency=settings.get('concurrency', 4),
+            requests_count=settings.get('requests'),
+            rps=settings.get('rps')).run()
+
+        table = report_table(report)
+        self.reports.append('<b>Load test</b><br/>%s' % table)
+
+        violations = check_thresholds(report, settings)
+        if violations:
+            self._error = 'New model is deployed (with traffic 0%) but failed load test: ' +\
+                '%s.<br/>%s' % ('; '.join(violations), table)
+
+    def compare_latency(self, current_url: str, url: str, settings: Dict) -> None:
+        try:
+            samples = load_samples(settings.samples_path)
+        except (FileNotFoundError, ValueError) as e:
+            self._error = 'Invalid deployment settings. Check latency_comparison.samples_path in ' +\
+                'config.yaml. Stopping deployment. Exception details: %s' % e
+            return
+
+        self.logger.info('Comparing latency of %s (current) and %s (new)' % (current_url, url))
+        comparison = compare_latency(current_url, url, samples, requests_count=settings.get('requests'))
+        table = comparison_table(comparison)
+
+        max_regression = settings.get('max_regression_percent', 10)
+        if not is_regression(comparison, max_regression):
+            self.reports.append('<b>Latency comparison</b><br/>%s' % table)
+        elif settings.get('block', True):
+            self._error = 'New model is deployed (with traffic 0%) but it is more than ' +\
+                '%s%% slower than the current model.<br/>%s' % (max_regression, table)
+        else:
+            self.reports.append('<b>Warning: new model is more than %s%% slower than the current ' % max_regression +\
+                'model</b><br/>%s' % table)
+
+    def pod_selector(self, revision: str) -> str:
+        return 'serving.knative.dev/revision=%s' % revision
+
+    def ready_replicas(self, revision: str) -> int:
+        pods = self.kfs.core_api.list_namespaced_pod(self.namespace, label_selector=self.pod_selector(revision))
+        return len([p for p in pods.items if p.status.container_statuses and
+                    all(c.ready for c in p.status.container_statuses)])
+
+    def wait_replicas(self, revision: str, replicas: int, timeout: int = REPLICAS_TIMEOUT) -> int:
+        'Waits until revision has `replicas` ready pods, returns number of ready pods'
+        deadline = time.monotonic() + timeout
+        ready = self.ready_replicas(revision)
+        while ready < replicas and time.monotonic() < deadline:
+            time.sleep(2)
+            ready = self.ready_replicas(revision)
+        return ready
+
+    def check_warmup_replicas(self) -> None:
+        '''Warmup can't scale the new revision up (changing minReplicas creates another revision),
+        it waits for replicas started because of minReplicas. More replicas would never start.
+        '''
+        replicas = (self.config.deployment.get('warmup') or {}).get('replicas')
+        if not replicas:
+            return
+        min_replicas = self.get_isvc().spec.predictor.min_replicas or 1
+        if replicas > min_replicas:
+            self._error = 'Invalid deployment settings. warmup.replicas (%s) exceeds minReplicas (%s) ' % (
+                replicas, min_replicas) + 'of the predictor, set minReplicas in inference service ' +\
+                'function. Stopping deployment.'
+
+    def warm_up(self, revision: str, url: str, settings: Dict) -> None:
+        '''Before traffic is shifted, waits until new revision runs expected number of replicas
+        (`settings.replicas` or predictor's minReplicas) and sends warmup requests until
+        latency stabilizes. Deployment is stopped if any warmup request fails.
+        '''
+        try:
+            samples = load_samples(settings.samples_path)
+        except (FileNotFoundError, ValueError) as e:
+            self._error = 'Invalid deployment settings. Check warmup.samples_path in config.yaml. ' +\
+                'Stopping deployment. Exception details: %s' % e
+            return
+
+        replicas = settings.get('replicas')
+        if not replicas:
+            replicas = self.isvc.get('spec', {}).get('predictor', {}).get('minReplicas') or 1
+
+        start = time.monotonic()
+        ready = self.wait_replicas(revision, replicas)
+        if ready < replicas:
+            self.logger.warning('Only %s of %s replicas of revision %s are ready' % (ready, replicas, revision))
+
+        self.logger.info('Warming up revision %s (%s replicas)' % (revision, ready))
+        requests_per_replica = settings.get('requests_per_replica', 10)
+        report = warm_up(
+            url, samples,
+            min_requests=requests_per_replica * max(ready, 1),
+            max_requests=settings.get('max_requests', 200),
+            tolerance_percent=settings.get('tolerance_percent', 20))
+
+        if report.errors:
+            self._error = 'New model failed warmup: %s of %s requests to revision %s failed. ' % (
+                report.errors, report.requests, revision) + 'Stopping deployment.'
+            return
+
+        message = 'Warmup: %s requests to %s replicas, ' % (report.requests, ready)
+        if report.stable:
+            message += 'latency stable after %.1fs ' % (time.monotonic() - start)
+        else:
+            message += 'latency not stable after %.1fs ' % (time.monotonic() - start)
+        message += '(first request: %.1f ms, last request: %.1f ms)' % (report.latencies[0], report.latencies[-1])
+        self.reports.append(message)
+
+    def tune_batcher(self, revision: str, settings: Dict) -> str:
+        '''Deploys the new model (with traffic 0%) with each combination of batcher settings
+        (`settings.max_batch_sizes` x `settings.max_latencies_ms`) and load tests it. Batcher
+        with the best throughput meeting latency SLO is kept for the rest of the deployment.
+        Returns revision deployed with the selected batcher.
+        '''
+        try:
+            samples = load_samples(settings.samples_path)
+        except (FileNotFoundError, ValueError) as e:
+            self._error = 'Invalid deployment settings. Check batcher_tuning.samples_path in config.yaml. ' +\
+                'Stopping deployment. Exception details: %s' % e
+            return revision
+
+        # None - batcher as defined by inference service function
+        candidates = [None] + [
+            {'max_batch_size': size, 'max_latency': latency}
+            for size in settings.get('max_batch_sizes', [8, 32])
+            for latency in settings.get('max_latencies_ms', [10, 50])]
+
+        trials = []
+        # Revision deployed most recently
+        latest = revision
+        for batcher in candidates:
+            candidate_revision = revision
+            if batcher:
+                self.predictor_overrides['batcher'] = V1beta1Batcher(**batcher)
+                self.set_traffic(0)
+                if self.error:
+                    self.logger.warning('Revision with batcher %s is not ready: %s' % (batcher, self.error))
+                    self._error = None
+                    latest = None
+                    trials.append(BatcherTrial(batcher, None, None, None, None))
+                    continue
+                candidate_revision = latest = self.get_latest_revision()
+
+            self.logger.info('Load testing revision %s, batcher: %s' % (candidate_revision, batcher))
+            report = LoadTester(
+                self.private_url(candidate_revision), samples,
+                concurrency=settings.get('concurrency', 8),
+                requests_count=settings.get('requests', 200)).run()
+            s = summary(report)
+            trials.append(BatcherTrial(batcher, candidate_revision, s['throughput'],
+                                       s['p95_latency_ms'], s['error_rate']))
+
+        selected = select_batcher(trials, settings.max_p95_latency_ms, settings.get('max_error_rate', 0.01))
+        if selected is None or selected.batcher is None:
+            self.predictor_overrides.pop('batcher', None)
+        else:
+            self.predictor_overrides['batcher'] = V1beta1Batcher(**selected.batcher)
+
+        self.batcher_tuning = {
+            'run_id': self.run_id,
+            'namespace': self.namespace,
+            'inference_service_name': self.inference_service_name,
+            'selected': selected.batcher if selected else None,
+            'trials': [t._asdict() for t in trials]
+        }
+        table = batcher_table(trials, selected)
+        if selected is None:
+            self.reports.append('<b>Batcher tuning: no setting meets latency SLO (p95 %s ms), ' %
+                                settings.max_p95_latency_ms + 'batcher left unchanged</b><br/>%s' % table)
+        else:
+            self.reports.append('<b>Batcher tuning</b><br/>%s' % table)
+
+        if selected is not None and selected.revision == latest:
+            return latest
+        # Deploy the selected setting (with traffic 0%) again. Replaced even when the spec seems
+        # unchanged, the revision of the last trial must not be promoted.
+        self.replace(self.get_isvc(canary_traffic_percent=0))
+        self.wait_ready()
+        return self.get_latest_revision()
+
+    def profile_autoscaling(self, revision: str, url: str) -> None:
+        '''Load tests the new revision with increasing concurrency and recommends autoscaling
+        settings of the predictor (`deployment.profiling` in config.yaml). With `apply` set,
+        recommended settings are used for the rest of the deployment.
+        '''
+        settings = self.config.deployment.get('profiling')
+        if not settings:
+            self._error = 'Profiling requires deployment.profiling settings in config.yaml. Stopping deployment.'
+            return
+        try:
+            samples = load_samples(settings.samples_path)
+        except (FileNotFoundError, ValueError) as e:
+            self._error = 'Invalid deployment settings. Check profiling.samples_path in config.yaml. ' +\
+                'Stopping deployment. Exception details: %s' % e
+            return
+
+        replicas = self.ready_replicas(revision)
+        self.logger.info('Profiling revision %s (%s replicas)' % (revision, replicas))
+        max_latency_increase = settings.get('max_latency_increase_percent', 50)
+        max_error_rate = settings.get('max_error_rate', 0.01)
+        steps = concurrency_sweep(
+            url, samples,
+            levels=settings.get('concurrency_levels', DEFAULT_CONCURRENCY_LEVELS),
+            requests_per_connection=settings.get('requests_per_connection', 20),
+            max_latency_increase_percent=max_latency_increase,
+            max_error_rate=max_error_rate)
+        # Knative might have scaled the revision up during the sweep
+        replicas = max(replicas, self.ready_replicas(revision), 1)
+
+        knee = find_knee(steps, max_latency_increase, max_error_rate,
+                         settings.get('min_throughput_gain_percent', 10))
+        table = sweep_table(steps, knee)
+        if knee is None:
+            self._error = 'New model is deployed (with traffic 0%) but failed profiling: ' +\
+                'requests fail even without concurrency.<br/>%s' % table
+            return
+
+        recommendation = recommend_autoscaling(
+            knee, replicas,
+            target_utilization_percent=settings.get('target_utilization_percent', 70),
+            expected_rps=settings.get('expected_rps'),
+            peak_rps=settings.get('peak_rps'))
+        if settings.get('apply'):
+            self.predictor_overrides.update({k: v for k, v in recommendation.items() if v is not None})
+
+        self.reports.append(
+            '<b>Autoscaling %s</b> (knee at %s concurrent requests on %s replicas)<br/>%s<br/>%s' % (
+                'settings applied' if settings.get('apply') else 'recommendation',
+                knee.concurrency, replicas, recommendation_table(recommendation), table))
+
+    def readiness_watcher(self, name: str, replaced_revision: Optional[str] = None) -> IsvcReadinessWatcher:
+        return IsvcReadinessWatcher(self.kfs, name, self.namespace, replaced_revision=replaced_revision)
+
+    def wait_rollout(self, watcher: IsvcReadinessWatcher) -> None:
+        'Latest Knative revision is ready together with InferenceService, nothing to wait for'
+        pass
+
+    def wait_ready(self, name: Optional[str] = None):
+        'Waits until InferenceService `name` (defaults to the deployed one) is ready'
+        name = name or self.inference_service_name
+        if name == self.inference_service_name:
+            watcher = self.readiness_watcher(name, self._replaced_revision)
+            self._replaced_revision = None
+        else:
+            watcher = self.readiness_watcher(name)
+        try:
+            watcher.wait()
+            self.wait_rollout(watcher)
+        except IsvcNotReadyException as e:
+            isvc = watcher.isvc or (self.fetch_isvc() if name == self.inference_service_name else None) or {}
+            status = yaml.safe_dump(isvc.get('status', {}))
+            events = watcher.events + watcher.kubernetes_events()
+            self._error = 'Error: %s. ' % e +\
                           'InferenceService Status: <br/> <code>%s</code>' % status
+            if events:
+                self._error += '<br/>Events: <br/><pre>%s</pre>' % '\n'.join(events)
+        finally:
+            if watcher.isvc and name == self.inference_service_name:
+                self._isvc = watcher.isvc
 
-    def check_isvc_exists(self):
+    def fetch_isvc(self) -> Optional[Dict]:
+        'Reads InferenceService by name, returns None if it does not exist'
         try:
-            isvcs = self.kfs.get(namespace=self.namespace)
-        except RuntimeError as e:
+            self._isvc = self.kfs.api_instance.get_namespaced_custom_object(
+                kserve_constants.KSERVE_GROUP, kserve_constants.KSERVE_V1BETA1_VERSION,
+                self.namespace, kserve_constants.KSERVE_PLURAL, self.inference_service_name)
+        except ApiException as e:
+            if e.status == 404:
+                self._isvc = None
+                return None
             raise Exception('Error while probing for inference services. Make sure you ' +
                             'created deployment namespaces. Refer to documentation for details.')
-        existing_isvcs = [i.get('metadata', {}).get('name') for i in isvcs['items']]
-        return self.inference_service_name in existing_isvcs
+        return self._isvc
+
+    @property
+    def isvc(self) -> Dict:
+        '''Last seen state of InferenceService. Read once, then kept up to date from
+        replace responses and objects observed while waiting for readiness.
+        '''
+        if self._isvc is None:
+            self.fetch_isvc()
+        return self._isvc or {}
+
+    def replace(self, isvc: V1beta1InferenceService) -> None:
+        '''Replaces InferenceService with resourceVersion of the last seen state (otherwise
+        KServe client reads it before each replace). On conflict, resourceVersion is refreshed.
+        '''
+        isvc.metadata.resource_version = self.isvc.get('metadata', {}).get('resourceVersion')
+        self._replaced_revision = self.isvc.get('status', {}).get(
+            'components', {}).get('predictor', {}).get('latestCreatedRevision')
+        try:
+            self._isvc = self.kfs.replace(self.inference_service_name, isvc)
+        except RuntimeError:
+            # Modified since last seen
+            isvc.metadata.resource_version = (self.fetch_isvc() or {}).get('metadata', {}).get('resourceVersion')
+            self._isvc = self.kfs.replace(self.inference_service_name, isvc)
+
+    def changes(self, isvc: V1beta1InferenceService) -> Optional[str]:
+        '''Compares `isvc` with the last seen state. Returns "spec" if predictor (or other
+        component) changed, "traffic" if only traffic split changed, None if nothing changed.
+        '''
+        live = self.isvc.get('spec') if isinstance(self.isvc, dict) else None
+        desired = self.kfs.api_instance.api_client.sanitize_for_serialization(isvc)
+        if not isinstance(live, dict) or not isinstance(desired, dict):
+            return 'spec'
+        desired = desired.get('spec', {})
+        if not is_equivalent(without_traffic(desired), without_traffic(live)):
+            return 'spec'
+        if traffic_percent(desired) != traffic_percent(live):
+            return 'traffic'
+        return None
+
+    def apply(self, isvc: V1beta1InferenceService) -> bool:
+        '''Brings InferenceService to the state of `isvc` with the smallest change: traffic split
+        is patched, other changes replace it (creating new revision). Returns False if there
+        was nothing to change.
+        '''
+        changes = self.changes(isvc)
+        if changes == 'spec':
+            self.replace(isvc)
+        elif changes == 'traffic':
+            self.patch_traffic(isvc.spec.predictor.canary_traffic_percent)
+        return changes is not None
+
+    def patch_traffic(self, percent: int) -> None:
+        'Sets percent of traffic routed to the latest revision, the rest goes to the previous one'
+        self._isvc = self.kfs.api_instance.patch_namespaced_custom_object(
+            kserve_constants.KSERVE_GROUP, kserve_constants.KSERVE_V1BETA1_VERSION,
+            self.namespace, kserve_constants.KSERVE_PLURAL, self.inference_service_name,
+            {'spec': {'predictor': {'canaryTrafficPercent': percent}}})
+
+    def is_up_to_date(self) -> bool:
+        'InferenceService is ready and its latest revision serves the model with all traffic'
+        status = self.isvc.get('status', {}) if isinstance(self.isvc, dict) else {}
+        conditions = {c['type']: c['status'] for c in status.get('conditions', [])}
+        predictor = status.get('components', {}).get('predictor', {})
+        return conditions.get('Ready') == 'True' and \
+            predictor.get('latestCreatedRevision') == predictor.get('latestReadyRevision') and \
+            self.changes(self.get_isvc(canary_traffic_percent=100)) is None
+
+    def check_isvc_exists(self):
+        return self.fetch_isvc() is not None
 
     def get_latest_revision(self):
-        isvc = self.kfs.get(self.inference_service_name, namespace=self.namespace)
-        return isvc.get('status', {}).get(
+        return self.isvc.get('status', {}).get(
             'components', {}).get('predictor', {}).get('latestCreatedRevision')
+
+    def get_rolled_out_revision(self):
+        '''Revision promoted to serve traffic. Latest ready revision can be a candidate
+        of a failed deployment which never received traffic.
+        '''
+        predictor = self.isvc.get('status', {}).get('components', {}).get('predictor', {})
+        if predictor.get('latestRolledoutRevision'):
+            return predictor['latestRolledoutRevision']
+        traffic = [t for t in predictor.get('traffic') or [] if t.get('percent')]
+        if traffic:
+            return max(traffic, key=lambda t: t['percent']).get('revisionName')
+        return predictor.get('latestReadyRevision')
+
+
+class RawIsvcDeployer(IsvcDeployer):
+    '''
+    Deploys InferenceService in KServe RawDeployment mode (`deployment.mode: raw`): predictor
+    runs as a plain Deployment and Service, without Knative queue-proxy and activator.
+    There are no revisions and no traffic split, so the new model is deployed as a shadow
+    InferenceService (`<name>-candidate`) and tested through its Service. When all checks pass,
+    the InferenceService is updated (rolling update of its Deployment) and the shadow is deleted.
+    '''
+    @property
+    def candidate_name(self) -> str:
+        return self.inference_service_name + CANDIDATE_SUFFIX
+
+    def get_isvc(self, canary_traffic_percent=None, name: Optional[str] = None):
+        # Traffic split is not supported in raw deployment mode
+        isvc = super().get_isvc(name=name)
+        isvc.metadata.annotations = dict(getattr(isvc.metadata, 'annotations', None) or {},
+                                         **{DEPLOYMENT_MODE_ANNOTATION: RAW_DEPLOYMENT})
+        return isvc
+
+    def get_latest_revision(self):
+        'Predictor Deployment, takes place of the revision in raw deployment mode'
+        return predictor_name(self.inference_service_name)
+
+    def private_url(self, revision: str) -> str:
+        'Predict endpoint of the predictor Service (`revision` is the predictor Deployment)'
+        model_name = revision[:-len(predictor_name(''))]
+        return 'http://%s.%s.svc.cluster.local/v1/models/%s:predict' % (revision, self.namespace, model_name)
+
+    def pod_selector(self, revision: str) -> str:
+        return 'serving.kserve.io/inferenceservice=%s' % revision[:-len(predictor_name(''))]
+
+    def ready_replicas(self, revision: str) -> int:
+        deployment = self.kfs.app_api.read_namespaced_deployment_status(revision, self.namespace)
+        return deployment.status.ready_replicas or 0
+
+    def readiness_watcher(self, name: str, replaced_revision: Optional[str] = None) -> IsvcReadinessWatcher:
+        # No revisions in raw deployment mode, rollout of predictor Deployment is checked by `wait_rollout`
+        return IsvcReadinessWatcher(self.kfs, name, self.namespace,
+                                    pod_selector='serving.kserve.io/inferenceservice=%s' % name)
+
+    def wait_rollout(self, watcher: IsvcReadinessWatcher) -> None:
+        '''InferenceService is ready as soon as old pods are available, waits until rolling update
+        of the predictor Deployment finishes.
+        '''
+        deployment_name = predictor_name(watcher.name)
+        deadline = time.monotonic() + watcher.timeout
+        while True:
+            deployment = self.kfs.app_api.read_namespaced_deployment_status(deployment_name, self.namespace)
+            if is_rolled_out(deployment):
+                return
+            for c in deployment.status.conditions or []:
+                if c.type == 'Progressing' and c.reason == 'ProgressDeadlineExceeded':
+                    raise IsvcNotReadyException('Deployment %s: %s' % (deployment_name, c.message))
+            watcher.check_pods()
+            if time.monotonic() > deadline:
+                raise IsvcNotReadyException('Timed out waiting for rollout of Deployment %s (%ss)' %
+                                            (deployment_name, watcher.timeout))
+            time.sleep(ROLLOUT_CHECK_INTERVAL)
+
+    def replace_isvc(self):
+        unsupported = [s for s in ['canary', 'batcher_tuning'] if self.config.deployment.get(s)]
+        if unsupported:
+            self._error = 'Settings %s are not supported in raw deployment mode. Stopping deployment.' % \
+                ', '.join('deployment.%s' % s for s in unsupported)
+            return
+
+        annotations = self.isvc.get('metadata', {}).get('annotations') or {}
+        if annotations.get(DEPLOYMENT_MODE_ANNOTATION) != RAW_DEPLOYMENT:
+            self._error = 'InferenceService %s is deployed in serverless mode and its deployment ' % \
+                self.inference_service_name + 'mode can\'t be changed. Delete it to switch to raw deployment mode.'
+            return
+
+        # Predictor Deployment serving traffic before the new model is rolled out
+        conditions = {c['type']: c['status'] for c in self.isvc.get('status', {}).get('conditions', [])}
+        current_revision = self.get_latest_revision() if conditions.get('Ready') == 'True' else None
+        try:
+            self.deploy_candidate()
+            if self.error:
+                return
+            self.mark('revision_ready')
+
+            self.test_model(predictor_name(self.candidate_name), current_revision)
+            if self.error:
+                return
+            self.mark('checks_done')
+
+            # Old pods keep serving until the new ones are available
+            self.apply(self.get_isvc())
+            self.wait_ready()
+        finally:
+            self.delete_candidate()
+
+    def record_deployment(self, previous_revision: Optional[str]) -> None:
+        'There are no revisions to roll back to in raw deployment mode, see `rollback`'
+        pass
+
+    def rollback(self, run_id: Optional[str] = None) -> None:
+        self._error = 'Rollback is not supported in raw deployment mode (InferenceService %s). ' % \
+            self.inference_service_name + 'Deploy the previous model again with /deploy --run-id=<RUN_ID>.'
+
+    def deploy_candidate(self) -> None:
+        'Deploys the new model as a shadow InferenceService, not receiving any traffic'
+        candidate = self.get_isvc(name=self.candidate_name)
+        try:
+            existing = self.kfs.api_instance.get_namespaced_custom_object(
+                kserve_constants.KSERVE_GROUP, kserve_constants.KSERVE_V1BETA1_VERSION,
+                self.namespace, kserve_constants.KSERVE_PLURAL, self.candidate_name)
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            existing = None
+
+        if existing:
+            # Left over by interrupted deployment
+            candidate.metadata.resource_version = existing['metadata']['resourceVersion']
+            self.kfs.replace(self.candidate_name, candidate)
+        else:
+            self.kfs.create(candidate, namespace=self.namespace)
+        self.wait_ready(self.candidate_name)
+
+    def delete_candidate(self) -> None:
+        try:
+            self.kfs.api_instance.delete_namespaced_custom_object(
+                kserve_constants.KSERVE_GROUP, kserve_constants.KSERVE_V1BETA1_VERSION,
+                self.namespace, kserve_constants.KSERVE_PLURAL, self.candidate_name)
+        except ApiException as e:
+            if e.status != 404:
+                self.logger.warning('Could not delete InferenceService %s: %s' % (self.candidate_name, e))
@@ -0,0 +1,417 @@
+import json
+import time
+import math
+import statistics
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+
+
+LoadTestReport = namedtuple('LoadTestReport', [
+    'requests',
+    'errors',
+    # Seconds
+    'duration',
+    # Milliseconds, successful requests only
+    'latencies'
+])
+
+
+LatencyComparison = namedtuple('LatencyComparison', [
+    # Milliseconds, pairs of successful requests (same sample sent to both endpoints)
+    'baseline',
+    'candidate',
+    'errors'
+])
+
+WarmupReport = namedtuple('WarmupReport', [
+    'requests',
+    # Seconds until latency stabilized (or warmup stopped)
+    'duration',
+    'stable',
+    # Milliseconds, in order of successful requests
+    'latencies',
+    'errors'
+])
+
+ConcurrencyStep = namedtuple('ConcurrencyStep', [
+    'concurrency',
+    # Requests per second
+    'throughput',
+    'p95_latency_ms',
+    'error_rate'
+])
+
+BatcherTrial = namedtuple('BatcherTrial', [
+    # Dict with max_batch_size and max_latency (ms), None for batcher defined by inference service function
+    'batcher',
+    # None if revision with the batcher did not become ready
+    'revision',
+    'throughput',
+    'p95_latency_ms',
+    'error_rate'
+])
+
+# Two-sided 95% confidence interval
+Z_95 = 1.96
+DEFAULT_CONCURRENCY_LEVELS = [1, 2, 4, 8, 16, 32]
+
+
+def load_samples(path: str) -> List[Dict]:
+    'Reads request payloads from JSONL file (one JSON document per line)'
+    with open(path, 'r') as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+    if not samples:
+        raise ValueError('File %s does not contain any samples' % path)
+    return samples
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    'Nearest-rank percentile'
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(int(math.ceil(p / 100 * len(values))) - 1, 0)]
+
+
+def summary(report: LoadTestReport) -> Dict:
+    return {
+        'p50_latency_ms': percentile(report.latencies, 50),
+        'p95_latency_ms': percentile(report.latencies, 95),
+        'p99_latency_ms': percentile(report.latencies, 99),
+        'throughput': report.requests / report.duration if report.duration else 0,
+        'error_rate': report.errors / report.requests if report.requests else 0
+    }
+
+
+def check_thresholds(report: LoadTestReport, thresholds: Dict) -> List[str]:
+    'Returns list of violated thresholds (`deployment.load_test` settings in config.yaml)'
+    s = summary(report)
+    violations = []
+    for p in ['p50', 'p95', 'p99']:
+        limit = thresholds.get('max_%s_latency_ms' % p)
+        value = s['%s_latency_ms' % p]
+        if limit is not None and (value is None or value > limit):
+            violations.append('%s latency %s ms exceeds %s ms' % (p, _format(value), limit))
+    if thresholds.get('max_error_rate') is not None and s['error_rate'] > thresholds['max_error_rate']:
+        violations.append('error rate %.2f%% exceeds %.2f%%' % (
+            s['error_rate'] * 100, thresholds['max_error_rate'] * 100))
+    if thresholds.get('min_throughput') is not None and s['throughput'] < thresholds['min_throughput']:
+        violations.append('throughput %.1f req/s is below %s req/s' % (
+            s['throughput'], thresholds['min_throughput']))
+    return violations
+
+
+def report_table(report: LoadTestReport) -> str:
+    s = summary(report)
+    rows = [
+        ('Requests', report.requests),
+        ('Errors', '%s (%.2f%%)' % (report.errors, s['error_rate'] * 100)),
+        ('Throughput', '%.1f req/s' % s['throughput']),
+        ('Latency p50', '%s ms' % _format(s['p50_latency_ms'])),
+        ('Latency p95', '%s ms' % _format(s['p95_latency_ms'])),
+        ('Latency p99', '%s ms' % _format(s['p99_latency_ms'])),
+    ]
+    return '<table>%s</table>' % ''.join(['<tr><td>%s</td><td>%s</td></tr>' % r for r in rows])
+
+
+def compare_latency(baseline_url: str, candidate_url: str, samples: List[Dict],
+                    requests_count: Optional[int] = None, timeout: float = 30) -> LatencyComparison:
+    '''Sends every sample to both endpoints, one request at a time. Order of endpoints
+    alternates between pairs, so warm-up and noise affect both endpoints equally.
+    '''
+    baseline, candidate, errors = [], [], 0
+    with requests.Session() as session:
+        for i in range(requests_count or len(samples)):
+            sample = samples[i % len(samples)]
+            urls = [baseline_url, candidate_url] if i % 2 == 0 else [candidate_url, baseline_url]
+            latencies = {}
+            for url in urls:
+                start = time.monotonic()
+                try:
+                    ok = session.post(url, json=sample, timeout=timeout).status_code == 200
+                except RequestException:
+                    ok = False
+                if ok:
+                    latencies[url] = (time.monotonic() - start) * 1000
+                else:
+                    errors += 1
+            if len(latencies) == 2:
+                baseline.append(latencies[baseline_url])
+                candidate.append(latencies[candidate_url])
+    return LatencyComparison(baseline=baseline, candidate=candidate, errors=errors)
+
+
+def latency_delta(comparison: LatencyComparison) -> Optional[Dict]:
+    '''Mean latency difference (candidate - baseline) of paired requests with 95%
+    confidence interval, in milliseconds and relative to the baseline mean.
+    '''
+    n = len(comparison.baseline)
+    if n < 2:
+        return None
+    deltas = [c - b for b, c in zip(comparison.baseline, comparison.candidate)]
+    mean = statistics.mean(deltas)
+    margin = Z_95 * statistics.stdev(deltas) / math.sqrt(n)
+    baseline_mean = statistics.mean(comparison.baseline)
+    return {
+        'delta_ms': mean,
+        'ci_low_ms': mean - margin,
+        'ci_high_ms': mean + margin,
+        'delta_percent': mean / baseline_mean * 100,
+        'ci_low_percent': (mean - margin) / baseline_mean * 100,
+        'ci_high_percent': (mean + margin) / baseline_mean * 100
+    }
+
+
+def is_regression(comparison: LatencyComparison, max_regression_percent: float) -> bool:
+    'Candidate is slower by more than `max_regression_percent` and the slowdown is significant'
+    delta = latency_delta(comparison)
+    return delta is not None and delta['delta_percent'] > max_regression_percent \
+        and delta['ci_low_percent'] > 0
+
+
+def comparison_table(comparison: LatencyComparison) -> str:
+    def stats(values):
+        return '%s / %s / %s' % (
+            _format(statistics.mean(values) if values else None),
+            _format(percentile(values, 50)), _format(percentile(values, 95)))
+
+    rows = [
+        ('', 'mean / p50 / p95 (ms)'),
+        ('Current revision', stats(comparison.baseline)),
+        ('New revision', stats(comparison.candidate)),
+    ]
+    delta = latency_delta(comparison)
+    if delta:
+        rows.append(('Difference', '%+.1f ms (%+.1f%%), 95%% CI: [%+.1f%%, %+.1f%%]' % (
+            delta['delta_ms'], delta['delta_percent'],
+            delta['ci_low_percent'], delta['ci_high_percent'])))
+    rows.append(('Requests (pairs)', '%s, errors: %s' % (len(comparison.baseline), comparison.errors)))
+    return '<table>%s</table>' % ''.join(['<tr><td>%s</td><td>%s</td></tr>' % r for r in rows])
+
+
+def is_latency_stable(latencies: List[float], window: int, tolerance_percent: float) -> bool:
+    'Mean latency of last `window` requests is within tolerance of the preceding window'
+    if len(latencies) < 2 * window:
+        return False
+    previous = statistics.mean(latencies[-2 * window:-window])
+    last = statistics.mean(latencies[-window:])
+    return abs(last - previous) <= previous * tolerance_percent / 100
+
+
+def warm_up(url: str, samples: List[Dict], min_requests: int, max_requests: int,
+            window: int = 5, tolerance_percent: float = 20, timeout: float = 60) -> WarmupReport:
+    '''Sends samples to `url` one by one until at least `min_requests` succeeded and latency
+    stabilized (or `max_requests` were sent). Every request opens new connection, so requests
+    are spread over all replicas behind the service. Failed requests are not part of
+    the latency stability check.
+    '''
+    latencies, errors = [], 0
+    start = time.monotonic()
+    stable = False
+    for i in range(max_requests):
+        request_start = time.monotonic()
+        try:
+            ok = requests.post(url, json=samples[i % len(samples)], timeout=timeout,
+                               headers={'Connection': 'close'}).status_code == 200
+        except RequestException:
+            ok = False
+        if not ok:
+            errors += 1
+            continue
+        latencies.append((time.monotonic() - request_start) * 1000)
+
+        stable = is_latency_stable(latencies, window, tolerance_percent)
+        if stable and len(latencies) >= min_requests:
+            break
+    return WarmupReport(
+        requests=len(latencies) + errors, duration=time.monotonic() - start,
+        stable=stable, latencies=latencies, errors=errors)
+
+
+def is_degraded(step: ConcurrencyStep, baseline: ConcurrencyStep, max_latency_increase_percent: float,
+                max_error_rate: float) -> bool:
+    'Latency of `step` grew too much compared to the lowest concurrency level, or requests fail'
+    if step.error_rate > max_error_rate or step.p95_latency_ms is None:
+        return True
+    return step.p95_latency_ms > baseline.p95_latency_ms * (1 + max_latency_increase_percent / 100)
+
+
+def concurrency_sweep(url: str, samples: List[Dict], levels: List[int] = DEFAULT_CONCURRENCY_LEVELS,
+                      requests_per_connection: int = 20, max_latency_increase_percent: float = 50,
+                      max_error_rate: float = 0.01) -> List[ConcurrencyStep]:
+    '''Load tests `url` with increasing number of parallel connections. Sweep stops at the
+    first level which degrades latency (so the endpoint isn't overloaded needlessly).
+    '''
+    steps = []
+    for concurrency in sorted(levels):
+        report = LoadTester(url, samples, concurrency=concurrency,
+                            requests_count=concurrency * requests_per_connection).run()
+        s = summary(report)
+        step = ConcurrencyStep(concurrency=concurrency, throughput=s['throughput'],
+                               p95_latency_ms=s['p95_latency_ms'], error_rate=s['error_rate'])
+        steps.append(step)
+        if is_degraded(step, steps[0], max_latency_increase_percent, max_error_rate):
+            break
+    return steps
+
+
+def find_knee(steps: List[ConcurrencyStep], max_latency_increase_percent: float = 50,
+              max_error_rate: float = 0.01, min_throughput_gain_percent: float = 10) -> Optional[ConcurrencyStep]:
+    '''Highest concurrency level before latency degrades or throughput stops growing
+    (by at least `min_throughput_gain_percent` from the previous level). None if even
+    the lowest level is degraded.
+    '''
+    knee = None
+    for step in steps:
+        if is_degraded(step, steps[0], max_latency_increase_percent, max_error_rate):
+            break
+        if knee is not None and step.throughput < knee.throughput * (1 + min_throughput_gain_percent / 100):
+            break
+        knee = step
+    return knee
+
+
+def recommend_autoscaling(knee: ConcurrencyStep, replicas: int, target_utilization_percent: float = 70,
+                          expected_rps: Optional[float] = None, peak_rps: Optional[float] = None) -> Dict:
+    '''KServe predictor autoscaling settings derived from the knee measured on `replicas` replicas.
+    Replica bounds are derived from expected (typical and peak) traffic if given.
+    '''
+    replicas = max(replicas, 1)
+    container_concurrency = max(knee.concurrency // replicas, 1)
+    utilization = target_utilization_percent / 100
+    # Requests per second a single replica serves at the scale target
+    replica_capacity = knee.throughput / replicas * utilization
+
+    recommendation = {
+        'container_concurrency': container_concurrency,
+        'scale_metric': 'concurrency',
+        'scale_target': max(int(container_concurrency * utilization), 1),
+        'min_replicas': 1,
+        'max_replicas': None
+    }
+    if expected_rps and replica_capacity:
+        recommendation['min_replicas'] = max(int(math.ceil(expected_rps / replica_capacity)), 1)
+    if peak_rps and replica_capacity:
+        recommendation['max_replicas'] = max(int(math.ceil(peak_rps / replica_capacity)),
+                                             recommendation['min_replicas'])
+    return recommendation
+
+
+def sweep_table(steps: List[ConcurrencyStep], knee: Optional[ConcurrencyStep]) -> str:
+    rows = [('Concurrency', 'Throughput', 'Latency p95', 'Errors')]
+    for step in steps:
+        rows.append((
+            '<b>%s</b>' % step.concurrency if step == knee else step.concurrency,
+            '%.1f req/s' % step.throughput,
+            '%s ms' % _format(step.p95_latency_ms),
+            '%.2f%%' % (step.error_rate * 100)))
+    return '<table>%s</table>' % ''.join(['<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>' % r
+                                          for r in rows])
+
+
+def recommendation_table(recommendation: Dict) -> str:
+    rows = [
+        ('containerConcurrency', recommendation['container_concurrency']),
+        ('scaleMetric', recommendation['scale_metric']),
+        ('scaleTarget', recommendation['scale_target']),
+        ('minReplicas', recommendation['min_replicas']),
+        ('maxReplicas', '-' if recommendation['max_replicas'] is None else recommendation['max_replicas']),
+    ]
+    return '<table>%s</table>' % ''.join(['<tr><td>%s</td><td>%s</td></tr>' % r for r in rows])
+
+
+def select_batcher(trials: List[BatcherTrial], max_p95_latency_ms: float,
+                   max_error_rate: float = 0.01) -> Optional[BatcherTrial]:
+    'Trial with the best throughput meeting latency SLO, None if no trial meets it'
+    valid = [t for t in trials if t.revision is not None and t.p95_latency_ms is not None and
+             t.p95_latency_ms <= max_p95_latency_ms and t.error_rate <= max_error_rate]
+    return max(valid, key=lambda t: t.throughput) if valid else None
+
+
+def batcher_table(trials: List[BatcherTrial], selected: Optional[BatcherTrial]) -> str:
+    rows = [('Max batch size', 'Max latency', 'Throughput', 'Latency p95', 'Errors')]
+    for t in trials:
+        row = (
+            t.batcher['max_batch_size'] if t.batcher else 'default',
+            '%s ms' % t.batcher['max_latency'] if t.batcher else 'default',
+            '%.1f req/s' % t.throughput if t.revision else 'not ready',
+            '%s ms' % _format(t.p95_latency_ms),
+            '%.2f%%' % (t.error_rate * 100) if t.revision else '-')
+        if t == selected:
+            row = tuple('<b>%s</b>' % c for c in row)
+        rows.append(row)
+    return '<table>%s</table>' % ''.join(['<tr>%s</tr>' % ''.join(['<td>%s</td>' % c for c in r])
+                                          for r in rows])
+
+
+def _format(value: Optional[float]) -> str:
+    return '-' if value is None else '%.1f' % value
+
+
+class LoadTester:
+    '''
+    Replays `samples` against `url` (POST) with `concurrency` parallel connections
+    (pooled HTTP session). Sends `requests_count` requests (defaults to number of samples,
+    samples are reused in round-robin), optionally paced to `rps` requests per second.
+    '''
+    def __init__(self, url: str, samples: List[Dict], concurrency: int = 4,
+                 requests_count: Optional[int] = None, rps: Optional[float] = None,
+                 timeout: float = 30) -> None:
+        self.logger = logging.getLogger('kfops')
+        self.url = url
+        self.samples = samples
+        self.concurrency = concurrency
+        self.requests_count = requests_count or len(samples)
+        self.rps = rps
+        self.timeout = timeout
+        self._lock = threading.Lock()
+
+    def _session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _send(self, session: requests.Session, i: int, start: float, results: Dict) -> None:
+        if self.rps:
+            delay = start + i / self.rps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        request_start = time.monotonic()
+        try:
+            resp = session.post(self.url, json=self.samples[i % len(self.samples)], timeout=self.timeout)
+            ok = resp.status_code == 200
+        except RequestException:
+            ok = False
+        latency = (time.monotonic() - request_start) * 1000
+
+        with self._lock:
+            if ok:
+                results['latencies'].append(latency)
+            else:
+                results['errors'] += 1
+
+    def run(self) -> LoadTestReport:
+        results = {'latencies': [], 'errors': 0}
+        with self._session() as session, ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            start = time.monotonic()
+            futures = [executor.submit(self._send, session, i, start, results)
+                       for i in range(self.requests_count)]
+            for f in futures:
+                f.result()
+            duration = time.monotonic() - start
+
+        return LoadTestReport(
+            requests=self.requests_count,
+            errors=results['errors'],
+            duration=duration,
+            latencies=results['latencies'])
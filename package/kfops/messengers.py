@@ -1,4 +1,8 @@
 import sys
+import time
+import uuid
+import threading
+from urllib.error import HTTPError, URLError
 from abc import ABC, abstractmethod
 import logging
 from typing import Dict, Optional
@@ -38,6 +42,10 @@ class Messenger(ABC):
         'Pipeline run completed message'
         pass
 
+    def flush(self) -> None:
+        'Publishes messages held back by the messenger (if any)'
+        pass
+
 
 class TerminalMessenger(Messenger):
     def __init__(self):
@@ -94,19 +102,121 @@ Pipeline run successfully completed after {run_time}.\n
 '''
 
 
+def is_transient_error(e: Exception) -> bool:
+    'Errors after which sending the message again can succeed'
+    if isinstance(e, HTTPError):
+        return e.code >= 500 or e.code == 429
+    return isinstance(e, (URLError, ConnectionError, TimeoutError))
+
+
 class VersionControlMessenger(Messenger):
-    def __init__(self, issue_number: int, vc_manager: VersionControlManager) -> None:
+    '''
+    Keeps single status comment per command. Messages are appended to the comment,
+    which is edited in place. Edits are throttled to one per `min_update_interval` seconds.
+
+    Messages are sent by a background thread, so the command doesn't wait for the version
+    control system. Messages queued while previous edit is in progress (or throttled) are
+    coalesced into a single edit. Transient errors are retried with exponential backoff
+    (`retry_delay`, doubled after each of `max_retries` attempts). Pending messages are
+    published with `flush`, errors are published immediately.
+
+    Status comment is tagged with a hidden marker, so a comment created by a request
+    that failed (e.g. timed out) is found instead of being posted again.
+    '''
+    def __init__(self, issue_number: int, vc_manager: VersionControlManager,
+                 min_update_interval: float = 0, max_retries: int = 5, retry_delay: float = 1) -> None:
         super().__init__()
         self.issue_number = issue_number
         self.vc_manager = vc_manager
+        self.min_update_interval = min_update_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.sections = []
+        self.comment_id = None
+        self.marker = '<!-- KFOPS_STATUS_ID=%s -->' % uuid.uuid4().hex
+        self.last_update = None
+        # Index of the first section of current comment and number of published sections
+        self._comment_start = 0
+        self._published = 0
+        self._urgent = False
+        self._condition = threading.Condition()
+        self._sender = None
+
+    @property
+    def status_body(self) -> str:
+        return '\n<hr/>\n'.join(self.sections[self._comment_start:])
+
+    def _publish(self, body: str, force: bool = False) -> None:
+        with self._condition:
+            self.sections.append(body)
+            self._condition.notify_all()
+            if self._sender is None:
+                self._sender = threading.Thread(
+                    target=self._send_loop, name='kfops-messenger', daemon=True)
+                self._sender.start()
+        if force:
+            self.flush()
+
+    def _send_loop(self) -> None:
+        while True:
+            with self._condition:
+                while self._published == len(self.sections):
+                    self._condition.wait()
+                if not self._urgent and self.last_update is not None:
+                    delay = self.last_update + self.min_update_interval - time.monotonic()
+                    if delay > 0:
+                        # Throttled, woken up earlier by flush
+                        self._condition.wait(delay)
+                        continue
+                count = len(self.sections)
+                body = '\n<hr/>\n'.join(self.sections[self._comment_start:count])
+                body = '%s\n%s' % (body, self.marker)
+
+            self._send(body, count)
+
+            with self._condition:
+                self._published = count
+                self.last_update = time.monotonic()
+                self._condition.notify_all()
+
+    def _send(self, body: str, count: int) -> None:
+        delay = self.retry_delay
+        for attempt in range(self.max_retries):
+            try:
+                if self.comment_id is None and attempt > 0:
+                    # Failed request could have created the comment anyway
+                    self.comment_id = self.vc_manager.find_comment(self.marker)
+                if self.comment_id is None:
+                    self.comment_id = self.vc_manager.create_comment(body)
+                    if self.comment_id is None:
+                        # Manager can't edit comments, next messages are posted separately
+                        self._comment_start = count
+                else:
+                    self.vc_manager.update_comment(self.comment_id, body)
+                return
+            except Exception as e:
+                if not is_transient_error(e) or attempt == self.max_retries - 1:
+                    self.logger.error('Could not publish message: %s' % e)
+                    return
+                self.logger.warning('Publishing message failed (%s), retrying in %ss' % (e, delay))
+                time.sleep(delay)
+                delay *= 2
+
+    def flush(self) -> None:
+        with self._condition:
+            self._urgent = True
+            self._condition.notify_all()
+            while self._published < len(self.sections):
+                self._condition.wait()
+            self._urgent = False
 
     def generic_message(self, message: str) -> None:
         self.logger.debug(message)
-        self.vc_manager.create_comment(message)
+        self._publish(message)
 
     def generic_error_message(self, message: str) -> None:
         self.logger.error(message)
-        self.vc_manager.create_comment(message)
+        self._publish(message, force=True)
         sys.exit(1)
 
     def component_built(self, pipeline_info: Dict, build_only) -> None:
@@ -118,7 +228,7 @@ class VersionControlMessenger(Messenger):
             body += '<br/>Type: <code>&#47;run</code> to run the compiled pipeline.'
 
         self.logger.debug(body)
-        self.vc_manager.create_comment(body)        
+        self._publish(body)        
 
     def pipeline_run(self, run_data: Dict) -> None:
         run_params = run_data.get('run_params')
@@ -134,11 +244,11 @@ class VersionControlMessenger(Messenger):
             run_params=run_params)
 
         self.logger.debug(body)
-        self.vc_manager.create_comment(body)                    
+        self._publish(body)                    
 
     def pipeline_run_completed(self, run_id: str, run_time: str) -> None:
         body = pipeline_run_completed_template.format(
             run_time=run_time,
             run_id=run_id)
         self.logger.debug(body)
-        self.vc_manager.create_comment(body)        
+        self._publish(body)
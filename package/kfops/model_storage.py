@@ -0,0 +1,184 @@
+import re
+import time
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+from kubernetes.client.rest import ApiException
+
+from .config import InvalidConfigException
+from .k8s_api import batch_v1_api
+
+# Bucket where pipelines store trained models, one folder per RUN_ID
+MODELS_BUCKET = 'trained-models'
+STORAGE_INITIALIZER_IMAGE = 'kserve/storage-initializer:v0.11.2'
+STAGING_TIMEOUT = 1800
+STAGING_CHECK_INTERVAL = 5
+STAGING_LABEL = 'kfops/model-staging'
+
+
+class ModelStorageException(Exception):
+    pass
+
+
+def failure(job):
+    'Failed condition of Job, None if it has not failed'
+    return next((c for c in job.status.conditions or [] if c.type == 'Failed' and c.status == 'True'), None)
+
+
+class ModelStorage(ABC):
+    'Location from which predictors load the trained model'
+
+    @abstractmethod
+    def storage_uri(self, run_id: str) -> str:
+        'Storage URI of the model trained by pipeline run `run_id`'
+        pass
+
+    @abstractmethod
+    def stage(self, run_id: str) -> bool:
+        '''Makes the model available at `storage_uri`. Returns False if there was nothing to do.
+        Raises ModelStorageException on failure.
+        '''
+        pass
+
+
+class S3ModelStorage(ModelStorage):
+    'Model is downloaded from MinIO by storage initializer of every predictor replica'
+
+    def storage_uri(self, run_id: str) -> str:
+        return 's3://%s/%s/' % (MODELS_BUCKET, run_id)
+
+    def stage(self, run_id: str) -> bool:
+        return False
+
+
+class PvcModelStorage(ModelStorage):
+    '''
+    Copies the model from MinIO to PersistentVolumeClaim (in deployment namespace) once, with
+    a Job running KServe storage initializer. Predictor replicas mount the volume (read-only)
+    instead of downloading the model on every start, e.g. when scaling out.
+    '''
+    def __init__(self, settings: Dict, namespace: str, timeout: int = STAGING_TIMEOUT) -> None:
+        self.logger = logging.getLogger('kfops')
+        self.settings = settings
+        self.namespace = namespace
+        self.timeout = timeout
+        self.pvc_name = settings['pvc_name']
+        self.path = settings.get('path', MODELS_BUCKET).strip('/')
+
+    def storage_uri(self, run_id: str) -> str:
+        return 'pvc://%s/%s/%s/' % (self.pvc_name, self.path, run_id)
+
+    @staticmethod
+    def label_value(run_id: str) -> str:
+        return re.sub(r'[^A-Za-z0-9-_.]', '-', run_id)[:63].strip('-_.')
+
+    def job_name(self, run_id: str) -> str:
+        '''Staging Job is named after the model and its destination, so concurrent deployments
+        (e.g. of model variants) can't start it twice'''
+        digest = hashlib.sha256(('%s/%s/%s' % (self.pvc_name, self.path, run_id)).encode()).hexdigest()
+        return 'kfops-model-staging-%s' % digest[:16]
+
+    def read_job(self, name: str):
+        'Returns Job `name` or None if it does not exist'
+        try:
+            return batch_v1_api.read_namespaced_job_status(name, self.namespace)
+        except ApiException as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def stage(self, run_id: str) -> bool:
+        name = self.job_name(run_id)
+        job = self.read_job(name)
+        if job and job.status.succeeded:
+            return False
+
+        if job and failure(job):
+            # Staging failed during earlier deployment, it's started again
+            self.logger.info('Deleting failed Job %s' % name)
+            try:
+                batch_v1_api.delete_namespaced_job(name, self.namespace, propagation_policy='Background')
+            except ApiException as e:
+                if e.status != 404:
+                    raise
+            self.wait_deleted(name)
+            job = None
+
+        if job is None:
+            try:
+                batch_v1_api.create_namespaced_job(self.namespace, body=self.job_manifest(run_id))
+            except ApiException as e:
+                # Started by another deployment in the meantime
+                if e.status != 409:
+                    raise
+        self.logger.info('Staging model of RUN_ID: %s on PVC %s (Job %s)' % (run_id, self.pvc_name, name))
+        self.wait_completed(name)
+        return True
+
+    def wait_deleted(self, name: str) -> None:
+        deadline = time.monotonic() + self.timeout
+        while self.read_job(name) is not None:
+            if time.monotonic() > deadline:
+                raise ModelStorageException('Timed out waiting for deletion of Job %s (%ss)' % (name, self.timeout))
+            time.sleep(STAGING_CHECK_INTERVAL)
+
+    def wait_completed(self, name: str) -> None:
+        deadline = time.monotonic() + self.timeout
+        while True:
+            job = batch_v1_api.read_namespaced_job_status(name, self.namespace)
+            if job.status.succeeded:
+                return
+            failed = failure(job)
+            if failed:
+                raise ModelStorageException('Job %s failed: %s %s' % (name, failed.reason, failed.message or ''))
+            if time.monotonic() > deadline:
+                raise ModelStorageException('Timed out waiting for Job %s (%ss)' % (name, self.timeout))
+            time.sleep(STAGING_CHECK_INTERVAL)
+
+    def job_manifest(self, run_id: str) -> Dict:
+        container = {
+            'name': 'storage-initializer',
+            'image': self.settings.get('storage_initializer_image', STORAGE_INITIALIZER_IMAGE),
+            'args': [S3ModelStorage().storage_uri(run_id), '/mnt/models/%s/%s' % (self.path, run_id)],
+            'volumeMounts': [{'name': 'models', 'mountPath': '/mnt/models'}]
+        }
+        if self.settings.get('credentials_secret'):
+            container['envFrom'] = [{'secretRef': {'name': self.settings['credentials_secret']}}]
+        if self.settings.get('s3_endpoint'):
+            container['env'] = [
+                {'name': 'S3_ENDPOINT', 'value': self.settings['s3_endpoint']},
+                {'name': 'S3_USE_HTTPS', 'value': '1' if self.settings.get('s3_use_https') else '0'}
+            ]
+
+        return {
+            'apiVersion': 'batch/v1',
+            'kind': 'Job',
+            'metadata': {
+                'name': self.job_name(run_id),
+                'labels': {
+                    'app.kubernetes.io/managed-by': 'kfops',
+                    STAGING_LABEL: self.label_value(run_id)
+                }
+            },
+            'spec': {
+                'backoffLimit': 2,
+                'template': {
+                    'spec': {
+                        'restartPolicy': 'Never',
+                        'containers': [container],
+                        'volumes': [{'name': 'models', 'persistentVolumeClaim': {'claimName': self.pvc_name}}]
+                    }
+                }
+            }
+        }
+
+
+def model_storage(settings: Optional[Dict], namespace: str) -> ModelStorage:
+    'Creates model storage from `deployment.model_storage` settings in config.yaml'
+    if not settings:
+        return S3ModelStorage()
+    if settings.get('type') == 'pvc':
+        return PvcModelStorage(settings, namespace)
+    raise InvalidConfigException('Unsupported model storage: %s' % settings.get('type'))
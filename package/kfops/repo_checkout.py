@@ -0,0 +1,318 @@
+"""
+Check out Pull Request code from a cached repository mirror
+
+Usage:
+    repo_checkout <repo_owner> <repo_name> <pr_number> <destination> [<pull_request_comment>]
+    repo_checkout --remove <repo_owner> <repo_name> <destination>
+
+Keeps a bare mirror of each repository under REPOSITORY_CACHE_PATH (persistent volume
+shared by all workflow runs). The mirror is refreshed incrementally with `git fetch`
+and every command gets its own worktree created from the mirror. Worktrees are named after
+their destination folder, which has to be unique for every workflow run. They are locked while
+in use, as folders of other runs are not visible to this pod, and removed with `--remove`.
+Git LFS objects are stored in the mirror as well, so they are downloaded only once.
+
+The mirror is a partial (blobless) clone, file contents are downloaded only when checked out.
+If `pull_request_comment` is passed and `repository.sparse_checkout` is enabled in config.yaml,
+checkout is performed in two phases: first `config_files/config.yaml` is read from the
+mirror, then only paths required by the command are checked out (sparse checkout).
+"""
+
+import os
+import sys
+import base64
+import fcntl
+import time
+import shutil
+import logging
+import subprocess
+import yaml
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from .helpers import set_logger, parse_pr_comment
+from .config import Config
+
+REPOSITORY_CACHE_PATH = os.environ.get('REPOSITORY_CACHE_PATH', '/cache/repositories')
+GITHUB_TOKEN = os.environ.get('GITHUB_TOKEN')
+GITHUB_PAT_USERNAME = os.environ.get('GITHUB_PAT_USERNAME')
+# Worktrees of runs which did not remove them (e.g. killed pods) are pruned after this time
+STALE_WORKTREE_HOURS = 24
+
+
+class RepositoryCheckoutException(Exception):
+    pass
+
+
+class RepositoryMirror:
+    '''
+    Bare mirror of a single repository stored in `cache_path`.
+
+    Parameters:
+        cache_path: Folder where mirrors of all repositories are kept.
+        owner: Repository owner.
+        name: Repository name.
+        url: Remote URL. Defaults to Github repository url.
+        username, token: Credentials passed to git as HTTP header (never stored in the mirror).
+    '''
+    def __init__(self, cache_path: str, owner: str, name: str, url: Optional[str] = None,
+                 username: Optional[str] = None, token: Optional[str] = None) -> None:
+        self.logger = logging.getLogger('kfops')
+        self.owner = owner
+        self.name = name
+        self.url = url or 'https://github.com/%s/%s' % (owner, name)
+        self.path = os.path.join(cache_path, owner, '%s.git' % name)
+        self.lock_path = os.path.join(cache_path, owner, '%s.lock' % name)
+        self.username = username
+        self.token = token
+
+    def _auth_config(self) -> List[str]:
+        if not self.token:
+            return []
+        credentials = base64.b64encode(
+            ('%s:%s' % (self.username or 'x-access-token', self.token)).encode()).decode()
+        return ['-c', 'http.extraHeader=Authorization: Basic %s' % credentials]
+
+    def git(self, *args, cwd: Optional[str] = None, env: Optional[Dict] = None,
+            git_dir: bool = True) -> str:
+        command = ['git'] + self._auth_config()
+        if git_dir:
+            command += ['--git-dir', self.path]
+        command += list(args)
+
+        process_env = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+        process_env.update(env or {})
+
+        result = subprocess.run(
+            command, cwd=cwd, env=process_env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if result.returncode != 0:
+            raise RepositoryCheckoutException(
+                'Command "git %s" failed: %s' % (' '.join(args), result.stderr.strip()))
+        return result.stdout.strip()
+
+    @contextmanager
+    def lock(self):
+        'Serializes mirror updates between concurrently running workflows'
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        with open(self.lock_path, 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.path, 'HEAD'))
+
+    def ensure(self) -> None:
+        'Creates the mirror if it does not exist yet'
+        if self.exists():
+            return
+        self.logger.info('Creating repository mirror in %s' % self.path)
+        os.makedirs(self.path, exist_ok=True)
+        self.git('init', '--bare', '--quiet')
+        self.git('remote', 'add', 'origin', self.url)
+        self.git('config', 'remote.origin.fetch', '+refs/heads/*:refs/heads/*')
+        self.git('config', 'gc.auto', '0')
+
+    def enable_partial_clone(self) -> None:
+        'Fetch commits and trees only, blobs are downloaded on demand'
+        self.git('config', 'remote.origin.promisor', 'true')
+        self.git('config', 'remote.origin.partialclonefilter', 'blob:none')
+
+    def fetch(self, refspecs: Optional[List[str]] = None) -> None:
+        'Incrementally updates branches (and optionally additional refs) from remote'
+        refspecs = refspecs or []
+        self.git('fetch', '--prune', '--quiet', 'origin',
+                 '+refs/heads/*:refs/heads/*', *refspecs)
+
+    def prune_worktrees(self, max_age_hours: int = STALE_WORKTREE_HOURS) -> None:
+        '''Removes administrative files of worktrees left behind by runs that did not remove
+        them. Worktrees of running workflows are locked, so they are kept even though their
+        (pod-local) folders do not exist in this pod.
+        '''
+        worktrees_path = os.path.join(self.path, 'worktrees')
+        if not os.path.isdir(worktrees_path):
+            return
+        expire = time.time() - max_age_hours * 3600
+        for name in os.listdir(worktrees_path):
+            lock_file = os.path.join(worktrees_path, name, 'locked')
+            if os.path.exists(lock_file) and os.path.getmtime(lock_file) < expire:
+                self.logger.info('Unlocking stale worktree %s' % name)
+                os.remove(lock_file)
+        self.git('worktree', 'prune', '--expire', '%s.hours.ago' % max_age_hours)
+
+    def fetch_pull_request(self, pr_number: int) -> str:
+        'Fetches Pull Request head into the mirror and returns its commit sha'
+        ref = 'refs/pull/%s/head' % pr_number
+        with self.lock():
+            self.ensure()
+            self.enable_partial_clone()
+            self.fetch(['+%s:%s' % (ref, ref)])
+            self.prune_worktrees()
+        return self.git('rev-parse', ref)
+
+    def read_file(self, commit: str, path: str) -> Optional[str]:
+        'Returns content of file `path` at `commit` or None if it does not exist'
+        try:
+            return self.git('show', '%s:%s' % (commit, path))
+        except RepositoryCheckoutException:
+            return None
+
+    def add_worktree(self, commit: str, destination: str, paths: Optional[List[str]] = None) -> None:
+        '''Checks out `commit` into `destination` as a locked worktree of the mirror.
+        If `paths` are passed, only these paths are checked out (sparse checkout).
+        '''
+        if os.path.exists(destination) and os.listdir(destination):
+            raise RepositoryCheckoutException(
+                'Checkout destination %s is not empty' % destination)
+
+        lfs_env = {'GIT_LFS_SKIP_SMUDGE': '1'}
+        with self.lock():
+            if paths:
+                self.enable_worktree_config()
+                self.git('worktree', 'add', '--lock', '--no-checkout', '--detach', '--force',
+                         destination, commit)
+            else:
+                self.git('worktree', 'add', '--lock', '--detach', '--force', destination, commit,
+                         env=lfs_env)
+
+        if paths:
+            self.sparse_checkout(destination, paths, env=lfs_env)
+
+        if self.uses_lfs(destination):
+            self.lfs_pull(destination, paths)
+
+    def enable_worktree_config(self) -> None:
+        'Allows settings (like sparse checkout) of a single worktree, see `git config --worktree`'
+        if os.path.exists(os.path.join(self.path, 'config.worktree')):
+            return
+        self.git('config', 'core.repositoryformatversion', '1')
+        self.git('config', 'extensions.worktreeConfig', 'true')
+        # Shared core.bare would apply to worktrees too, it belongs to the mirror only
+        self.git('config', '--worktree', 'core.bare', 'true')
+        self.git('config', '--unset', 'core.bare')
+
+    def sparse_checkout(self, worktree: str, paths: List[str], env: Optional[Dict] = None) -> None:
+        '''Checks out only `paths` into `worktree` created without checkout. Sparse checkout is
+        configured directly, `git sparse-checkout` is not available in git < 2.25 (e.g. Debian buster).
+        '''
+        self.git('config', '--worktree', 'core.sparseCheckout', 'true', cwd=worktree, git_dir=False)
+        worktree_git_dir = self.git('rev-parse', '--absolute-git-dir', cwd=worktree, git_dir=False)
+        os.makedirs(os.path.join(worktree_git_dir, 'info'), exist_ok=True)
+        with open(os.path.join(worktree_git_dir, 'info', 'sparse-checkout'), 'w') as f:
+            f.write(''.join('/%s\n' % p.lstrip('/') for p in paths))
+        self.git('read-tree', '-mu', 'HEAD', cwd=worktree, git_dir=False, env=env)
+
+    def remove_worktree(self, destination: str) -> None:
+        'Unlocks and removes worktree created by `add_worktree`'
+        with self.lock():
+            self.git('worktree', 'unlock', destination)
+            self.git('worktree', 'remove', '--force', destination)
+
+    def uses_lfs(self, worktree: str) -> bool:
+        attributes = os.path.join(worktree, '.gitattributes')
+        if not os.path.exists(attributes):
+            return False
+        with open(attributes, 'r') as f:
+            return 'filter=lfs' in f.read()
+
+    def lfs_pull(self, worktree: str, paths: Optional[List[str]] = None) -> None:
+        '''Downloads LFS objects missing from the mirror's LFS storage
+        (shared between all worktrees) and checks them out.
+        '''
+        if not shutil.which('git-lfs'):
+            self.logger.warning('Repository uses Git LFS but git-lfs is not installed.')
+            return
+        include = ['--include', ','.join(paths)] if paths else []
+        self.git('lfs', 'pull', *include, cwd=worktree, git_dir=False)
+
+
+def command_checkout_paths(command: str, config: Config) -> Optional[List[str]]:
+    '''Returns list of repository paths required to execute `command`.
+    Returns None if whole repository should be checked out.
+    '''
+    sparse_checkout = config.repository.get('sparse_checkout')
+    if not sparse_checkout or not sparse_checkout.get('enabled'):
+        return None
+
+    paths = ['config_files/', '.gitattributes']
+    paths += sparse_checkout.get('additional_paths') or []
+
+    if command in ['build', 'build_run']:
+        # Pipeline file is checked out together with modules located next to it
+        pipeline_folder = os.path.dirname(config.pipeline.pipeline_path)
+        paths.append(pipeline_folder + '/' if pipeline_folder else config.pipeline.pipeline_path)
+        if config.image_builder:
+            for image in config.image_builder.images:
+                paths.append(image.dockerfile_folder_path.rstrip('/') + '/')
+                paths += [p.rstrip('/') + '/' for p in image.other_folders_path]
+    elif command in ['deploy', 'staging_deploy', 'profile_deploy', 'rollback']:
+        if config.deployment:
+            paths.append(config.deployment.inference_service_function_path)
+            for variant in config.deployment.get('variants') or []:
+                if variant.get('inference_service_function_path'):
+                    paths.append(variant.inference_service_function_path)
+            if config.deployment.get('pre_deployment_test_sample_input_path'):
+                paths.append(config.deployment.pre_deployment_test_sample_input_path)
+            for section in ['load_test', 'latency_comparison', 'warmup', 'profiling', 'batcher_tuning']:
+                if config.deployment.get(section):
+                    paths.append(config.deployment[section].samples_path)
+    elif command != 'run':
+        return None
+
+    return paths
+
+
+def get_checkout_paths(mirror: RepositoryMirror, commit: str, pr_comment: str) -> Optional[List[str]]:
+    'First checkout phase, reads config.yaml from the mirror and computes paths to check out'
+    config_content = mirror.read_file(commit, 'config_files/config.yaml')
+    if config_content is None:
+        return None
+
+    command, _ = parse_pr_comment(pr_comment)
+    config = Config(
+        config=yaml.safe_load(config_content),
+        validate_files=False, check_files_existence=False)
+    return command_checkout_paths(command, config)
+
+
+def main():
+    set_logger()
+    logger = logging.getLogger('kfops')
+
+    args = sys.argv[1:]
+    if args[:1] == ['--remove'] and len(args) == 4:
+        owner, name, destination = args[1:]
+        mirror = RepositoryMirror(REPOSITORY_CACHE_PATH, owner, name)
+        try:
+            mirror.remove_worktree(destination)
+        except RepositoryCheckoutException as e:
+            logger.warning(e)
+        return
+    if len(args) not in [4, 5]:
+        logger.error('Usage: repo_checkout <repo_owner> <repo_name> <pr_number> <destination> ' +
+                     '[<pull_request_comment>]\n       ' +
+                     'repo_checkout --remove <repo_owner> <repo_name> <destination>')
+        sys.exit(1)
+    owner, name, pr_number, destination = args[:4]
+    pr_comment = args[4] if len(args) == 5 else None
+
+    mirror = RepositoryMirror(
+        REPOSITORY_CACHE_PATH, owner, name,
+        username=GITHUB_PAT_USERNAME, token=GITHUB_TOKEN)
+
+    try:
+        commit = mirror.fetch_pull_request(pr_number)
+        paths = get_checkout_paths(mirror, commit, pr_comment) if pr_comment else None
+        logger.info('Checking out Pull Request %s (commit %s) into %s' % (pr_number, commit, destination))
+        if paths:
+            logger.info('Sparse checkout of paths: %s' % ', '.join(paths))
+        mirror.add_worktree(commit, destination, paths=paths)
+    except RepositoryCheckoutException as e:
+        logger.error(e)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -10,10 +10,14 @@ Supported pull_request_comment commands:
     /build_run
     /deploy
     /staging_deploy
+    /profile_deploy
+    /rollback
 
 Supported optional pull_request_comment command parameters if command is run from PR comment:
     /deploy --run-id=<run_id> --force
     /staging_deploy --run-id=<run_id> --force
+    /profile_deploy --run-id=<run_id> --env=<staging|production> --force
+    /rollback --run-id=<run_id>
 """
 
 import os
@@ -28,6 +32,7 @@ PR_NUMBER = os.environ.get('PR_NUMBER')
 RUN_ENV = os.environ.get('RUN_ENV')
 KUBEFLOW_URL = os.environ.get('KUBEFLOW_URL')
 WORKFLOW_NAMESPACE = os.environ.get('WORKFLOW_NAMESPACE')
+STATUS_COMMENT_UPDATE_INTERVAL = float(os.environ.get('STATUS_COMMENT_UPDATE_INTERVAL', 0))
 
 def main():
     set_logger()
@@ -51,18 +56,33 @@ def main():
 
     from .handler import VersionControlHandler
     from .version_control_manager import GithubManager, DevelopmentDummyManager
+    from .state_store import ConfigMapStateStore, DevelopmentDummyStateStore
+    from .deployment_history import ConfigMapDeploymentHistory, DevelopmentDummyDeploymentHistory
 
     if RUN_ENV == 'development':
         manager = DevelopmentDummyManager
+        state_store = DevelopmentDummyStateStore()
+        deployment_history = DevelopmentDummyDeploymentHistory()
     else:
         manager = GithubManager
+        state_store = ConfigMapStateStore(
+            config.repository.owner, config.repository.name, PR_NUMBER,
+            namespace=config.workflow_namespace)
+        deployment_history = ConfigMapDeploymentHistory(namespace=config.workflow_namespace)
 
     github_handler = VersionControlHandler(
         client=client, 
         command=command, command_params=command_params,
         pr_number=PR_NUMBER, config=config,
-        VCManager=manager)
-    github_handler.exec_command()
+        VCManager=manager, state_store=state_store,
+        status_update_interval=STATUS_COMMENT_UPDATE_INTERVAL,
+        deployment_history=deployment_history)
+    try:
+        github_handler.exec_command()
+    finally:
+        github_api = getattr(github_handler.vc_manager, 'github_api', None)
+        if github_api is not None:
+            logger.info('Github API usage: %s' % github_api.metrics())
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,98 @@
+import logging
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+import requests
+from requests.exceptions import RequestException
+
+from .config import InvalidConfigException
+
+
+RevisionMetrics = namedtuple('RevisionMetrics', [
+    'requests',
+    'error_rate',
+    'p95_latency_ms'
+])
+
+
+class MetricsSourceException(Exception):
+    pass
+
+
+class MetricsSource(ABC):
+    'Serving metrics (traffic, errors, latency) of Knative revisions'
+
+    @abstractmethod
+    def revision_metrics(self, namespace: str, revision: str, window_seconds: int) -> RevisionMetrics:
+        'Returns metrics of `revision` aggregated over last `window_seconds`'
+        pass
+
+
+class PrometheusMetricsSource(MetricsSource):
+    '''
+    Reads metrics reported by Knative queue-proxy (`revision_app_request_*`)
+    from Prometheus HTTP API at `url`.
+    '''
+    def __init__(self, url: str, timeout: float = 10) -> None:
+        self.logger = logging.getLogger('kfops')
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _query(self, query: str) -> Optional[float]:
+        try:
+            resp = requests.get('%s/api/v1/query' % self.url, params={'query': query},
+                                timeout=self.timeout)
+            resp.raise_for_status()
+        except RequestException as e:
+            raise MetricsSourceException('Prometheus query failed: %s' % e)
+
+        result = resp.json().get('data', {}).get('result', [])
+        if not result:
+            return None
+        value = float(result[0]['value'][1])
+        # NaN is returned e.g. for quantile of empty histogram
+        return None if value != value else value
+
+    def revision_metrics(self, namespace: str, revision: str, window_seconds: int) -> RevisionMetrics:
+        selector = 'namespace_name="%s",revision_name="%s"' % (namespace, revision)
+        window = '%ss' % window_seconds
+
+        requests_count = self._query(
+            'sum(increase(revision_app_request_count{%s}[%s]))' % (selector, window)) or 0
+        errors = self._query(
+            'sum(increase(revision_app_request_count{%s,response_code_class="5xx"}[%s]))' %
+            (selector, window)) or 0
+        p95_latency = self._query(
+            'histogram_quantile(0.95, sum(rate(revision_app_request_latencies_bucket{%s}[%s])) by (le))' %
+            (selector, window))
+
+        return RevisionMetrics(
+            requests=requests_count,
+            error_rate=errors / requests_count if requests_count else 0,
+            p95_latency_ms=p95_latency)
+
+
+def metrics_source(settings: Dict) -> MetricsSource:
+    'Creates metrics source from `deployment.canary.metrics` settings in config.yaml'
+    if settings.get('type') == 'prometheus':
+        return PrometheusMetricsSource(settings['url'])
+    raise InvalidConfigException('Unsupported metrics source: %s' % settings.get('type'))
+
+
+def check_revision_metrics(metrics: RevisionMetrics, thresholds: Dict) -> List[str]:
+    'Returns list of violated thresholds (`deployment.canary` settings in config.yaml)'
+    if metrics.requests < thresholds.get('min_requests', 1):
+        # Not enough traffic to judge the revision
+        return []
+
+    violations = []
+    max_error_rate = thresholds.get('max_error_rate')
+    if max_error_rate is not None and metrics.error_rate > max_error_rate:
+        violations.append('error rate %.2f%% exceeds %.2f%%' % (
+            metrics.error_rate * 100, max_error_rate * 100))
+    max_latency = thresholds.get('max_p95_latency_ms')
+    if max_latency is not None and metrics.p95_latency_ms is not None \
+            and metrics.p95_latency_ms > max_latency:
+        violations.append('p95 latency %.1f ms exceeds %s ms' % (metrics.p95_latency_ms, max_latency))
+    return violations
@@ -0,0 +1,138 @@
+import re
+import json
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from kubernetes.client.rest import ApiException
+
+from .k8s_api import v1_api
+
+HISTORY_KEY = 'history'
+MAX_HISTORY_LENGTH = 100
+MAX_CONFLICT_RETRIES = 5
+
+
+class StateStore(ABC):
+    '''
+    Persistent, Pull Request scoped storage of variables (like VERSION_ID or RUN_ID)
+    produced by kfops commands.
+    '''
+    @abstractmethod
+    def get(self, variable: str) -> Optional[str]:
+        'Returns last stored value of `variable` or None'
+        pass
+
+    @abstractmethod
+    def set(self, variables: Dict[str, str]) -> None:
+        'Stores `variables` and appends them to the history'
+        pass
+
+    @abstractmethod
+    def history(self) -> List[Dict]:
+        'Returns list of stored variables (oldest first)'
+        pass
+
+
+class DevelopmentDummyStateStore(StateStore):
+    def __init__(self):
+        self.variables = {}
+        self._history = []
+
+    def get(self, variable: str) -> Optional[str]:
+        return self.variables.get(variable)
+
+    def set(self, variables: Dict[str, str]) -> None:
+        self.variables.update(variables)
+        self._history += [{'variable': k, 'value': v} for k, v in variables.items()]
+
+    def history(self) -> List[Dict]:
+        return self._history
+
+
+class ConfigMapStateStore(StateStore):
+    '''
+    Keeps Pull Request state in a single ConfigMap (in kfops namespace) named after
+    repository and Pull Request number. Each variable lookup is a single read.
+    '''
+    def __init__(self, repo_owner: str, repo_name: str, pr_number: int, namespace: str = 'kfops'):
+        self.logger = logging.getLogger('kfops')
+        self.repo_owner = repo_owner
+        self.repo_name = repo_name
+        self.pr_number = pr_number
+        self.namespace = namespace
+        self.name = self.configmap_name(repo_owner, repo_name, pr_number)
+        self._data = None
+
+    @staticmethod
+    def configmap_name(repo_owner: str, repo_name: str, pr_number: int) -> str:
+        name = 'kfops-pr-state-%s-%s-%s' % (repo_owner, repo_name, pr_number)
+        name = re.sub(r'[^a-z0-9-]', '-', name.lower())
+        return name[:253].strip('-')
+
+    def _read(self):
+        try:
+            return v1_api.read_namespaced_config_map(name=self.name, namespace=self.namespace)
+        except ApiException as e:
+            if e.status == 404:
+                return None
+            raise
+
+    @property
+    def data(self) -> Dict:
+        if self._data is None:
+            configmap = self._read()
+            self._data = (configmap.data or {}) if configmap else {}
+        return self._data
+
+    def get(self, variable: str) -> Optional[str]:
+        return self.data.get(variable)
+
+    def history(self) -> List[Dict]:
+        return json.loads(self.data.get(HISTORY_KEY, '[]'))
+
+    def set(self, variables: Dict[str, str]) -> None:
+        for _ in range(MAX_CONFLICT_RETRIES):
+            configmap = self._read()
+            data = (configmap.data or {}) if configmap else {}
+
+            history = json.loads(data.get(HISTORY_KEY, '[]'))
+            time = datetime.utcnow().isoformat()
+            history += [{'variable': k, 'value': v, 'time': time} for k, v in variables.items()]
+
+            data = dict(data, **variables)
+            data[HISTORY_KEY] = json.dumps(history[-MAX_HISTORY_LENGTH:])
+
+            try:
+                if configmap:
+                    configmap.data = data
+                    v1_api.replace_namespaced_config_map(
+                        name=self.name, namespace=self.namespace, body=configmap)
+                else:
+                    v1_api.create_namespaced_config_map(
+                        namespace=self.namespace, body=self._manifest(data))
+                self._data = data
+                return
+            except ApiException as e:
+                # Modified (409 on replace) or created (409 on create) concurrently, retry
+                if e.status != 409:
+                    raise
+        raise Exception('Could not store Pull Request state in ConfigMap %s' % self.name)
+
+    def _manifest(self, data: Dict) -> Dict:
+        return {
+            'apiVersion': 'v1',
+            'kind': 'ConfigMap',
+            'metadata': {
+                'name': self.name,
+                'labels': {
+                    'app.kubernetes.io/managed-by': 'kfops',
+                    'kfops/pr-number': str(self.pr_number)
+                },
+                'annotations': {
+                    'kfops/repository': '%s/%s' % (self.repo_owner, self.repo_name)
+                }
+            },
+            'data': data
+        }
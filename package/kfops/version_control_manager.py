@@ -1,13 +1,70 @@
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple, Iterator, Optional
 from abc import ABC, abstractmethod
+from collections import namedtuple
+from itertools import islice
 import re
+import json
+import threading
 from urllib.error import HTTPError
 
-from ghapi.all import GhApi
-
+from .github_client import GithubClient
 from .config import set_config, Config
 default_config = set_config()
 
+COMMENTS_PER_PAGE = 100
+SNAPSHOT_HEAD_HISTORY_LENGTH = 100
+SNAPSHOT_COMMENTS_COUNT = 20
+
+PULL_REQUEST_SNAPSHOT_QUERY = '''
+query($owner: String!, $name: String!, $number: Int!, $historyLength: Int!, $commentsCount: Int!) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      mergeable
+      headRefName
+      baseRefName
+      baseRef { target { oid } }
+      headRef { target { ... on Commit { history(first: $historyLength) { nodes { oid } } } } }
+      labels(first: 100) { nodes { name } }
+      comments(last: $commentsCount) { nodes { body } }
+    }
+  }
+}
+'''
+
+LABEL_HOLDERS_QUERY = '''
+query($owner: String!, $name: String!, $number: Int!, $label: String!, $search: String!) {
+  repository(owner: $owner, name: $name) {
+    label(name: $label) { id }
+    pullRequest(number: $number) { id }
+  }
+  search(query: $search, type: ISSUE, first: 100) {
+    nodes {
+      ... on PullRequest { id number }
+      ... on Issue { id number }
+    }
+  }
+}
+'''
+
+PullRequestSnapshot = namedtuple('PullRequestSnapshot', [
+    'mergeable',
+    'head_ref',
+    'base_ref',
+    # True if base branch is fully merged into PR branch, None if it could not be determined
+    'contains_base',
+    'labels',
+    # Most recent comments (oldest first)
+    'recent_comments'
+])
+
+
+def last_page_number(link_header: Optional[str]) -> int:
+    'Reads number of the last page from pagination `Link` header'
+    if not link_header:
+        return 1
+    found = re.findall(r'<[^>]*[?&]page=(\d+)[^>]*>;\s*rel="last"', link_header)
+    return int(found[0]) if found else 1
+
 class VersionControlManager(ABC):
     @abstractmethod
     def __init__(self, issue_number: int):
@@ -18,6 +75,11 @@ class VersionControlManager(ABC):
         'Paginate through PR pages and fetch all comments'
         pass
 
+    @abstractmethod
+    def iter_comments(self, newest_first: bool = False) -> Iterator:
+        'Lazily paginate through PR comments, one page at a time'
+        pass
+
     @abstractmethod
     def extract_hidden_variables(self, variables: list, prefix: str) -> Dict:
         '''Extracts (prefixed) variables from Github pull request.
@@ -32,8 +94,18 @@ class VersionControlManager(ABC):
         pass
 
     @abstractmethod
-    def create_comment(self, body: str) -> None:
-        'Generic method to create PR comment'
+    def create_comment(self, body: str) -> Optional[int]:
+        'Generic method to create PR comment. Returns comment id.'
+        pass
+
+    @abstractmethod
+    def update_comment(self, comment_id: int, body: str) -> None:
+        'Replaces body of the comment created with `create_comment`'
+        pass
+
+    @abstractmethod
+    def find_comment(self, marker: str) -> Optional[int]:
+        'Returns id of the most recent comment containing `marker` or None'
         pass
 
     @abstractmethod
@@ -69,15 +141,25 @@ class DevelopmentDummyManager(VersionControlManager):
     def get_comments(self) -> Dict:
         return {}
 
+    def iter_comments(self, newest_first: bool = False) -> Iterator:
+        return iter([])
+
     def extract_hidden_variables(self, variables: list, prefix: str) -> Dict:
         return {}
 
     def add_label(self, label: str = 'Production') -> None:
         pass
 
-    def create_comment(self, body: str) -> None:
+    def create_comment(self, body: str) -> Optional[int]:
+        print(body)
+        return None
+
+    def update_comment(self, comment_id: int, body: str) -> None:
         print(body)
 
+    def find_comment(self, marker: str) -> Optional[int]:
+        return None
+
     def is_pr_diverged(self) -> bool:
         return False
 
@@ -95,59 +177,183 @@ class GithubManager(VersionControlManager):
         self.issue_number = issue_number
         self.config = config
         self.github_api = self.initialize_github_api()
+        self._snapshot = None
+        # Positions of comments created by this manager in `snapshot.recent_comments`
+        self._snapshot_comment_index = {}
+        # Comments are created and updated by the messenger's sender thread
+        self._snapshot_lock = threading.Lock()
         
     def initialize_github_api(self):
         repo_conf = self.config.repository
-        return GhApi(owner=repo_conf.owner, repo=repo_conf.name)
+        return GithubClient(owner=repo_conf.owner, repo=repo_conf.name)
+
+    @property
+    def snapshot(self) -> PullRequestSnapshot:
+        '''State of the PR fetched with single GraphQL query and shared by all checks
+        within the command. Mutations either update it or invalidate it.
+        '''
+        if self._snapshot is None:
+            self._snapshot = self._fetch_snapshot()
+        return self._snapshot
+
+    def invalidate_snapshot(self) -> None:
+        with self._snapshot_lock:
+            self._snapshot = None
+            self._snapshot_comment_index = {}
+
+    def _recent_comments(self) -> List[str]:
+        'Copy of snapshot comments, safe to iterate while comments are being published'
+        snapshot = self.snapshot
+        with self._snapshot_lock:
+            return list(snapshot.recent_comments)
+
+    def _graphql(self, query: str, variables: Optional[Dict] = None) -> Dict:
+        res = self.github_api('/graphql', 'POST', data={'query': query, 'variables': variables or {}})
+        if res.get('errors'):
+            raise Exception('Github GraphQL query failed: %s' % 
+                            '; '.join([e['message'] for e in res['errors']]))
+        return res['data']
+
+    def _fetch_snapshot(self) -> PullRequestSnapshot:
+        repo_conf = self.config.repository
+        repository = self._graphql(PULL_REQUEST_SNAPSHOT_QUERY, {
+            'owner': repo_conf.owner,
+            'name': repo_conf.name,
+            'number': int(self.issue_number),
+            'historyLength': SNAPSHOT_HEAD_HISTORY_LENGTH,
+            'commentsCount': SNAPSHOT_COMMENTS_COUNT
+        })['repository']
+        pr = repository['pullRequest']
+
+        contains_base = None
+        if pr.get('baseRef') and pr.get('headRef'):
+            head_history = [c['oid'] for c in pr['headRef']['target']['history']['nodes']]
+            if pr['baseRef']['target']['oid'] in head_history:
+                contains_base = True
+
+        return PullRequestSnapshot(
+            mergeable={'MERGEABLE': True, 'CONFLICTING': False}.get(pr['mergeable']),
+            head_ref=pr['headRefName'],
+            base_ref=pr['baseRefName'],
+            contains_base=contains_base,
+            labels=[l['name'] for l in pr['labels']['nodes']],
+            recent_comments=[c['body'] for c in pr['comments']['nodes']]
+        )
+
+    def _list_comments(self, page: int):
+        comments = self.github_api.issues.list_comments(
+            self.issue_number, per_page=COMMENTS_PER_PAGE, page=page)
+        return comments, last_page_number(self.github_api.recv_hdrs.get('Link'))
 
     def get_comments(self):
-        comments = []
-        page = 1
-        while True:
-            tmp_comments = self.github_api.issues.list_comments(self.issue_number, page=page)
-            page += 1
-            comments += tmp_comments
-            if not tmp_comments:
-                break
-        return comments
+        return list(self.iter_comments())
 
-    def extract_hidden_variables(self, variables: list, prefix: str) -> Dict:
-        found_vars = {}
-        for c in self.get_comments():
-            for var in variables:
-                if var in c.body:
-                    found = re.findall(r'<!-- %s_%s=(.*?) -->' % (prefix, var), c.body, re.M)
-                    if found:
-                        found_vars[var] = found[0]
-        return found_vars
+    def iter_comments(self, newest_first: bool = False) -> Iterator:
+        '''Github returns comments oldest first. First page tells (with `Link` header) where
+        the last page is, so newest comments are reached with at most one additional request.
+        '''
+        first_page, last_page = self._list_comments(page=1)
 
-    def _maybe_create_label(self, name: str) -> None:
-        try:
-            self.github_api.issues.get_label(name)
-        except HTTPError as e:
-            self.github_api.issues.create_label(name, color='d73a4a')
+        if not newest_first:
+            yield from first_page
+            for page in range(2, last_page + 1):
+                yield from self._list_comments(page)[0]
+        else:
+            for page in range(last_page, 1, -1):
+                yield from reversed(self._list_comments(page)[0])
+            yield from reversed(first_page)
 
-    def add_label(self, label: str = 'Production'):
-        self._maybe_create_label(label)
+    def extract_hidden_variables(self, variables: list, prefix: str) -> Dict:
+        def find_vars(bodies):
+            for body in bodies:
+                for var in variables:
+                    if var not in found_vars and var in body:
+                        found = re.findall(r'<!-- %s_%s=(.*?) -->' % (prefix, var), body, re.M)
+                        if found:
+                            found_vars[var] = found[-1]
+                if len(found_vars) == len(variables):
+                    return True
+            return False
 
-        for i in self.github_api.issues.list(filter='all', labels=label):
-            self.github_api.issues.remove_label(i.number, name=label)
+        found_vars = {}
+        # Snapshot keeps most recent comments, older ones are scanned only if needed
+        if find_vars(reversed(self._recent_comments())):
+            return found_vars
 
-        self.github_api.issues.add_labels(self.issue_number, labels=[label, ])
+        found_vars = {}
+        find_vars(c.body for c in self.iter_comments(newest_first=True))
+        return found_vars
 
-    def create_comment(self, body: str):
-        self.github_api.issues.create_comment(
+    def add_label(self, label: str = 'Production'):
+        '''Moves `label` to current PR. Issues and PRs holding the label are found with
+        a single search and the label is moved with one batched mutation.
+        '''
+        repo_conf = self.config.repository
+        res = self._graphql(LABEL_HOLDERS_QUERY, {
+            'owner': repo_conf.owner,
+            'name': repo_conf.name,
+            'number': int(self.issue_number),
+            'label': label,
+            'search': 'repo:%s/%s label:"%s"' % (repo_conf.owner, repo_conf.name, label)
+        })
+
+        if res['repository']['label']:
+            label_id = res['repository']['label']['id']
+        else:
+            label_id = self.github_api.issues.create_label(label, color='d73a4a').node_id
+
+        holders = [n for n in res['search']['nodes']
+                   if n and n.get('number') != int(self.issue_number)]
+
+        mutations = ['remove%s: removeLabelsFromLabelable(input: {labelableId: %s, labelIds: [%s]}) ' \
+                     '{ clientMutationId }' % (i, json.dumps(h['id']), json.dumps(label_id))
+                     for i, h in enumerate(holders)]
+        mutations.append('add: addLabelsToLabelable(input: {labelableId: %s, labelIds: [%s]}) ' \
+                         '{ clientMutationId }' % (json.dumps(res['repository']['pullRequest']['id']),
+                                                    json.dumps(label_id)))
+        self._graphql('mutation { %s }' % ' '.join(mutations))
+
+        if self._snapshot is not None and label not in self._snapshot.labels:
+            self._snapshot.labels.append(label)
+
+    def create_comment(self, body: str) -> int:
+        comment = self.github_api.issues.create_comment(
             self.issue_number, body,
             accept='application/vnd.github.v3.html+json')
+        with self._snapshot_lock:
+            if self._snapshot is not None:
+                self._snapshot_comment_index[comment.id] = len(self._snapshot.recent_comments)
+                self._snapshot.recent_comments.append(body)
+        return comment.id
+
+    def update_comment(self, comment_id: int, body: str) -> None:
+        self.github_api.issues.update_comment(
+            comment_id, body,
+            accept='application/vnd.github.v3.html+json')
+        with self._snapshot_lock:
+            if self._snapshot is not None and comment_id in self._snapshot_comment_index:
+                self._snapshot.recent_comments[self._snapshot_comment_index[comment_id]] = body
+
+    def find_comment(self, marker: str) -> Optional[int]:
+        'Only the most recent page of comments is searched'
+        for comment in islice(self.iter_comments(newest_first=True), COMMENTS_PER_PAGE):
+            if marker in comment.body:
+                return comment.id
+        return None
 
     def is_pr_diverged(self):
-        pr = self.github_api.pulls.get(self.issue_number)
-        comp = self.github_api.repos.compare_commits(pr.head.ref, pr.base.ref)
+        if self.snapshot.contains_base:
+            return False
+
+        # Base branch commit not found in recent history of PR branch, compare branches
+        comp = self.github_api.repos.compare_commits(self.snapshot.head_ref, self.snapshot.base_ref)
         return True if comp.status == 'diverged' else False
 
     def is_pr_mergeable(self):
-        pr = self.github_api.pulls.get(self.issue_number)
-        return pr.mergeable
+        if self.snapshot.mergeable is None:
+            # Github computes mergeability in background, ask again once
+            self.invalidate_snapshot()
+        return self.snapshot.mergeable
 
     def merge_pr(self) -> Tuple[bool, str]:
         try:
@@ -155,6 +361,8 @@ class GithubManager(VersionControlManager):
             return True, None
         except HTTPError as e:
             return False, e
+        finally:
+            self.invalidate_snapshot()
 
     def close_pr(self) -> Tuple[bool, str]:
         try:
@@ -162,3 +370,5 @@ class GithubManager(VersionControlManager):
             return True, None
         except HTTPError as e:
             return False, e
+        finally:
+            self.invalidate_snapshot()
@@ -0,0 +1,112 @@
+import json
+import time
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeGithubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        payload = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        headers = dict(self._rate_limit_headers(), **(headers or {}))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _rate_limit_headers(self):
+        server = self.server
+        if server.rate_limit is None:
+            return {}
+        return {
+            'X-RateLimit-Limit': str(server.rate_limit),
+            'X-RateLimit-Remaining': str(server.rate_limit_remaining),
+            'X-RateLimit-Reset': str(int(time.time()) + server.rate_limit_reset_in)
+        }
+
+    def _rate_limited(self):
+        '''Rejects request if it exceeds simulated primary or secondary rate limit.
+        Primary limit resets right after rejected request.
+        '''
+        server = self.server
+        if server.secondary_limit_responses:
+            server.secondary_limit_responses -= 1
+            self._send(403, {'message': 'You have exceeded a secondary rate limit.'},
+                       headers={'Retry-After': str(server.retry_after)})
+            return True
+        if server.rate_limit is None:
+            return False
+        if server.rate_limit_remaining == 0:
+            self._send(403, {'message': 'API rate limit exceeded.'})
+            server.rate_limit_remaining = server.rate_limit
+            return True
+        server.rate_limit_remaining -= 1
+        return False
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(('GET', self.path))
+        if self._rate_limited():
+            return
+
+        path = self.path.split('?')[0]
+        if path not in server.resources:
+            return self._send(404, {'message': 'Not Found'})
+
+        body = server.resources[path]
+        etag = '"%s"' % hashlib.md5(json.dumps(body).encode()).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            server.not_modified += 1
+            return self._send(304, headers={'ETag': etag})
+        self._send(200, body, headers={'ETag': etag})
+
+    def do_POST(self):
+        server = self.server
+        server.requests.append(('POST', self.path))
+        if self._rate_limited():
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(length) or b'{}')
+
+        path = self.path.split('?')[0]
+        server.resources.setdefault(path, []).append(data)
+        self._send(201, data)
+
+
+class FakeGithubServer(ThreadingHTTPServer):
+    '''
+    Minimal Github REST API for tests. Serves (and accepts POST of) JSON resources
+    stored in `resources` dict (keyed by path) and answers conditional requests with 304.
+
+    Rate limits are simulated when `rate_limit` is set (requests per window, remaining
+    budget in `rate_limit_remaining`). Next `secondary_limit_responses` requests are
+    rejected with `Retry-After: <retry_after>` header.
+    '''
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeGithubHandler)
+        self.resources = {}
+        self.requests = []
+        self.not_modified = 0
+        self.rate_limit = None
+        self.rate_limit_remaining = None
+        self.rate_limit_reset_in = 3600
+        self.secondary_limit_responses = 0
+        self.retry_after = 60
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s' % self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,48 @@
+import json
+from unittest.mock import patch
+from munch import munchify
+from kubernetes.client.rest import ApiException
+
+from package.kfops.deployment_history import ConfigMapDeploymentHistory
+
+
+def configmap(data):
+    return munchify({'metadata': {'name': 'test'}, 'data': data})
+
+def test_configmap_name():
+    name = ConfigMapDeploymentHistory.configmap_name('Prod', 'sklearn.iris')
+    assert name == 'kfops-deployments-prod-sklearn-iris'
+
+@patch('package.kfops.deployment_history.v1_api')
+def test_find_uses_index(v1_api):
+    entry = {'run_id': '1', 'revision': 'rev-1'}
+    v1_api.read_namespaced_config_map.return_value = configmap({
+        'history': json.dumps([entry]), 'run.1': json.dumps(entry)})
+    history = ConfigMapDeploymentHistory()
+
+    assert history.find('prod', 'sklearn-iris', '1') == entry
+    assert history.find('prod', 'sklearn-iris', '2') is None
+    assert history.entries('prod', 'sklearn-iris') == [entry]
+    assert v1_api.read_namespaced_config_map.call_count == 1
+
+@patch('package.kfops.deployment_history.v1_api')
+def test_record_creates_configmap(v1_api):
+    v1_api.read_namespaced_config_map.side_effect = ApiException(status=404)
+    history = ConfigMapDeploymentHistory(namespace='kfops')
+
+    history.record('prod', 'sklearn-iris', {'run_id': '1', 'revision': 'rev-1'})
+
+    body = v1_api.create_namespaced_config_map.call_args[1]['body']
+    assert body['metadata']['name'] == 'kfops-deployments-prod-sklearn-iris'
+    assert json.loads(body['data']['run.1'])['revision'] == 'rev-1'
+    assert history.entries('prod', 'sklearn-iris')[0]['revision'] == 'rev-1'
+
+@patch('package.kfops.deployment_history.v1_api')
+def test_record_retries_on_conflict(v1_api):
+    v1_api.read_namespaced_config_map.return_value = configmap({})
+    v1_api.replace_namespaced_config_map.side_effect = [ApiException(status=409), None]
+    history = ConfigMapDeploymentHistory()
+
+    history.record('prod', 'sklearn-iris', {'run_id': '2', 'revision': 'rev-2'})
+
+    assert v1_api.replace_namespaced_config_map.call_count == 2
@@ -0,0 +1,51 @@
+import json
+from datetime import datetime, timezone
+from munch import munchify
+
+from package.kfops.deployment_timing import pod_phases, image_pull_seconds, phase_table, append_history
+
+
+def at(second):
+    return datetime(2024, 1, 1, 0, 0, second, tzinfo=timezone.utc)
+
+def event(reason, second):
+    return munchify({'reason': reason, 'last_timestamp': at(second), 'event_time': None, 'first_timestamp': at(second)})
+
+pod = munchify({
+    'metadata': {'name': 'rev-1-deployment-abc', 'creation_timestamp': at(0)},
+    'status': {
+        'conditions': [
+            {'type': 'PodScheduled', 'status': 'True', 'last_transition_time': at(2)},
+            {'type': 'Ready', 'status': 'True', 'last_transition_time': at(50)}
+        ],
+        'init_container_statuses': [{'name': 'storage-initializer', 'state': {
+            'terminated': {'started_at': at(10), 'finished_at': at(30)}}}],
+        'container_statuses': [
+            {'name': 'queue-proxy', 'state': {'running': {'started_at': at(31)}}},
+            {'name': 'kserve-container', 'state': {'running': {'started_at': at(40)}}}
+        ]
+    }
+})
+
+def test_image_pull_seconds():
+    events = [event('Pulling', 3), event('Pulled', 8), event('Scheduled', 2),
+              event('Pulled', 31), event('Pulling', 32), event('Pulled', 39)]
+    assert image_pull_seconds(events) == 12
+
+def test_pod_phases():
+    phases = pod_phases(pod, [event('Pulling', 3), event('Pulled', 8)])
+    assert phases == {'scheduling': 2, 'image_pull': 5, 'storage_initializer': 20, 'model_load': 10}
+
+def test_phase_table():
+    table = phase_table({'scheduling': 2, 'image_pull': None}, total=60)
+    assert '<td>Scheduling</td><td>2.0s</td>' in table
+    assert '<td>Image pull</td><td>-</td>' in table
+    assert '<b>60.0s</b>' in table
+
+def test_append_history(tmp_path):
+    path = str(tmp_path / 'deployments' / 'timing.jsonl')
+    append_history(path, {'run_id': '1'})
+    append_history(path, {'run_id': '2'})
+
+    with open(path) as f:
+        assert [json.loads(line)['run_id'] for line in f] == ['1', '2']
@@ -0,0 +1,181 @@
+import time
+import pytest
+import threading
+from unittest.mock import patch
+from urllib.error import HTTPError
+from package.kfops.github_client import GithubClient, MemoryResponseCache, FileResponseCache, \
+    RateLimiter
+from package.tests.fake_github_server import FakeGithubServer
+
+comments_path = '/repos/owner/repo/issues/1/comments'
+
+@pytest.fixture
+def server():
+    with FakeGithubServer() as s:
+        s.resources[comments_path] = [{'id': 1, 'body': 'first'}]
+        yield s
+
+def get_client(server, cache=None, rate_limiter=None):
+    return GithubClient(owner='owner', repo='repo', token='token',
+                        cache=cache or MemoryResponseCache(), gh_host=server.url,
+                        rate_limiter=rate_limiter or RateLimiter(mutation_interval=0))
+
+def test_conditional_request_cache_hit(server):
+    client = get_client(server)
+
+    first = client.issues.list_comments(1)
+    second = client.issues.list_comments(1)
+
+    assert first[0].body == second[0].body == 'first'
+    assert client.cache_misses == 1
+    assert client.cache_hits == 1
+    assert server.not_modified == 1
+
+def test_conditional_request_resource_modified(server):
+    client = get_client(server)
+    client.issues.list_comments(1)
+
+    server.resources[comments_path].append({'id': 2, 'body': 'second'})
+    comments = client.issues.list_comments(1)
+
+    assert [c.body for c in comments] == ['first', 'second']
+    assert client.cache_misses == 2
+    assert client.cache_hits == 0
+
+def test_shared_file_cache(server, tmp_path):
+    get_client(server, cache=FileResponseCache(str(tmp_path))).issues.list_comments(1)
+
+    client = get_client(server, cache=FileResponseCache(str(tmp_path)))
+    client.issues.list_comments(1)
+
+    assert client.cache_hits == 1
+
+def test_post_is_not_cached(server):
+    client = get_client(server)
+
+    client.issues.create_comment(1, 'new comment')
+
+    assert client.cache_misses == 0
+    assert server.resources[comments_path][-1] == {'body': 'new comment'}
+
+def test_http_error_is_raised(server):
+    client = get_client(server)
+
+    with pytest.raises(HTTPError):
+        client.issues.get_label('missing')
+
+def test_response_headers_per_thread(server):
+    server.resources['/repos/owner/repo/issues/2/comments'] = [{'id': 2, 'body': 'other'}]
+    client = get_client(server)
+    client.issues.list_comments(1)
+    etag = client.recv_hdrs['ETag']
+
+    thread = threading.Thread(target=lambda: client.issues.list_comments(2))
+    thread.start()
+    thread.join()
+
+    assert client.recv_hdrs['ETag'] == etag
+
+def test_rate_limit_metrics(server):
+    server.rate_limit, server.rate_limit_remaining = 5000, 100
+    client = get_client(server)
+
+    client.issues.list_comments(1)
+
+    metrics = client.metrics()
+    assert metrics['rate_limit_remaining'] == 99
+    assert metrics['rate_limit_limit'] == 5000
+    assert metrics['cache_misses'] == 1
+
+@patch.object(RateLimiter, '_sleep')
+def test_primary_rate_limit_exceeded(sleep, server):
+    server.rate_limit, server.rate_limit_remaining = 5000, 0
+    server.rate_limit_reset_in = 30
+    client = get_client(server)
+
+    comments = client.issues.list_comments(1)
+
+    assert comments[0].body == 'first'
+    assert client.rate_limiter.rate_limited_responses == 1
+    assert 25 < sleep.call_args[0][0] <= 30
+
+@patch.object(RateLimiter, '_sleep')
+def test_secondary_rate_limit_retry_after(sleep, server):
+    server.secondary_limit_responses = 1
+    server.retry_after = 5
+    client = get_client(server)
+
+    client.issues.create_comment(1, body='second')
+
+    assert len(server.requests) == 2
+    assert 4 < sleep.call_args[0][0] <= 5
+    assert server.resources[comments_path][-1]['body'] == 'second'
+
+@patch.object(RateLimiter, '_sleep')
+def test_rate_limit_retries_exhausted(sleep, server):
+    server.secondary_limit_responses = 10
+    client = get_client(server)
+
+    with pytest.raises(HTTPError) as e:
+        client.issues.list_comments(1)
+
+    assert e.value.code == 403
+    assert len(server.requests) == 4
+
+@patch.object(RateLimiter, '_sleep')
+def test_forbidden_not_retried(sleep, server):
+    server.resources['/repos/owner/repo/issues/2/comments'] = []
+    client = get_client(server)
+    with patch('package.kfops.github_client.urlopen',
+               side_effect=HTTPError('url', 403, 'Forbidden', {}, None)) as urlopen:
+        with pytest.raises(HTTPError):
+            client.issues.list_comments(2)
+
+    assert urlopen.call_count == 1
+    sleep.assert_not_called()
+
+@patch.object(RateLimiter, '_sleep')
+def test_content_creating_requests_spaced(sleep, server):
+    client = get_client(server, rate_limiter=RateLimiter(mutation_interval=1))
+
+    client.issues.create_comment(1, body='second')
+    client.issues.create_comment(1, body='third')
+    client.issues.list_comments(1)
+
+    assert sleep.call_count == 1
+    assert 0 < sleep.call_args[0][0] <= 1
+
+@patch.object(RateLimiter, '_sleep')
+def test_graphql_queries_not_spaced(sleep, server):
+    client = get_client(server, rate_limiter=RateLimiter(mutation_interval=1))
+
+    client('/graphql', 'POST', data={'query': 'query { viewer { login } }'})
+    client('/graphql', 'POST', data={'query': '{ viewer { login } }'})
+    sleep.assert_not_called()
+
+    client('/graphql', 'POST', data={'query': 'mutation { a }'})
+    client('/graphql', 'POST', data={'query': ' mutation { b }'})
+    assert sleep.call_count == 1
+
+def test_route_params_quoted(server):
+    server.resources['/repos/owner/repo/labels/Deployed%20to%20prod%231'] = {'name': 'Deployed to prod#1'}
+    client = get_client(server)
+
+    label = client.issues.get_label('Deployed to prod#1')
+
+    assert label.name == 'Deployed to prod#1'
+    assert server.requests[-1] == ('GET', '/repos/owner/repo/labels/Deployed%20to%20prod%231')
+
+@patch.object(RateLimiter, '_sleep')
+def test_requests_paced_by_remaining_budget(sleep):
+    limiter = RateLimiter(burst=1)
+    limiter.update({'X-RateLimit-Remaining': '10', 'X-RateLimit-Limit': '5000',
+                    'X-RateLimit-Reset': str(int(time.time()) + 100)})
+
+    with limiter.request('GET'):
+        pass
+    with limiter.request('GET'):
+        pass
+
+    assert sleep.call_count == 1
+    assert 9 < sleep.call_args[0][0] <= 10
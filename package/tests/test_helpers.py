@@ -12,6 +12,9 @@ def test_convert_parameters_to_dict():
     (' /build_run ', 'build_run', {}),
     ('/build_run \ncomment in next line', 'build_run', {}),
     ('/build_run \r\ncomment in next line', 'build_run', {}),
+    ('/profile_deploy', 'profile_deploy', {}),
+    ('/profile_deploy --env=production', 'profile_deploy', {'env': 'production'}),
+    ('/rollback --run-id=122', 'rollback', {'run-id': '122'}),
     ('/deploy --run-id=123 --force', 'deploy', {'run-id': '123', 'force': True}),
     ('/deploy --force --run-id 123', 'deploy', {'run-id': '123', 'force': True}),
     ('/deploy --force --run-id 123 --force', 'deploy', {'run-id': '123', 'force': True}),
@@ -1,14 +1,26 @@
+import json
 import yaml
 import os
 import re
 import pytest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from unittest.mock import patch, Mock, call
 from requests.exceptions import HTTPError
+from kubernetes.client.rest import ApiException
 from munch import munchify
 from package.kfops.config import Config
-from package.kfops.kserve_deployer import IsvcDeployer, read_function_from_file
+from package.kfops.kserve_deployer import IsvcDeployer, read_function_from_file, \
+    IsvcReadinessWatcher, IsvcNotReadyException, is_equivalent, RawIsvcDeployer, is_rolled_out, \
+    replica_startup, ReplicaStartup
+from package.kfops.model_storage import ModelStorageException
+from package.kfops.load_test import LoadTestReport, LatencyComparison, WarmupReport, ConcurrencyStep
+from package.kfops.serving_metrics import MetricsSource, RevisionMetrics
 from tempfile import NamedTemporaryFile
-from kserve import V1beta1InferenceService
+from kserve import V1beta1InferenceService, V1beta1InferenceServiceSpec, V1beta1PredictorSpec, \
+    V1beta1SKLearnSpec
+from kubernetes import client
+from kubernetes.client import ApiClient
 
 
 function_def = '''
@@ -16,19 +28,14 @@ def test_function():
     return True
 '''
 
-existing_inference_services = {
-    'items': [
-        {
-            'metadata': {
-                'name': 'test-inference-service',
-                'namespace': 'default'
-            },
-        }
-    ]
+existing_inference_service = {
+    'metadata': {
+        'name': 'test-inference-service',
+        'namespace': 'default',
+        'resourceVersion': '100'
+    },
 }
 
-no_inference_services = {'items': []}
-
 basic_config = {
     'deployment': {
         'inference_service_name': 'test-inference-service',
@@ -70,24 +77,73 @@ def test_read_function_from_file_invalid_function_name():
 @patch('package.kfops.kserve_deployer.KServeClient')
 def test_check_isvc_exists(kfs, read_function_from_file):
     c = Config(validate_files=False, check_files_existence=False, config=basic_config)
-    kfs.return_value.get.return_value = existing_inference_services
+    kfs.return_value.api_instance.get_namespaced_custom_object.return_value = existing_inference_service
     read_function_from_file.return_value = dummy_func()
 
     deployer = IsvcDeployer(run_id='test-run-id', namespace='default', config=c)
 
     assert deployer.check_isvc_exists() == True
+    kfs.return_value.api_instance.get_namespaced_custom_object.assert_called_once_with(
+        'serving.kserve.io', 'v1beta1', 'default', 'inferenceservices', 'test-inference-service')
+    assert kfs.return_value.api_instance.list_namespaced_custom_object.call_count == 0
 
 @patch('package.kfops.kserve_deployer.read_function_from_file')
 @patch('package.kfops.kserve_deployer.KServeClient')
 def test_check_isvc_exists_no_isvc(kfs, read_function_from_file):
     c = Config(validate_files=False, check_files_existence=False, config=basic_config)
-    kfs.return_value.get.return_value = no_inference_services
+    kfs.return_value.api_instance.get_namespaced_custom_object.side_effect = ApiException(status=404)
     read_function_from_file.return_value = dummy_func
 
     deployer = IsvcDeployer(run_id='test-run-id', namespace='default', config=c)
 
     assert deployer.check_isvc_exists() == False
 
+@patch('package.kfops.kserve_deployer.read_function_from_file')
+@patch('package.kfops.kserve_deployer.KServeClient')
+def test_check_isvc_exists_error(kfs, read_function_from_file):
+    c = Config(validate_files=False, check_files_existence=False, config=basic_config)
+    kfs.return_value.api_instance.get_namespaced_custom_object.side_effect = ApiException(status=403)
+    read_function_from_file.return_value = dummy_func
+
+    deployer = IsvcDeployer(run_id='test-run-id', namespace='default', config=c)
+
+    with pytest.raises(Exception, match='Error while probing for inference services'):
+        deployer.check_isvc_exists()
+
+@patch('package.kfops.kserve_deployer.read_function_from_file')
+@patch('package.kfops.kserve_deployer.KServeClient')
+def test_replace_uses_last_seen_resource_version(kfs, read_function_from_file):
+    c = Config(validate_files=False, check_files_existence=False, config=basic_config)
+    kfs.return_value.api_instance.get_namespaced_custom_object.return_value = existing_inference_service
+    kfs.return_value.replace.return_value = {'metadata': {'resourceVersion': '101'}}
+    read_function_from_file.return_value = dummy_func
+    isvc = V1beta1InferenceService(metadata=munchify({}))
+
+    deployer = IsvcDeployer(run_id='test-run-id', namespace='default', config=c)
+    deployer.check_isvc_exists()
+    deployer.replace(isvc)
+    assert isvc.metadata.resource_version == '100'
+    deployer.replace(isvc)
+    assert isvc.metadata.resource_version == '101'
+
+    assert kfs.return_value.api_instance.get_namespaced_custom_object.call_count == 1
+
+@patch('package.kfops.kserve_deployer.read_function_from_file')
+@patch('package.kfops.kserve_deployer.KServeClient')
+def test_replace_conflict_refreshes_resource_version(kfs, read_function_from_file):
+    c = Config(validate_files=False, check_files_existence=False, config=basic_config)
+    kfs.return_value.api_instance.get_namespaced_custom_object.side_effect = [
+        existing_inference_service, {'metadata': {'resourceVersion': '105'}}]
+    kfs.return_value.replace.side_effect = [RuntimeError('(409) Conflict'), {'metadata': {'resourceVersion': '106'}}]
+    read_function_from_file.return_value = dummy_func
+    isvc = V1beta1InferenceService(metadata=munchify({}))
+
+    deployer = IsvcDeployer(run_id='test-run-id', namespace='default', config=c)
+    deployer.replace(isvc)
+
+    assert isvc.metadata.resource_version == '105'
+    assert deployer.isvc == {'metadata': {'resourceVersion': '106'}}
+
 @patch('package.kfops.kserve_deployer.read_function_from_file')
 @patch('package.kfops.kserve_deployer.KServeClient')
 def test_invalid_isvc_function_parameters(kfs, read_function_from_file):
@@ -109,12 +165,14 @@ def test_valid_isvc_function_parameters(kfs, read_function_from_file):
 
     assert deployer.get_isvc() == True
 
+@patch('package.kfops.kserve_deployer.IsvcDeployer.wait_ready', return_value=None)
 @patch('package.kfops.kserve_deployer.read_function_from_file')
 @patch('package.kfops.kserve_deployer.KServeClient')
 @patch('package.kfops.kserve_deployer.IsvcDeployer.get_isvc')
-def test_deploy_no_existing_isvc(isvc, kfs, read_function_from_file):
+def test_deploy_no_existing_isvc(isvc, kfs, read_function_from_file, wait_ready):
     c = Config(validate_files=False, check_files_existence=False, config=basic_config)
     read_function_from_file.return_value = valid_params_func
+    kfs.return_value.api_instance.get_namespaced_custom_object.side_effect = ApiException(status=404)
 
     deployer = IsvcDeployer(run_id='test-run-id', namespace='default', config=c)
     deployer.deploy()
@@ -219,3 +277,781 @@ def test_deploy_replace_existing_isvc_with_sample_input_status_success(
         call(canary_traffic_percent=100)
     ])
     assert deployer.error == None
+
+def isvc_object(ready='Unknown', generation=2, observed_generation=2, reason=None):
+    return {
+        'metadata': {'name': 'test-inference-service', 'generation': generation},
+        'status': {
+            'observedGeneration': observed_generation,
+            'conditions': [{'type': 'Ready', 'status': ready, 'reason': reason}],
+            'components': {'predictor': {'latestCreatedRevision': 'test-inference-service-predictor-00002'}}
+        }
+    }
+
+def pod_with_waiting_container(reason):
+    return munchify({'metadata': {'name': 'pod-1'}, 'status': {
+        'init_container_statuses': None,
+        'container_statuses': [{'name': 'kserve-container', 'state': {
+            'waiting': {'reason': reason, 'message': 'Back-off pulling image'}}}]}})
+
+def test_readiness_watcher_ignores_previous_generation():
+    kfs = Mock()
+    watcher = IsvcReadinessWatcher(kfs, 'test-inference-service', 'default')
+
+    assert watcher.check(isvc_object(ready='True', observed_generation=1)) == False
+    assert watcher.check(isvc_object(ready='True')) == True
+
+def test_readiness_watcher_without_observed_generation():
+    kfs = Mock()
+    watcher = IsvcReadinessWatcher(kfs, 'test-inference-service', 'default')
+    isvc = isvc_object(ready='True')
+    del isvc['status']['observedGeneration']
+
+    assert watcher.check(isvc) == True
+
+def test_readiness_watcher_without_observed_generation_waits_for_new_revision():
+    kfs = Mock()
+    watcher = IsvcReadinessWatcher(kfs, 'test-inference-service', 'default',
+                                   replaced_revision='test-inference-service-predictor-00001')
+    isvc = isvc_object(ready='True')
+    del isvc['status']['observedGeneration']
+    stale = isvc_object(ready='True')
+    del stale['status']['observedGeneration']
+    stale['status']['components']['predictor']['latestCreatedRevision'] = 'test-inference-service-predictor-00001'
+
+    assert watcher.check(stale) == False
+    assert watcher.check(isvc) == True
+    assert watcher.revision == 'test-inference-service-predictor-00002'
+
+# Not patched by `kserve` fixture
+wait_ready = IsvcDeployer.wait_ready
+
+@patch('package.kfops.kserve_deployer.IsvcReadinessWatcher')
+def test_wait_ready_after_replace_ignores_replaced_revision(watcher, kserve):
+    deployer = get_deployer()
+    deployer.replace(deployer.get_isvc(canary_traffic_percent=0))
+    wait_ready(deployer)
+    wait_ready(deployer)
+
+    assert [c[1]['replaced_revision'] for c in watcher.call_args_list] == ['rev-1', None]
+
+def test_readiness_watcher_fails_fast_on_image_pull_error():
+    kfs = Mock()
+    kfs.core_api.list_namespaced_pod.return_value = Mock(items=[
+        pod_with_waiting_container('ImagePullBackOff')])
+    watcher = IsvcReadinessWatcher(kfs, 'test-inference-service', 'default')
+
+    with pytest.raises(IsvcNotReadyException, match='ImagePullBackOff'):
+        watcher.check(isvc_object())
+    kfs.core_api.list_namespaced_pod.assert_called_once_with(
+        'default', label_selector='serving.knative.dev/revision=test-inference-service-predictor-00002')
+
+@patch('package.kfops.kserve_deployer.watch')
+def test_readiness_watcher_returns_when_ready(watch):
+    kfs = Mock()
+    kfs.core_api.list_namespaced_pod.return_value = Mock(items=[])
+    watch.Watch.return_value.stream.return_value = iter([
+        {'type': 'MODIFIED', 'object': isvc_object()},
+        {'type': 'MODIFIED', 'object': isvc_object(ready='True')},
+    ])
+    watcher = IsvcReadinessWatcher(kfs, 'test-inference-service', 'default')
+
+    watcher.wait()
+
+    assert watch.Watch.return_value.stop.call_count == 1
+    assert len(watcher.events) == 2
+
+@patch('package.kfops.kserve_deployer.IsvcReadinessWatcher.wait')
+@patch('package.kfops.kserve_deployer.read_function_from_file')
+@patch('package.kfops.kserve_deployer.KServeClient')
+def test_wait_ready_reports_events(kfs, read_function_from_file, wait):
+    c = Config(validate_files=False, check_files_existence=False, config=basic_config)
+    read_function_from_file.return_value = dummy_func
+    wait.side_effect = IsvcNotReadyException('Container "kserve-container" of pod pod-1: CrashLoopBackOff')
+    kfs.return_value.api_instance.get_namespaced_custom_object.return_value = isvc_object()
+    kfs.return_value.core_api.list_namespaced_event.return_value = Mock(items=[munchify(
+        {'involved_object': {'kind': 'Pod'}, 'reason': 'BackOff', 'message': 'Back-off restarting'})])
+
+    deployer = IsvcDeployer(run_id='test-run-id', namespace='default', config=c)
+    deployer.wait_ready()
+
+    assert 'CrashLoopBackOff' in deployer.error
+    assert 'Pod BackOff: Back-off restarting' in deployer.error
+
+def live_isvc(run_id, canary_traffic_percent=None, revision='rev-1'):
+    predictor = {'sklearn': {'storageUri': 's3://trained-models/%s/' % run_id}, 'minReplicas': 1}
+    if canary_traffic_percent is not None:
+        predictor['canaryTrafficPercent'] = canary_traffic_percent
+    return {
+        'metadata': {'name': 'test-inference-service', 'resourceVersion': '100'},
+        'spec': {'predictor': predictor},
+        'status': {
+            'conditions': [{'type': 'Ready', 'status': 'True'}],
+            'components': {'predictor': {'latestCreatedRevision': revision, 'latestReadyRevision': revision}}
+        }
+    }
+
+def sklearn_isvc(name, storage_uri, namespace, canary_traffic_percent=None):
+    return V1beta1InferenceService(
+        api_version='serving.kserve.io/v1beta1', kind='InferenceService',
+        metadata=client.V1ObjectMeta(name=name, namespace=namespace),
+        spec=V1beta1InferenceServiceSpec(predictor=V1beta1PredictorSpec(
+            canary_traffic_percent=canary_traffic_percent,
+            sklearn=V1beta1SKLearnSpec(storage_uri=storage_uri))))
+
+def sklearn_isvc_with(name, storage_uri, namespace, canary_traffic_percent=None, **predictor):
+    'Like `sklearn_isvc`, with additional predictor attributes'
+    isvc = sklearn_isvc(name, storage_uri, namespace, canary_traffic_percent)
+    for attr, value in predictor.items():
+        setattr(isvc.spec.predictor, attr, value)
+    return isvc
+
+@pytest.fixture
+def kserve():
+    '''Mocked KServe client used by deployers created in the test. InferenceService serves
+    model `previous-run-id` (revision rev-1), new model is rolled out as revision rev-2.
+    Inference service function returns `sklearn_isvc`, readiness is not waited for.
+    '''
+    def patch_traffic(group, version, namespace, plural, name, body):
+        percent = body['spec']['predictor']['canaryTrafficPercent']
+        return live_isvc('test-run-id', percent, revision='rev-2')
+
+    with patch('package.kfops.kserve_deployer.KServeClient') as kfs, \
+            patch('package.kfops.kserve_deployer.read_function_from_file', return_value=sklearn_isvc), \
+            patch('package.kfops.kserve_deployer.IsvcDeployer.wait_ready', return_value=None):
+        kfs = kfs.return_value
+        kfs.api_instance.api_client = ApiClient()
+        kfs.api_instance.get_namespaced_custom_object.return_value = live_isvc('previous-run-id')
+        kfs.replace.return_value = live_isvc('test-run-id', 0, revision='rev-2')
+        kfs.api_instance.patch_namespaced_custom_object.side_effect = patch_traffic
+        kfs.core_api.list_namespaced_pod.return_value = Mock(items=[])
+        yield kfs
+
+def get_deployer(deployer_class=IsvcDeployer, run_id='test-run-id', deployment=None, **kwargs):
+    'Deployer of `basic_config` extended with `deployment` settings'
+    config = {'deployment': dict(basic_config['deployment'], **(deployment or {}))}
+    c = Config(validate_files=False, check_files_existence=False, config=config)
+    return deployer_class(run_id=run_id, namespace='default', config=c, **kwargs)
+
+def traffic_patches(kfs):
+    'Traffic percents set by patching InferenceService'
+    return [c[0][-1]['spec']['predictor']['canaryTrafficPercent']
+            for c in kfs.api_instance.patch_namespaced_custom_object.call_args_list]
+
+load_test_settings = {'load_test': {'samples_path': 'samples.jsonl', 'max_p95_latency_ms': 100}}
+
+@patch('package.kfops.kserve_deployer.LoadTester')
+@patch('package.kfops.kserve_deployer.load_samples', return_value=[{'instances': [1]}])
+def test_deploy_load_test_failed(samples, load_tester, kserve):
+    load_tester.return_value.run.return_value = LoadTestReport(
+        requests=10, errors=0, duration=1, latencies=[150] * 10)
+
+    deployer = get_deployer(deployment=load_test_settings)
+    deployer.deploy()
+
+    assert load_tester.call_args[0][0] == \
+        'http://rev-2-private.default.svc.cluster.local/v1/models/test-inference-service:predict'
+    assert kserve.replace.call_count == 1
+    assert traffic_patches(kserve) == []
+    assert 'failed load test: p95 latency 150.0 ms exceeds 100 ms' in deployer.error
+    assert len(deployer.reports) == 1
+
+@patch('package.kfops.kserve_deployer.LoadTester')
+@patch('package.kfops.kserve_deployer.load_samples', return_value=[{'instances': [1]}])
+def test_deploy_load_test_passed(samples, load_tester, kserve):
+    load_tester.return_value.run.return_value = LoadTestReport(
+        requests=10, errors=0, duration=1, latencies=[50] * 10)
+
+    deployer = get_deployer(deployment=load_test_settings)
+    deployer.deploy()
+
+    assert deployer.error == None
+    assert kserve.replace.call_count == 1
+    assert traffic_patches(kserve) == [100]
+
+@patch('package.kfops.kserve_deployer.compare_latency')
+@patch('package.kfops.kserve_deployer.load_samples', return_value=[{'instances': [1]}])
+def test_deploy_latency_regression(samples, compare_latency, kserve):
+    compare_latency.return_value = LatencyComparison(
+        baseline=[100, 100, 100], candidate=[140, 141, 139], errors=0)
+
+    deployer = get_deployer(deployment={'latency_comparison': {
+        'samples_path': 'samples.jsonl', 'max_regression_percent': 20}})
+    deployer.deploy()
+
+    compare_latency.assert_called_once_with(
+        'http://rev-1-private.default.svc.cluster.local/v1/models/test-inference-service:predict',
+        'http://rev-2-private.default.svc.cluster.local/v1/models/test-inference-service:predict',
+        [{'instances': [1]}], requests_count=None)
+    assert traffic_patches(kserve) == []
+    assert 'more than 20% slower' in deployer.error
+
+class FakeMetricsSource(MetricsSource):
+    'Returns prepared metrics, one per canary step'
+    def __init__(self, metrics):
+        self.metrics = list(metrics)
+        self.calls = []
+
+    def revision_metrics(self, namespace, revision, window_seconds):
+        self.calls.append((namespace, revision, window_seconds))
+        return self.metrics.pop(0)
+
+canary_settings = {'canary': {
+    'steps': [5, 25, 50], 'dwell_seconds': 30, 'max_error_rate': 0.01,
+    'metrics': {'type': 'prometheus', 'url': 'http://prometheus:9090'}}}
+
+@patch('package.kfops.kserve_deployer.time')
+@patch('package.kfops.kserve_deployer.metrics_source')
+def test_progressive_rollout(metrics_source, time, kserve):
+    source = FakeMetricsSource([RevisionMetrics(100, 0, 50)] * 3)
+    metrics_source.return_value = source
+
+    deployer = get_deployer(deployment=canary_settings)
+    deployer.deploy()
+
+    assert deployer.error == None
+    assert kserve.replace.call_args[0][1].spec.predictor.canary_traffic_percent == 0
+    assert traffic_patches(kserve) == [5, 25, 50, 100]
+    assert source.calls == [('default', 'rev-2', 30)] * 3
+    assert 'Canary rollout' in deployer.reports[0]
+
+@patch('package.kfops.kserve_deployer.time')
+@patch('package.kfops.kserve_deployer.metrics_source')
+def test_progressive_rollout_without_steps(metrics_source, time, kserve):
+    metrics_source.return_value = FakeMetricsSource([])
+
+    deployer = get_deployer(deployment={'canary': dict(canary_settings['canary'], steps=[])})
+    deployer.deploy()
+
+    assert deployer.error == None
+    assert traffic_patches(kserve) == [100]
+    assert metrics_source.return_value.calls == []
+
+@patch('package.kfops.kserve_deployer.time')
+@patch('package.kfops.kserve_deployer.metrics_source')
+def test_progressive_rollout_rolled_back(metrics_source, time, kserve):
+    metrics_source.return_value = FakeMetricsSource([
+        RevisionMetrics(100, 0, 50), RevisionMetrics(100, 0.2, 50)])
+
+    deployer = get_deployer(deployment=canary_settings)
+    deployer.deploy()
+
+    assert traffic_patches(kserve) == [5, 25, 0]
+    assert 'stopped at 25% of traffic and rolled back' in deployer.error
+    assert 'error rate 20.00% exceeds 1.00%' in deployer.error
+
+@patch('package.kfops.kserve_deployer.warm_up')
+@patch('package.kfops.kserve_deployer.load_samples', return_value=[{'instances': [1]}])
+def test_deploy_warmup(samples, warm_up, kserve):
+    kserve.replace.return_value['spec']['predictor']['minReplicas'] = 2
+    ready_pod = munchify({'status': {'container_statuses': [{'ready': True}, {'ready': True}], 'conditions': []}})
+    kserve.core_api.list_namespaced_pod.return_value = Mock(items=[ready_pod, ready_pod])
+    warm_up.return_value = WarmupReport(requests=10, duration=3, stable=True, latencies=[2000, 50], errors=0)
+
+    deployer = get_deployer(deployment={'warmup': {'samples_path': 'samples.jsonl', 'requests_per_replica': 5}})
+    deployer.isvc_func = lambda **kwargs: sklearn_isvc_with(min_replicas=2, **kwargs)
+    deployer.deploy()
+
+    assert deployer.error == None
+    assert warm_up.call_args[1]['min_requests'] == 10
+    kserve.core_api.list_namespaced_pod.assert_called_with(
+        'default', label_selector='serving.knative.dev/revision=rev-2')
+    assert deployer.reports[0].startswith('Warmup: 10 requests to 2 replicas, latency stable after')
+    assert traffic_patches(kserve) == [100]
+
+@patch('package.kfops.kserve_deployer.warm_up')
+@patch('package.kfops.kserve_deployer.load_samples', return_value=[{'instances': [1]}])
+def test_deploy_warmup_failed_requests(samples, warm_up, kserve):
+    ready_pod = munchify({'status': {'container_statuses': [{'ready': True}], 'conditions': []}})
+    kserve.core_api.list_namespaced_pod.return_value = Mock(items=[ready_pod])
+    warm_up.return_value = WarmupReport(requests=10, duration=3, stable=True, latencies=[50] * 8, errors=2)
+
+    deployer = get_deployer(deployment={'warmup': {'samples_path': 'samples.jsonl'}})
+    deployer.deploy()
+
+    assert '2 of 10 requests to revision rev-2 failed' in deployer.error
+    assert traffic_patches(kserve) == []
+
+def test_deploy_warmup_replicas_exceed_min_replicas(kserve):
+    deployer = get_deployer(deployment={'warmup': {'samples_path': 'samples.jsonl', 'replicas': 3}})
+    deployer.deploy()
+
+    assert 'warmup.replicas (3) exceeds minReplicas (1)' in deployer.error
+    assert kserve.replace.call_count == 0
+
+profiling_settings = {'profiling': {'samples_path': 'samples.jsonl', 'peak_rps': 100, 'apply': True}}
+
+@patch('package.kfops.kserve_deployer.concurrency_sweep')
+@patch('package.kfops.kserve_deployer.load_samples', return_value=[{'instances': [1]}])
+def test_profile_deploy_applies_autoscaling(samples, concurrency_sweep, kserve):
+    ready_pod = munchify({'status': {'container_statuses': [{'ready': True}], 'conditions': []}})
+    kserve.core_api.list_namespaced_pod.return_value = Mock(items=[ready_pod])
+    concurrency_sweep.return_value = [
+        ConcurrencyStep(1, 10, 100, 0), ConcurrencyStep(2, 20, 100, 0),
+        ConcurrencyStep(4, 21, 300, 0)]
+
+    deployer = get_deployer(deployment=profiling_settings, profile=True)
+    deployer.deploy()
+
+    assert deployer.error == None
+    assert 'knee at 2 concurrent requests on 1 replicas' in deployer.reports[0]
+    canary, rollout = [c[0][1].spec.predictor for c in kserve.replace.call_args_list]
+    assert canary.container_concurrency is None
+    assert rollout.container_concurrency == 2
+    assert rollout.scale_target == 1
+    assert rollout.max_replicas == 8
+    assert json.loads(kserve.replace.call_args[0][1].metadata.annotations['kfops/profiled-autoscaling']) == \
+        {'container_concurrency': 2, 'max_replicas': 8, 'min_replicas': 1, 'scale_metric': 'concurrency',
+         'scale_target': 1}
+
+def test_deploy_keeps_profiled_autoscaling(kserve):
+    live = live_isvc('previous-run-id')
+    live['metadata']['annotations'] = {
+        'kfops/profiled-autoscaling': '{"container_concurrency": 2, "scale_target": 1}'}
+    live['spec']['predictor'].update({'containerConcurrency': 2, 'scaleTarget': 1})
+    kserve.api_instance.get_namespaced_custom_object.return_value = live
+
+    deployer = get_deployer()
+    deployer.deploy()
+
+    assert deployer.error == None
+    predictor = kserve.replace.call_args[0][1].spec.predictor
+    assert predictor.container_concurrency == 2
+    assert predictor.scale_target == 1
+    assert 'kfops/profiled-autoscaling' in kserve.replace.call_args[0][1].metadata.annotations
+
+def test_profiled_autoscaling_is_up_to_date(kserve):
+    live = live_isvc('test-run-id')
+    live['metadata']['annotations'] = {'kfops/profiled-autoscaling': '{"container_concurrency": 2}'}
+    live['spec']['predictor']['containerConcurrency'] = 2
+    kserve.api_instance.get_namespaced_custom_object.return_value = live
+
+    deployer = get_deployer()
+    deployer.deploy()
+
+    assert kserve.replace.call_count == 0
+    assert 'Model is already deployed' in deployer.reports[0]
+
+def test_inference_service_function_overrides_profiled_autoscaling(kserve):
+    live = live_isvc('previous-run-id')
+    live['metadata']['annotations'] = {'kfops/profiled-autoscaling': '{"container_concurrency": 2}'}
+    kserve.api_instance.get_namespaced_custom_object.return_value = live
+
+    deployer = get_deployer()
+    deployer.restore_profiled_autoscaling()
+    deployer.isvc_func = lambda **kwargs: V1beta1InferenceService(
+        metadata=client.V1ObjectMeta(name=kwargs['name']),
+        spec=V1beta1InferenceServiceSpec(predictor=V1beta1PredictorSpec(container_concurrency=4)))
+
+    isvc = deployer.get_isvc()
+    assert isvc.spec.predictor.container_concurrency == 4
+    assert isvc.metadata.annotations is None
+
+def test_profile_deploy_without_settings(kserve):
+    deployer = get_deployer(profile=True)
+    deployer.deploy()
+
+    assert 'Profiling requires deployment.profiling settings' in deployer.error
+    assert kserve.replace.call_count == 1
+
+@patch('package.kfops.kserve_deployer.LoadTester')
+@patch('package.kfops.kserve_deployer.load_samples', return_value=[{'instances': [1]}])
+@patch('package.kfops.kserve_deployer.IsvcDeployer.get_latest_revision')
+def test_deploy_batcher_tuning(revision, samples, load_tester, kserve):
+    # The last one is read when reporting deployment time
+    revision.side_effect = ['rev-1', 'rev-2', 'rev-3', 'rev-4', 'rev-4']
+    # Default, batch size 8, batch size 32 (too slow)
+    load_tester.return_value.run.side_effect = [
+        LoadTestReport(requests=10, errors=0, duration=1, latencies=[50] * 10),
+        LoadTestReport(requests=10, errors=0, duration=0.5, latencies=[80] * 10),
+        LoadTestReport(requests=10, errors=0, duration=0.2, latencies=[150] * 10)]
+
+    deployer = get_deployer(deployment={'batcher_tuning': {
+        'samples_path': 'samples.jsonl', 'max_batch_sizes': [8, 32], 'max_latencies_ms': [10],
+        'max_p95_latency_ms': 100}})
+    deployer.deploy()
+
+    assert deployer.error == None
+    assert deployer.batcher_tuning['selected'] == {'max_batch_size': 8, 'max_latency': 10}
+    assert [t['revision'] for t in deployer.batcher_tuning['trials']] == ['rev-1', 'rev-2', 'rev-3']
+    assert 'Batcher tuning' in deployer.reports[0]
+    # Two candidates, selected batcher deployed again (traffic 0%) and promoted
+    predictors = [c[0][1].spec.predictor for c in kserve.replace.call_args_list]
+    assert len(predictors) == 5
+    assert [p.batcher.max_batch_size for p in predictors[1:]] == [8, 32, 8, 8]
+    assert predictors[-1].canary_traffic_percent == 100
+
+@pytest.mark.parametrize('p95_latencies, selected', [
+    # Batcher of inference service function is the fastest
+    ([50, 80, 90], True),
+    # No setting meets latency SLO
+    ([150, 150, 150], False),
+])
+@patch('package.kfops.kserve_deployer.LoadTester')
+@patch('package.kfops.kserve_deployer.load_samples', return_value=[{'instances': [1]}])
+@patch('package.kfops.kserve_deployer.IsvcDeployer.get_latest_revision')
+def test_deploy_batcher_tuning_keeps_function_batcher(revision, samples, load_tester, kserve, p95_latencies, selected):
+    revision.side_effect = ['rev-1', 'rev-2', 'rev-3'] + ['rev-4'] * 5
+    load_tester.return_value.run.side_effect = [
+        LoadTestReport(requests=10, errors=0, duration=d, latencies=[l] * 10)
+        for d, l in zip([0.2, 0.5, 1], p95_latencies)]
+
+    deployer = get_deployer(deployment={'batcher_tuning': {
+        'samples_path': 'samples.jsonl', 'max_batch_sizes': [8, 32], 'max_latencies_ms': [10],
+        'max_p95_latency_ms': 100}})
+    deployer.deploy()
+
+    assert deployer.error == None
+    assert deployer.batcher_tuning['selected'] is None
+    assert ('no setting meets latency SLO' in deployer.reports[0]) != selected
+    # Function's batcher deployed again (traffic 0%) and promoted
+    predictors = [c[0][1].spec.predictor for c in kserve.replace.call_args_list]
+    assert [p.batcher and p.batcher.max_batch_size for p in predictors] == [None, 8, 32, None]
+    assert predictors[-1].canary_traffic_percent == 0
+    assert traffic_patches(kserve) == [100]
+
+def test_is_equivalent():
+    live = {'predictor': {
+        'sklearn': {'storageUri': 's3://model', 'protocolVersion': 'v1', 'name': 'kserve-container',
+                    'resources': {'limits': {'cpu': '20m', 'memory': '200Mi'}}},
+        'minReplicas': 1}}
+
+    assert is_equivalent({'predictor': {'sklearn': {
+        'storageUri': 's3://model', 'resources': {'limits': {'cpu': 0.02, 'memory': '200Mi'}}}}}, live)
+    assert is_equivalent({'predictor': {'sklearn': {
+        'storageUri': 's3://model', 'runtime': None, 'resources': {'limits': {'cpu': '20m', 'memory': '200Mi'}}}}},
+        live)
+    # Removed fields
+    assert not is_equivalent({'predictor': {'sklearn': {'storageUri': 's3://model'}}}, live)
+    assert not is_equivalent({'predictor': {'sklearn': {
+        'storageUri': 's3://model', 'resources': {'limits': {'cpu': '20m', 'memory': '200Mi'}}}}},
+        dict(live, predictor=dict(live['predictor'], batcher={'maxBatchSize': 32, 'maxLatency': 50})))
+    assert not is_equivalent({'predictor': {'sklearn': {
+        'storageUri': 's3://model', 'resources': {'limits': {'cpu': '20m', 'memory': '200Mi'}}}}},
+        dict(live, predictor=dict(live['predictor'], minReplicas=2)))
+    # Defaulted by the cluster
+    assert is_equivalent({'predictor': {'sklearn': {'storageUri': 's3://model'}}}, {'predictor': {
+        'sklearn': {'storageUri': 's3://model', 'name': 'kserve-container',
+                    'resources': {'limits': {'cpu': '1', 'memory': '2Gi'}, 'requests': {'cpu': '1', 'memory': '2Gi'}}},
+        'minReplicas': 1}})
+    assert not is_equivalent({'predictor': {'sklearn': {'storageUri': 's3://other-model'}}}, live)
+    assert not is_equivalent({'predictor': {'sklearn': {
+        'resources': {'limits': {'cpu': '1'}}}}}, live)
+    assert not is_equivalent({'predictor': {'minReplicas': True}}, live)
+
+def test_deploy_same_model_removed_field_is_rolled_out(kserve):
+    live = live_isvc('test-run-id')
+    live['spec']['predictor']['batcher'] = {'maxBatchSize': 32, 'maxLatency': 50}
+    kserve.api_instance.get_namespaced_custom_object.return_value = live
+
+    deployer = get_deployer()
+    deployer.deploy()
+
+    assert deployer.error == None
+    assert kserve.replace.call_args_list[0][0][1].spec.predictor.batcher is None
+    assert 'Model is already deployed' not in ''.join(deployer.reports)
+
+def test_deploy_same_model_is_noop(kserve):
+    kserve.api_instance.get_namespaced_custom_object.return_value = live_isvc('test-run-id')
+
+    deployer = get_deployer()
+    deployer.deploy()
+
+    assert deployer.error == None
+    assert kserve.replace.call_count == 0
+    assert traffic_patches(kserve) == []
+    assert 'already deployed' in deployer.reports[0]
+
+def test_deploy_patches_traffic_only(kserve):
+    # Previous deployment of the same model stopped with traffic 0%
+    kserve.api_instance.get_namespaced_custom_object.return_value = live_isvc('test-run-id', 0)
+
+    deployer = get_deployer()
+    deployer.deploy()
+
+    assert deployer.error == None
+    assert kserve.replace.call_count == 0
+    kserve.api_instance.patch_namespaced_custom_object.assert_called_once_with(
+        'serving.kserve.io', 'v1beta1', 'default', 'inferenceservices', 'test-inference-service',
+        {'spec': {'predictor': {'canaryTrafficPercent': 100}}})
+
+def test_deploy_new_model_replaces(kserve):
+    deployer = get_deployer()
+    deployer.deploy()
+
+    assert kserve.replace.call_count == 1
+    assert kserve.replace.call_args[0][1].spec.predictor.canary_traffic_percent == 0
+    # Promotion changes traffic only
+    assert traffic_patches(kserve) == [100]
+
+def rolled_out_isvc(previous_revision):
+    return {
+        'metadata': {'name': 'test-inference-service', 'resourceVersion': '100'},
+        'status': {'components': {'predictor': {
+            'latestCreatedRevision': 'rev-2', 'latestReadyRevision': 'rev-2',
+            'previousRolledoutRevision': previous_revision}}}
+    }
+
+def test_deploy_records_rolled_out_revision(kserve):
+    live = live_isvc('previous-run-id')
+    # Candidate of a failed deployment is ready but never received traffic
+    live['status']['components']['predictor'].update({
+        'latestCreatedRevision': 'rev-9', 'latestReadyRevision': 'rev-9', 'latestRolledoutRevision': 'rev-1'})
+    kserve.api_instance.get_namespaced_custom_object.return_value = live
+    history = Mock()
+
+    deployer = get_deployer(history=history)
+    deployer.deploy()
+
+    assert deployer.error == None
+    entry = history.record.call_args[0][2]
+    assert entry['previous_revision'] == 'rev-1'
+    assert entry['revision'] == 'rev-2'
+
+def test_rolled_out_revision_from_traffic(kserve):
+    live = live_isvc('previous-run-id')
+    live['status']['components']['predictor'].update({'latestReadyRevision': 'rev-9', 'traffic': [
+        {'revisionName': 'rev-9', 'percent': 0, 'latestRevision': True},
+        {'revisionName': 'rev-1', 'percent': 100, 'latestRevision': False}]})
+    kserve.api_instance.get_namespaced_custom_object.return_value = live
+
+    assert get_deployer().get_rolled_out_revision() == 'rev-1'
+
+def deployment_history(retain_until='2999-01-01T00:00:00'):
+    history = Mock()
+    history.entries.return_value = [
+        {'run_id': 'run-1', 'revision': 'rev-1', 'previous_revision': None, 'retain_until': None},
+        {'run_id': 'run-2', 'revision': 'rev-2', 'previous_revision': 'rev-1', 'retain_until': retain_until}
+    ]
+    return history
+
+def test_rollback_shifts_traffic_to_retained_revision(kserve):
+    kserve.api_instance.get_namespaced_custom_object.return_value = rolled_out_isvc('rev-1')
+    history = deployment_history()
+
+    deployer = get_deployer(run_id=None, history=history)
+    deployer.rollback()
+
+    assert deployer.error is None
+    assert traffic_patches(kserve) == [0]
+    assert kserve.replace.call_count == 0
+    assert deployer.run_id == 'run-1'
+    entry = history.record.call_args[0][2]
+    assert entry['run_id'] == 'run-1' and entry['revision'] == 'rev-1' and entry['rollback']
+    assert 'Traffic routed back to revision rev-1' in deployer.reports[0]
+
+@patch('package.kfops.kserve_deployer.IsvcDeployer.deploy')
+def test_rollback_redeploys_after_retention_window(deploy, kserve):
+    kserve.api_instance.get_namespaced_custom_object.return_value = rolled_out_isvc('rev-1')
+
+    deployer = get_deployer(run_id=None, history=deployment_history(retain_until='2000-01-01T00:00:00'))
+    deployer.rollback()
+
+    assert deploy.call_count == 1
+    assert deployer.run_id == 'run-1'
+    assert traffic_patches(kserve) == []
+    assert 'has been redeployed' in deployer.reports[0]
+
+def test_rollback_without_history(kserve):
+    history = Mock()
+    history.entries.return_value = []
+
+    deployer = get_deployer(run_id=None, history=history)
+    deployer.rollback()
+
+    assert 'Could not find deployment history' in deployer.error
+
+def raw_live_isvc(run_id):
+    isvc = live_isvc(run_id)
+    isvc['metadata']['annotations'] = {'serving.kserve.io/deploymentMode': 'RawDeployment'}
+    return isvc
+
+def get_raw_isvc(run_id):
+    def get(group, version, namespace, plural, name):
+        if name == 'test-inference-service':
+            return raw_live_isvc(run_id)
+        raise ApiException(status=404)
+    return get
+
+def deployment_status(generation=2, observed_generation=2, replicas=2, updated=2, available=2, total=2):
+    return munchify({
+        'metadata': {'generation': generation},
+        'spec': {'replicas': replicas},
+        'status': {'observed_generation': observed_generation, 'replicas': total,
+                   'updated_replicas': updated, 'available_replicas': available, 'conditions': []}
+    })
+
+def test_is_rolled_out():
+    assert is_rolled_out(deployment_status())
+    assert not is_rolled_out(deployment_status(observed_generation=1))
+    # Old replica not terminated yet
+    assert not is_rolled_out(deployment_status(total=3))
+    assert not is_rolled_out(deployment_status(available=1))
+
+@patch('package.kfops.kserve_deployer.requests')
+def test_raw_deploy_tests_candidate_before_update(requests, kserve):
+    kserve.api_instance.get_namespaced_custom_object.side_effect = get_raw_isvc('old-run-id')
+    requests.post.return_value.status_code = 200
+
+    deployer = get_deployer(RawIsvcDeployer, sample_input={'instances': []})
+    deployer.deploy()
+
+    assert deployer.error is None
+    candidate = kserve.create.call_args[0][0]
+    assert candidate.metadata.name == 'test-inference-service-candidate'
+    assert candidate.metadata.annotations['serving.kserve.io/deploymentMode'] == 'RawDeployment'
+    requests.post.assert_called_once_with(
+        'http://test-inference-service-candidate-predictor.default.svc.cluster.local' +
+        '/v1/models/test-inference-service-candidate:predict', json={'instances': []})
+    assert kserve.replace.call_args[0][0] == 'test-inference-service'
+    assert kserve.replace.call_args[0][1].spec.predictor.canary_traffic_percent is None
+    assert traffic_patches(kserve) == []
+    assert kserve.api_instance.delete_namespaced_custom_object.call_args[0][-1] == \
+        'test-inference-service-candidate'
+    RawIsvcDeployer.wait_ready.assert_has_calls([call('test-inference-service-candidate'), call()])
+
+@patch('package.kfops.kserve_deployer.requests')
+def test_raw_deploy_failed_candidate_is_not_rolled_out(requests, kserve):
+    kserve.api_instance.get_namespaced_custom_object.side_effect = get_raw_isvc('old-run-id')
+    requests.post.return_value.status_code = 500
+
+    deployer = get_deployer(RawIsvcDeployer, sample_input={'instances': []})
+    deployer.deploy()
+
+    assert 'test sample failed' in deployer.error
+    assert kserve.replace.call_count == 0
+    assert kserve.api_instance.delete_namespaced_custom_object.call_count == 1
+
+def test_raw_deploy_rejects_serverless_isvc(kserve):
+    deployer = get_deployer(RawIsvcDeployer)
+    deployer.deploy()
+
+    assert 'deployed in serverless mode' in deployer.error
+    assert kserve.create.call_count == 0
+    assert kserve.replace.call_count == 0
+
+def test_raw_rollback_not_supported(kserve):
+    kserve.api_instance.get_namespaced_custom_object.side_effect = get_raw_isvc('old-run-id')
+    history = deployment_history()
+
+    deployer = get_deployer(RawIsvcDeployer, run_id=None, history=history)
+    deployer.rollback()
+
+    assert 'Rollback is not supported in raw deployment mode' in deployer.error
+    assert kserve.replace.call_count == 0
+    assert history.record.call_count == 0
+
+@patch('package.kfops.kserve_deployer.time')
+def test_raw_wait_rollout(time, kserve):
+    time.monotonic.return_value = 0
+    kserve.app_api.read_namespaced_deployment_status.side_effect = [
+        deployment_status(updated=1), deployment_status()]
+
+    deployer = get_deployer(RawIsvcDeployer)
+    deployer.wait_rollout(deployer.readiness_watcher('test-inference-service'))
+
+    assert kserve.app_api.read_namespaced_deployment_status.call_args[0] == \
+        ('test-inference-service-predictor', 'default')
+    assert kserve.core_api.list_namespaced_pod.call_args[1]['label_selector'] == \
+        'serving.kserve.io/inferenceservice=test-inference-service'
+
+def started_pod(created, ready, download=None):
+    init_statuses = []
+    if download is not None:
+        init_statuses = [{'name': 'storage-initializer', 'state': {'terminated': {
+            'started_at': datetime(2024, 1, 1, 0, 0, 0), 'finished_at': datetime(2024, 1, 1, 0, 0, download)}}}]
+    return munchify({
+        'metadata': {'creation_timestamp': datetime(2024, 1, 1, 0, 0, created)},
+        'status': {'conditions': [{'type': 'Ready', 'status': 'True',
+                                   'last_transition_time': datetime(2024, 1, 1, 0, 0, ready)}],
+                   'init_container_statuses': init_statuses}
+    })
+
+def test_replica_startup():
+    startup = replica_startup([started_pod(0, 40, download=30), started_pod(0, 20, download=10)])
+    assert startup == ReplicaStartup(2, 20, 30)
+    assert replica_startup([]) is None
+
+def test_pvc_model_storage_uri(kserve):
+    deployer = get_deployer(deployment={'model_storage': {'type': 'pvc', 'pvc_name': 'models'}})
+
+    assert deployer.get_isvc().spec.predictor.sklearn.storage_uri == 'pvc://models/trained-models/test-run-id/'
+
+def test_deploy_stops_when_model_staging_fails(kserve):
+    deployer = get_deployer()
+    deployer.model_storage = Mock()
+    deployer.model_storage.stage.side_effect = ModelStorageException('Job failed')
+
+    deployer.deploy()
+
+    assert 'Could not stage the model' in deployer.error
+    assert kserve.create.call_count == 0
+    assert kserve.replace.call_count == 0
+
+@patch('package.kfops.kserve_deployer.default_history_path')
+def test_deploy_reports_deployment_phases(history_path, kserve, tmp_path):
+    history_path.return_value = str(tmp_path / 'timing.jsonl')
+
+    deployer = get_deployer()
+    deployer.deploy()
+
+    assert deployer.error is None
+    assert 'Deployment time' in deployer.reports[-1]
+    assert '<td>Traffic shift</td>' in deployer.reports[-1]
+    with open(str(tmp_path / 'timing.jsonl')) as f:
+        entry = json.loads(f.readline())
+    assert entry['run_id'] == 'test-run-id'
+    assert entry['revision'] == 'rev-2'
+    assert set(entry['phases']) == {'checks', 'traffic_shift'}
+
+def write_function(folder, body):
+    path = os.path.join(str(folder), 'deployment.py')
+    with open(path, 'w') as f:
+        f.write('def inference_service_instance():\n    return %s\n' % body)
+    return path
+
+def test_read_function_from_file_same_module_name(tmp_path):
+    os.makedirs(str(tmp_path / 'a'))
+    os.makedirs(str(tmp_path / 'b'))
+    first = write_function(tmp_path / 'a', '"a"')
+    second = write_function(tmp_path / 'b', '"b"')
+
+    assert read_function_from_file(first)() == 'a'
+    assert read_function_from_file(second)() == 'b'
+
+def test_read_function_from_file_cache(tmp_path):
+    path = write_function(tmp_path, '1')
+    func = read_function_from_file(path)
+    assert read_function_from_file(path) is func
+
+    write_function(tmp_path, '2')
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+    assert read_function_from_file(path)() == 2
+
+def test_read_function_from_file_isolated(tmp_path):
+    path = os.path.join(str(tmp_path), 'deployment.py')
+    with open(path, 'w') as f:
+        f.write('import os\ndef inference_service_instance(fail=False):\n' +
+                '    if fail:\n        raise TypeError("invalid")\n    return os.getpid()\n')
+
+    func = read_function_from_file(path, isolate=True)
+
+    assert func() != os.getpid()
+    with pytest.raises(TypeError, match='invalid'):
+        func(fail=True)
+
+def test_isolated_function_loaded_only_by_its_process(tmp_path):
+    path = os.path.join(str(tmp_path), 'deployment.py')
+    with open(path, 'w') as f:
+        f.write('import os\nos.environ["KFOPS_TEST_LOADED"] = "1"\n' +
+                'def inference_service_instance():\n    return os.environ["KFOPS_TEST_LOADED"]\n')
+
+    func = read_function_from_file(path, isolate=True)
+    # Deployments call inference service functions from threads
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert list(executor.map(lambda _: func(), range(2))) == ['1', '1']
+    assert 'KFOPS_TEST_LOADED' not in os.environ
+    with pytest.raises(ModuleNotFoundError):
+        read_function_from_file(os.path.join(str(tmp_path), 'missing.py'), isolate=True)
+    with pytest.raises(AttributeError, match='Invalid deployment setup'):
+        read_function_from_file(path, function_name='missing', isolate=True)()
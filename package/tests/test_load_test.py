@@ -0,0 +1,181 @@
+import json
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from package.kfops.load_test import LoadTester, LoadTestReport, load_samples, percentile, \
+    check_thresholds, summary, compare_latency, LatencyComparison, latency_delta, is_regression, \
+    is_latency_stable, warm_up, ConcurrencyStep, concurrency_sweep, find_knee, recommend_autoscaling, \
+    BatcherTrial, select_batcher
+
+
+class PredictHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.received.append(data)
+        status = 500 if data.get('fail') else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+@pytest.fixture
+def server():
+    s = ThreadingHTTPServer(('127.0.0.1', 0), PredictHandler)
+    s.received = []
+    threading.Thread(target=s.serve_forever, daemon=True).start()
+    yield s
+    s.shutdown()
+    s.server_close()
+
+def url(server):
+    return 'http://127.0.0.1:%s/v1/models/test:predict' % server.server_address[1]
+
+def test_load_samples(tmp_path):
+    path = tmp_path / 'samples.jsonl'
+    path.write_text('{"instances": [1]}\n\n{"instances": [2]}\n')
+
+    assert load_samples(str(path)) == [{'instances': [1]}, {'instances': [2]}]
+
+def test_load_samples_empty_file(tmp_path):
+    path = tmp_path / 'samples.jsonl'
+    path.write_text('')
+
+    with pytest.raises(ValueError):
+        load_samples(str(path))
+
+def test_percentile():
+    values = list(range(1, 101))
+
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) is None
+
+def test_load_tester(server):
+    samples = [{'instances': [1]}, {'fail': True}]
+
+    report = LoadTester(url(server), samples, concurrency=4, requests_count=20).run()
+
+    assert report.requests == 20
+    assert report.errors == 10
+    assert len(report.latencies) == 10
+    assert len(server.received) == 20
+    assert summary(report)['error_rate'] == 0.5
+
+def test_load_tester_rps(server):
+    report = LoadTester(url(server), [{'instances': [1]}], requests_count=5, rps=20).run()
+
+    assert report.errors == 0
+    assert report.duration >= 0.2
+
+def test_check_thresholds():
+    report = LoadTestReport(requests=100, errors=2, duration=10, latencies=[10] * 90 + [300] * 8)
+
+    violations = check_thresholds(report, {
+        'max_p50_latency_ms': 50, 'max_p99_latency_ms': 200,
+        'max_error_rate': 0.01, 'min_throughput': 5})
+
+    assert violations == [
+        'p99 latency 300.0 ms exceeds 200 ms',
+        'error rate 2.00% exceeds 1.00%']
+
+def test_compare_latency(server):
+    comparison = compare_latency(url(server), url(server) + '?candidate', [{'instances': [1]}],
+                                 requests_count=4)
+
+    assert len(comparison.baseline) == len(comparison.candidate) == 4
+    assert comparison.errors == 0
+    assert len(server.received) == 8
+
+def test_latency_delta():
+    comparison = LatencyComparison(baseline=[100, 100, 100, 100], candidate=[150, 148, 152, 150], errors=0)
+
+    delta = latency_delta(comparison)
+
+    assert delta['delta_ms'] == 50
+    assert delta['ci_low_percent'] > 45 and delta['ci_high_percent'] < 55
+    assert is_regression(comparison, 40) == True
+    assert is_regression(comparison, 60) == False
+
+def test_noisy_difference_is_not_regression():
+    comparison = LatencyComparison(baseline=[100, 100, 100, 100], candidate=[40, 260, 50, 250], errors=0)
+
+    assert latency_delta(comparison)['delta_percent'] == 50
+    assert is_regression(comparison, 10) == False
+
+def test_is_latency_stable():
+    assert is_latency_stable([900, 500, 200, 100, 100, 100], window=3, tolerance_percent=20) == False
+    assert is_latency_stable([900, 100, 105, 100, 98, 102, 101], window=3, tolerance_percent=20) == True
+    assert is_latency_stable([100, 100], window=3, tolerance_percent=20) == False
+
+def test_warm_up(server):
+    report = warm_up(url(server), [{'instances': [1]}], min_requests=12, max_requests=50,
+                     window=3, tolerance_percent=1000)
+
+    assert report.stable == True
+    assert report.requests == 12
+    assert len(server.received) == 12
+
+def test_warm_up_max_requests(server):
+    report = warm_up(url(server), [{'instances': [1]}], min_requests=100, max_requests=5)
+
+    assert report.requests == 5
+    assert report.stable == False
+
+def test_warm_up_errors_excluded_from_latency(server):
+    report = warm_up(url(server), [{'instances': [1]}, {'fail': True}], min_requests=10, max_requests=6,
+                     window=1, tolerance_percent=1000)
+
+    assert report.errors == 3
+    assert len(report.latencies) == 3
+    assert report.requests == 6
+
+def test_concurrency_sweep(server):
+    steps = concurrency_sweep(url(server), [{'instances': [1]}], levels=[2, 1], requests_per_connection=3,
+                              max_latency_increase_percent=100000)
+
+    assert [s.concurrency for s in steps] == [1, 2]
+    assert len(server.received) == 9
+
+def test_concurrency_sweep_stops_on_errors(server):
+    steps = concurrency_sweep(url(server), [{'fail': True}], levels=[1, 2, 4], requests_per_connection=2)
+
+    assert len(steps) == 1
+    assert steps[0].error_rate == 1
+
+def test_find_knee():
+    steps = [
+        ConcurrencyStep(1, 10, 100, 0),
+        ConcurrencyStep(2, 19, 105, 0),
+        ConcurrencyStep(4, 36, 110, 0),
+        ConcurrencyStep(8, 38, 200, 0),
+    ]
+    assert find_knee(steps).concurrency == 4
+    # Throughput stops growing
+    assert find_knee(steps, max_latency_increase_percent=200).concurrency == 4
+    assert find_knee(steps, min_throughput_gain_percent=0, max_latency_increase_percent=200).concurrency == 8
+    assert find_knee([ConcurrencyStep(1, 10, 100, 0.5)]) is None
+
+def test_recommend_autoscaling():
+    knee = ConcurrencyStep(concurrency=16, throughput=80, p95_latency_ms=100, error_rate=0)
+
+    assert recommend_autoscaling(knee, replicas=2) == {
+        'container_concurrency': 8, 'scale_metric': 'concurrency', 'scale_target': 5,
+        'min_replicas': 1, 'max_replicas': None}
+    # One replica serves 80 / 2 * 0.7 = 28 req/s at the scale target
+    recommendation = recommend_autoscaling(knee, replicas=2, expected_rps=50, peak_rps=300)
+    assert recommendation['min_replicas'] == 2
+    assert recommendation['max_replicas'] == 11
+
+def test_select_batcher():
+    trials = [
+        BatcherTrial(None, 'rev-1', 50, 80, 0),
+        BatcherTrial({'max_batch_size': 8, 'max_latency': 10}, 'rev-2', 120, 90, 0),
+        BatcherTrial({'max_batch_size': 32, 'max_latency': 50}, 'rev-3', 200, 150, 0),
+        BatcherTrial({'max_batch_size': 32, 'max_latency': 10}, None, None, None, None),
+    ]
+    assert select_batcher(trials, max_p95_latency_ms=100).revision == 'rev-2'
+    assert select_batcher(trials, max_p95_latency_ms=200).revision == 'rev-3'
+    assert select_batcher(trials, max_p95_latency_ms=50) is None
@@ -0,0 +1,105 @@
+import time
+import pytest
+from unittest.mock import Mock
+from urllib.error import HTTPError
+from package.kfops.messengers import VersionControlMessenger
+
+def get_messenger(min_update_interval=0):
+    vc_manager = Mock()
+    vc_manager.create_comment.return_value = 123
+    vc_manager.find_comment.return_value = None
+    return VersionControlMessenger(1, vc_manager, min_update_interval=min_update_interval,
+                                   retry_delay=0)
+
+def status(messenger, body):
+    return '%s\n%s' % (body, messenger.marker)
+
+def test_messages_edit_single_comment():
+    messenger = get_messenger()
+
+    messenger.generic_message('first')
+    messenger.flush()
+    messenger.generic_message('second')
+    messenger.flush()
+
+    messenger.vc_manager.create_comment.assert_called_once_with(status(messenger, 'first'))
+    messenger.vc_manager.update_comment.assert_called_once_with(123, status(messenger, 'first\n<hr/>\nsecond'))
+
+def test_updates_throttled_and_coalesced():
+    messenger = get_messenger(min_update_interval=10)
+    messenger.generic_message('first')
+    messenger.flush()
+
+    messenger.generic_message('second')
+    messenger.generic_message('third')
+    time.sleep(0.1)
+    assert messenger.vc_manager.update_comment.call_count == 0
+
+    messenger.flush()
+    messenger.vc_manager.update_comment.assert_called_once_with(
+        123, status(messenger, 'first\n<hr/>\nsecond\n<hr/>\nthird'))
+
+def test_message_does_not_block():
+    messenger = get_messenger()
+    messenger.vc_manager.create_comment.side_effect = lambda body: time.sleep(0.5) or 123
+
+    start = time.monotonic()
+    messenger.generic_message('first')
+    assert time.monotonic() - start < 0.5
+
+    messenger.flush()
+    assert messenger.comment_id == 123
+
+def test_transient_error_retried():
+    messenger = get_messenger()
+    messenger.vc_manager.create_comment.side_effect = [
+        HTTPError('url', 502, 'Bad Gateway', {}, None), 123]
+
+    messenger.generic_message('first')
+    messenger.flush()
+
+    assert messenger.vc_manager.create_comment.call_count == 2
+    assert messenger.comment_id == 123
+
+def test_comment_created_by_failed_request_not_duplicated():
+    messenger = get_messenger()
+    messenger.vc_manager.create_comment.side_effect = HTTPError('url', 504, 'Gateway Timeout', {}, None)
+    messenger.vc_manager.find_comment.return_value = 123
+
+    messenger.generic_message('first')
+    messenger.flush()
+
+    assert messenger.vc_manager.create_comment.call_count == 1
+    messenger.vc_manager.find_comment.assert_called_once_with(messenger.marker)
+    assert messenger.comment_id == 123
+
+def test_error_not_retried():
+    messenger = get_messenger()
+    messenger.vc_manager.create_comment.side_effect = HTTPError('url', 404, 'Not Found', {}, None)
+
+    messenger.generic_message('first')
+    messenger.flush()
+
+    assert messenger.vc_manager.create_comment.call_count == 1
+
+def test_error_published_immediately():
+    messenger = get_messenger(min_update_interval=10)
+    messenger.generic_message('first')
+    messenger.flush()
+
+    with pytest.raises(SystemExit):
+        messenger.generic_error_message('error')
+
+    messenger.vc_manager.update_comment.assert_called_once_with(123, status(messenger, 'first\n<hr/>\nerror'))
+
+def test_manager_without_comment_ids():
+    messenger = get_messenger()
+    messenger.vc_manager.create_comment.return_value = None
+
+    messenger.generic_message('first')
+    messenger.flush()
+    messenger.generic_message('second')
+    messenger.flush()
+
+    assert messenger.vc_manager.create_comment.call_count == 2
+    messenger.vc_manager.create_comment.assert_called_with(status(messenger, 'second'))
@@ -0,0 +1,111 @@
+import os
+import pytest
+import yaml
+from unittest.mock import patch, Mock
+from munch import munchify
+from kubernetes.client.rest import ApiException
+
+from package.kfops.config import InvalidConfigException
+from package.kfops.model_storage import PvcModelStorage, S3ModelStorage, ModelStorageException, model_storage
+
+settings = {'type': 'pvc', 'pvc_name': 'models', 'credentials_secret': 'minio', 's3_endpoint': 'minio:9000'}
+
+
+def job(name='kfops-model-staging-abc', succeeded=None, active=None, conditions=None):
+    return munchify({'metadata': {'name': name},
+                     'status': {'succeeded': succeeded, 'active': active, 'conditions': conditions}})
+
+def test_model_storage_factory():
+    assert isinstance(model_storage(None, 'prod'), S3ModelStorage)
+    assert model_storage(settings, 'prod').storage_uri('123') == 'pvc://models/trained-models/123/'
+    with pytest.raises(InvalidConfigException):
+        model_storage({'type': 'nfs'}, 'prod')
+
+@patch('package.kfops.model_storage.batch_v1_api')
+def test_stage_creates_job(batch_v1_api):
+    batch_v1_api.read_namespaced_job_status.side_effect = [ApiException(status=404), job(succeeded=1)]
+
+    assert PvcModelStorage(settings, 'prod').stage('123') == True
+
+    body = batch_v1_api.create_namespaced_job.call_args[1]['body']
+    container = body['spec']['template']['spec']['containers'][0]
+    assert container['args'] == ['s3://trained-models/123/', '/mnt/models/trained-models/123']
+    assert container['envFrom'] == [{'secretRef': {'name': 'minio'}}]
+    assert body['spec']['template']['spec']['volumes'][0]['persistentVolumeClaim']['claimName'] == 'models'
+    assert body['metadata']['labels']['kfops/model-staging'] == '123'
+    assert body['metadata']['name'] == PvcModelStorage(settings, 'prod').job_name('123')
+
+def test_job_name():
+    storage = PvcModelStorage(settings, 'prod')
+    assert storage.job_name('123') == storage.job_name('123')
+    assert storage.job_name('123') != storage.job_name('124')
+    assert storage.job_name('123') != PvcModelStorage(dict(settings, path='other'), 'prod').job_name('123')
+    assert len(storage.job_name('7d6e5a31-3c43-4a5e-9e4b-2f1d5c6b7a8e')) <= 63
+
+@patch('package.kfops.model_storage.batch_v1_api')
+def test_stage_skips_staged_model(batch_v1_api):
+    batch_v1_api.read_namespaced_job_status.return_value = job(succeeded=1)
+
+    assert PvcModelStorage(settings, 'prod').stage('123') == False
+    assert batch_v1_api.create_namespaced_job.call_count == 0
+
+@patch('package.kfops.model_storage.batch_v1_api')
+def test_stage_waits_for_running_job(batch_v1_api):
+    batch_v1_api.read_namespaced_job_status.side_effect = [job(active=1), job(succeeded=1)]
+
+    assert PvcModelStorage(settings, 'prod').stage('123') == True
+    assert batch_v1_api.create_namespaced_job.call_count == 0
+
+@patch('package.kfops.model_storage.batch_v1_api')
+def test_stage_waits_for_job_created_concurrently(batch_v1_api):
+    batch_v1_api.read_namespaced_job_status.side_effect = [ApiException(status=404), job(succeeded=1)]
+    batch_v1_api.create_namespaced_job.side_effect = ApiException(status=409)
+
+    assert PvcModelStorage(settings, 'prod').stage('123') == True
+    assert batch_v1_api.read_namespaced_job_status.call_count == 2
+
+@patch('package.kfops.model_storage.time')
+@patch('package.kfops.model_storage.batch_v1_api')
+def test_stage_restarts_failed_job(batch_v1_api, time):
+    time.monotonic.return_value = 0
+    failed = job(conditions=[{'type': 'Failed', 'status': 'True', 'reason': 'BackoffLimitExceeded', 'message': None}])
+    batch_v1_api.read_namespaced_job_status.side_effect = [
+        failed, failed, ApiException(status=404), job(succeeded=1)]
+
+    assert PvcModelStorage(settings, 'prod').stage('123') == True
+    assert batch_v1_api.delete_namespaced_job.call_count == 1
+    assert batch_v1_api.create_namespaced_job.call_count == 1
+
+@patch('package.kfops.model_storage.batch_v1_api')
+def test_stage_job_failed(batch_v1_api):
+    batch_v1_api.read_namespaced_job_status.side_effect = [ApiException(status=404), job(conditions=[
+        {'type': 'Failed', 'status': 'True', 'reason': 'BackoffLimitExceeded', 'message': None}])]
+
+    with pytest.raises(ModelStorageException, match='BackoffLimitExceeded'):
+        PvcModelStorage(settings, 'prod').stage('123')
+
+def cluster_role_rules():
+    'Rules of the ClusterRole of deployment steps, Helm directives are left out'
+    path = os.path.join(os.path.dirname(__file__), '..', '..', 'cluster_setup', 'kfops', 'templates',
+                        'argo-pipeline-runner-rbac.yaml')
+    with open(path) as f:
+        manifests = yaml.safe_load_all('\n'.join(l for l in f.read().splitlines() if '{{' not in l))
+        return next(m for m in manifests if m['kind'] == 'ClusterRole')['rules']
+
+@patch('package.kfops.model_storage.batch_v1_api')
+def test_job_api_calls_allowed_by_cluster_role(batch_v1_api):
+    failed = job(conditions=[{'type': 'Failed', 'status': 'True', 'reason': 'BackoffLimitExceeded', 'message': None}])
+    batch_v1_api.read_namespaced_job_status.side_effect = [failed, ApiException(status=404), job(succeeded=1)]
+
+    PvcModelStorage(settings, 'prod').stage('123')
+
+    # Kubernetes API client methods and resources (and verbs) they require
+    permissions = {'list_namespaced_job': ('jobs', 'list'), 'create_namespaced_job': ('jobs', 'create'),
+                   'read_namespaced_job': ('jobs', 'get'), 'read_namespaced_job_status': ('jobs/status', 'get'),
+                   'delete_namespaced_job': ('jobs', 'delete')}
+    called = [c[0] for c in batch_v1_api.method_calls]
+    assert 'read_namespaced_job_status' in called
+    allowed = {(r, v) for rule in cluster_role_rules() if 'batch' in rule['apiGroups']
+               for r in rule['resources'] for v in rule['verbs']}
+    for method in called:
+        assert permissions[method] in allowed, method
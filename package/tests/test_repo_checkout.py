@@ -0,0 +1,208 @@
+import os
+import time
+import subprocess
+import yaml
+import pytest
+from package.kfops.config import Config
+from package.kfops.repo_checkout import RepositoryMirror, RepositoryCheckoutException, \
+    command_checkout_paths, get_checkout_paths
+
+config_str = '''
+repository:
+  owner: my-repo-username
+  name: kfops-sample
+  sparse_checkout:
+    enabled: true
+    additional_paths:
+      - lib/
+pipeline:
+  name: Pipeline name
+  namespace: my-namespace
+  experiment_name: Test experiment
+  pipeline_path: pipeline/pipeline.py
+deployment:
+  inference_service_name: sklearn-iris
+  inference_service_function_path: config_files/deployment.py
+  pre_deployment_test_sample_input_path: test_deployment/input.json
+  production:
+    namespace: prod
+image_builder:
+  container_registry_uri: my-registry
+  images:
+    - name: my_image_name
+      dockerfile_folder_path: containers/my_image_name
+      other_folders_path:
+        - containers/lib
+'''
+
+
+def git(cwd, *args):
+    return subprocess.run(
+        ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com'] + list(args),
+        cwd=cwd, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+
+def origin_path(url):
+    return url.replace('file://', '')
+
+def commit_file(repo, path, content):
+    full_path = os.path.join(repo, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'w') as f:
+        f.write(content)
+    git(repo, 'add', path)
+    git(repo, 'commit', '-q', '-m', 'Update %s' % path)
+    return git(repo, 'rev-parse', 'HEAD')
+
+@pytest.fixture
+def origin(tmp_path):
+    repo = str(tmp_path / 'origin')
+    os.makedirs(repo)
+    git(repo, 'init', '-q')
+    git(repo, 'config', 'uploadpack.allowFilter', 'true')
+    commit_file(repo, 'config_files/config.yaml', config_str)
+    commit_file(repo, 'data/dataset.csv', 'a,b,c')
+    git(repo, 'branch', '-M', 'main')
+    git(repo, 'checkout', '-q', '-b', 'feature')
+    sha = commit_file(repo, 'model/train.py', 'print(1)')
+    git(repo, 'update-ref', 'refs/pull/1/head', sha)
+    git(repo, 'checkout', '-q', 'main')
+    return 'file://%s' % repo
+
+def test_fetch_pull_request_creates_mirror(origin, tmp_path):
+    mirror = RepositoryMirror(str(tmp_path / 'cache'), 'owner', 'repo', url=origin)
+
+    sha = mirror.fetch_pull_request(1)
+
+    assert mirror.exists()
+    assert sha == git(origin_path(origin), 'rev-parse', 'refs/pull/1/head')
+    assert mirror.git('rev-parse', 'refs/heads/main') == git(origin_path(origin), 'rev-parse', 'main')
+
+def test_fetch_pull_request_updates_existing_mirror(origin, tmp_path):
+    mirror = RepositoryMirror(str(tmp_path / 'cache'), 'owner', 'repo', url=origin)
+    mirror.fetch_pull_request(1)
+
+    git(origin_path(origin), 'checkout', '-q', 'feature')
+    new_sha = commit_file(origin_path(origin), 'model/train.py', 'print(2)')
+    git(origin_path(origin), 'update-ref', 'refs/pull/1/head', new_sha)
+
+    assert mirror.fetch_pull_request(1) == new_sha
+
+def test_add_worktree(origin, tmp_path):
+    mirror = RepositoryMirror(str(tmp_path / 'cache'), 'owner', 'repo', url=origin)
+    sha = mirror.fetch_pull_request(1)
+
+    destination = str(tmp_path / 'volume' / 'repo')
+    mirror.add_worktree(sha, destination)
+
+    with open(os.path.join(destination, 'model/train.py')) as f:
+        assert f.read() == 'print(1)'
+    assert git(destination, 'rev-parse', 'HEAD') == sha
+
+def test_worktree_of_other_run_is_not_pruned(origin, tmp_path):
+    mirror = RepositoryMirror(str(tmp_path / 'cache'), 'owner', 'repo', url=origin)
+    sha = mirror.fetch_pull_request(1)
+
+    # Worktree of a workflow running in another pod (its folder is not visible here)
+    other_run = tmp_path / 'other-pod' / 'run-1'
+    mirror.add_worktree(sha, str(other_run))
+    os.rename(str(other_run), str(tmp_path / 'run-1'))
+    mirror.fetch_pull_request(1)
+    os.rename(str(tmp_path / 'run-1'), str(other_run))
+
+    assert git(str(other_run), 'rev-parse', 'HEAD') == sha
+    assert 'run-1' in os.listdir(os.path.join(mirror.path, 'worktrees'))
+
+def test_remove_worktree(origin, tmp_path):
+    mirror = RepositoryMirror(str(tmp_path / 'cache'), 'owner', 'repo', url=origin)
+    sha = mirror.fetch_pull_request(1)
+
+    destination = str(tmp_path / 'volume' / 'run-1')
+    mirror.add_worktree(sha, destination)
+    mirror.remove_worktree(destination)
+
+    assert not os.path.exists(destination)
+    assert mirror.git('worktree', 'list').count('\n') == 0
+
+def test_stale_worktree_is_pruned(origin, tmp_path):
+    mirror = RepositoryMirror(str(tmp_path / 'cache'), 'owner', 'repo', url=origin)
+    sha = mirror.fetch_pull_request(1)
+
+    destination = tmp_path / 'volume' / 'run-1'
+    mirror.add_worktree(sha, str(destination))
+    subprocess.run(['rm', '-rf', str(destination)], check=True)
+    admin_path = os.path.join(mirror.path, 'worktrees', 'run-1')
+    two_days_ago = time.time() - 48 * 3600
+    for f in os.listdir(admin_path):
+        os.utime(os.path.join(admin_path, f), (two_days_ago, two_days_ago))
+    mirror.prune_worktrees()
+
+    assert not os.path.exists(admin_path)
+
+def test_add_worktree_non_empty_destination(origin, tmp_path):
+    mirror = RepositoryMirror(str(tmp_path / 'cache'), 'owner', 'repo', url=origin)
+    sha = mirror.fetch_pull_request(1)
+
+    destination = tmp_path / 'repo'
+    destination.mkdir()
+    (destination / 'file.txt').write_text('foo')
+
+    with pytest.raises(RepositoryCheckoutException):
+        mirror.add_worktree(sha, str(destination))
+
+def test_fetch_missing_pull_request(origin, tmp_path):
+    mirror = RepositoryMirror(str(tmp_path / 'cache'), 'owner', 'repo', url=origin)
+
+    with pytest.raises(RepositoryCheckoutException):
+        mirror.fetch_pull_request(2)
+
+def test_add_worktree_sparse_checkout(origin, tmp_path):
+    mirror = RepositoryMirror(str(tmp_path / 'cache'), 'owner', 'repo', url=origin)
+    sha = mirror.fetch_pull_request(1)
+
+    destination = str(tmp_path / 'repo')
+    mirror.add_worktree(sha, destination, paths=['config_files/', 'model/train.py'])
+
+    assert os.path.exists(os.path.join(destination, 'config_files/config.yaml'))
+    assert os.path.exists(os.path.join(destination, 'model/train.py'))
+    assert not os.path.exists(os.path.join(destination, 'data'))
+    # Configured without `git sparse-checkout` (git < 2.25)
+    assert mirror.git('config', 'core.sparseCheckout', cwd=destination, git_dir=False) == 'true'
+
+    # Sparse checkout doesn't affect the mirror and other worktrees
+    full = str(tmp_path / 'full')
+    mirror.add_worktree(mirror.fetch_pull_request(1), full)
+    assert os.path.exists(os.path.join(full, 'data'))
+    assert mirror.git('rev-parse', '--is-bare-repository') == 'true'
+
+def test_mirror_is_blobless(origin, tmp_path):
+    mirror = RepositoryMirror(str(tmp_path / 'cache'), 'owner', 'repo', url=origin)
+    sha = mirror.fetch_pull_request(1)
+
+    missing = mirror.git('rev-list', '--objects', '--missing=print', sha)
+    assert any(line.startswith('?') for line in missing.splitlines())
+
+def test_get_checkout_paths(origin, tmp_path):
+    mirror = RepositoryMirror(str(tmp_path / 'cache'), 'owner', 'repo', url=origin)
+    sha = mirror.fetch_pull_request(1)
+
+    paths = get_checkout_paths(mirror, sha, '/deploy --run-id=123')
+
+    assert 'config_files/deployment.py' in paths
+
+def test_command_checkout_paths():
+    c = Config(validate_files=False, check_files_existence=False, config=yaml.safe_load(config_str))
+
+    assert command_checkout_paths('build', c) == [
+        'config_files/', '.gitattributes', 'lib/', 'pipeline/',
+        'containers/my_image_name/', 'containers/lib/']
+    assert command_checkout_paths('run', c) == ['config_files/', '.gitattributes', 'lib/']
+    assert command_checkout_paths('deploy', c) == [
+        'config_files/', '.gitattributes', 'lib/',
+        'config_files/deployment.py', 'test_deployment/input.json']
+
+def test_command_checkout_paths_sparse_checkout_disabled():
+    config = yaml.safe_load(config_str)
+    del config['repository']['sparse_checkout']
+    c = Config(validate_files=False, check_files_existence=False, config=config)
+
+    assert command_checkout_paths('build', c) is None
@@ -0,0 +1,53 @@
+import pytest
+from unittest.mock import patch, Mock
+from requests.exceptions import ConnectionError
+from package.kfops.config import InvalidConfigException
+from package.kfops.serving_metrics import PrometheusMetricsSource, RevisionMetrics, \
+    MetricsSourceException, metrics_source, check_revision_metrics
+
+def prometheus_response(value):
+    resp = Mock()
+    resp.json.return_value = {'data': {'result': [{'value': [0, value]}] if value is not None else []}}
+    return resp
+
+@patch('package.kfops.serving_metrics.requests')
+def test_prometheus_revision_metrics(requests):
+    requests.get.side_effect = [
+        prometheus_response('200'), prometheus_response('4'), prometheus_response('120.5')]
+    source = PrometheusMetricsSource('http://prometheus:9090/')
+
+    metrics = source.revision_metrics('prod', 'model-predictor-00002', 60)
+
+    assert metrics == RevisionMetrics(requests=200, error_rate=0.02, p95_latency_ms=120.5)
+    url, = requests.get.call_args_list[0][0]
+    assert url == 'http://prometheus:9090/api/v1/query'
+    query = requests.get.call_args_list[1][1]['params']['query']
+    assert 'revision_name="model-predictor-00002"' in query
+    assert 'response_code_class="5xx"' in query
+    assert '[60s]' in query
+
+@patch('package.kfops.serving_metrics.requests')
+def test_prometheus_no_traffic(requests):
+    requests.get.side_effect = [prometheus_response(None), prometheus_response(None),
+                                prometheus_response('NaN')]
+
+    metrics = PrometheusMetricsSource('http://prometheus:9090').revision_metrics('prod', 'rev', 60)
+
+    assert metrics == RevisionMetrics(requests=0, error_rate=0, p95_latency_ms=None)
+
+@patch('package.kfops.serving_metrics.requests.get', side_effect=ConnectionError('refused'))
+def test_prometheus_unavailable(get):
+    with pytest.raises(MetricsSourceException):
+        PrometheusMetricsSource('http://prometheus:9090').revision_metrics('prod', 'rev', 60)
+
+def test_metrics_source_invalid_type():
+    with pytest.raises(InvalidConfigException):
+        metrics_source({'type': 'datadog'})
+
+def test_check_revision_metrics():
+    thresholds = {'max_error_rate': 0.01, 'max_p95_latency_ms': 100, 'min_requests': 10}
+
+    assert check_revision_metrics(RevisionMetrics(100, 0.0, 80), thresholds) == []
+    assert check_revision_metrics(RevisionMetrics(5, 0.5, 500), thresholds) == []
+    assert check_revision_metrics(RevisionMetrics(100, 0.05, 150), thresholds) == [
+        'error rate 5.00% exceeds 1.00%', 'p95 latency 150.0 ms exceeds 100 ms']
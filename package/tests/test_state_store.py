@@ -0,0 +1,67 @@
+import json
+import pytest
+from unittest.mock import patch, Mock
+from munch import munchify
+from kubernetes.client.rest import ApiException
+
+from package.kfops.state_store import ConfigMapStateStore
+
+
+def configmap(data):
+    return munchify({'metadata': {'name': 'test'}, 'data': data})
+
+def test_configmap_name():
+    name = ConfigMapStateStore.configmap_name('My_Owner', 'repo.name', 12)
+    assert name == 'kfops-pr-state-my-owner-repo-name-12'
+
+@patch('package.kfops.state_store.v1_api')
+def test_get(v1_api):
+    v1_api.read_namespaced_config_map.return_value = configmap({'RUN_ID': '123'})
+    store = ConfigMapStateStore('owner', 'repo', 1)
+
+    assert store.get('RUN_ID') == '123'
+    assert store.get('VERSION_ID') is None
+    assert v1_api.read_namespaced_config_map.call_count == 1
+
+@patch('package.kfops.state_store.v1_api')
+def test_get_configmap_does_not_exist(v1_api):
+    v1_api.read_namespaced_config_map.side_effect = ApiException(status=404)
+    store = ConfigMapStateStore('owner', 'repo', 1)
+
+    assert store.get('RUN_ID') is None
+    assert store.history() == []
+
+@patch('package.kfops.state_store.v1_api')
+def test_set_creates_configmap(v1_api):
+    v1_api.read_namespaced_config_map.side_effect = ApiException(status=404)
+    store = ConfigMapStateStore('owner', 'repo', 1, namespace='kfops')
+
+    store.set({'VERSION_ID': 'abc'})
+
+    body = v1_api.create_namespaced_config_map.call_args[1]['body']
+    assert body['metadata']['name'] == 'kfops-pr-state-owner-repo-1'
+    assert body['data']['VERSION_ID'] == 'abc'
+    assert json.loads(body['data']['history'])[0]['value'] == 'abc'
+    assert store.get('VERSION_ID') == 'abc'
+
+@patch('package.kfops.state_store.v1_api')
+def test_set_updates_configmap_and_history(v1_api):
+    history = json.dumps([{'variable': 'RUN_ID', 'value': '1', 'time': ''}])
+    v1_api.read_namespaced_config_map.return_value = configmap({'RUN_ID': '1', 'history': history})
+    store = ConfigMapStateStore('owner', 'repo', 1)
+
+    store.set({'RUN_ID': '2'})
+
+    body = v1_api.replace_namespaced_config_map.call_args[1]['body']
+    assert body.data['RUN_ID'] == '2'
+    assert [h['value'] for h in json.loads(body.data['history'])] == ['1', '2']
+
+@patch('package.kfops.state_store.v1_api')
+def test_set_retries_on_conflict(v1_api):
+    v1_api.read_namespaced_config_map.return_value = configmap({})
+    v1_api.replace_namespaced_config_map.side_effect = [ApiException(status=409), None]
+    store = ConfigMapStateStore('owner', 'repo', 1)
+
+    store.set({'RUN_ID': '2'})
+
+    assert v1_api.replace_namespaced_config_map.call_count == 2
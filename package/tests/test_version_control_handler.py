@@ -1,3 +1,4 @@
+import json
 import pytest
 import yaml
 from unittest.mock import patch, Mock, PropertyMock, call
@@ -121,7 +122,8 @@ def test_vc_parses_command_params(messenger, isvc_deployer):
         VCManager=TestVCManager)
     test_handler.exec_command()
 
-    isvc_deployer.assert_called_with('123', 'my-production-namespace', config=c, sample_input=None)
+    isvc_deployer.assert_called_with('123', 'my-production-namespace', config=c, sample_input=None,
+                                     profile=False, model=None, history=None)
 
 
 @patch('package.kfops.handler.VersionControlMessenger')
@@ -300,4 +302,306 @@ def test_vc_deploy_success(isvc_deployer, messenger):
     test_handler.exec_command()
     
     assert isvc_deployer.return_value.deploy.call_count == 1
-    assert TestVCManager.return_value.add_label.call_count == 1
\ No newline at end of file
+    assert TestVCManager.return_value.add_label.call_count == 1
+
+@patch('package.kfops.handler.VersionControlMessenger')
+@patch('package.kfops.handler.IsvcDeployer')
+def test_vc_deploy_reads_run_id_from_state_store(isvc_deployer, messenger):
+    client = Mock()
+    TestVCManager = Mock()
+    state_store = Mock()
+    state_store.get.return_value = '123'
+    isvc_deployer.return_value.batcher_tuning = None
+
+    c = ConfigOverride(validate_files=False, check_files_existence=False, config=yaml.safe_load(config_str_with_prod_namespace))
+    test_handler = VersionControlHandler(
+        client=client,
+        command='deploy', command_params={'force': True},
+        pr_number='1', config=c,
+        VCManager=TestVCManager, state_store=state_store)
+    test_handler.exec_command()
+
+    state_store.get.assert_called_with('RUN_ID')
+    assert TestVCManager.return_value.extract_hidden_variables.call_count == 0
+    isvc_deployer.assert_called_with('123', 'my-production-namespace', config=c, sample_input=None,
+                                     profile=False, model=None, history=None)
+
+@patch('package.kfops.handler.VersionControlMessenger')
+@patch('package.kfops.handler.IsvcDeployer')
+def test_vc_deploy_migrates_comment_variables_to_state_store(isvc_deployer, messenger):
+    client = Mock()
+    TestVCManager = Mock()
+    TestVCManager.return_value.extract_hidden_variables.return_value = {'RUN_ID': '123'}
+    state_store = Mock()
+    state_store.get.return_value = None
+    isvc_deployer.return_value.batcher_tuning = None
+
+    c = ConfigOverride(validate_files=False, check_files_existence=False, config=yaml.safe_load(config_str_with_prod_namespace))
+    test_handler = VersionControlHandler(
+        client=client,
+        command='deploy', command_params={'force': True},
+        pr_number='1', config=c,
+        VCManager=TestVCManager, state_store=state_store)
+    test_handler.exec_command()
+
+    state_store.set.assert_called_once_with({'RUN_ID': '123'})
+    isvc_deployer.assert_called_with('123', 'my-production-namespace', config=c, sample_input=None,
+                                     profile=False, model=None, history=None)
+
+@patch('package.kfops.handler.VersionControlMessenger')
+@patch('package.kfops.handler.IsvcDeployer')
+def test_vc_deploy_migrates_only_missing_variables(isvc_deployer, messenger):
+    client = Mock()
+    TestVCManager = Mock()
+    TestVCManager.return_value.extract_hidden_variables.return_value = {'RUN_ID': '123', 'VERSION_ID': 'v0'}
+    state_store = Mock()
+    state_store.get.side_effect = lambda name: {'VERSION_ID': 'v1'}.get(name)
+    isvc_deployer.return_value.batcher_tuning = None
+
+    c = ConfigOverride(validate_files=False, check_files_existence=False, config=yaml.safe_load(config_str_with_prod_namespace))
+    test_handler = VersionControlHandler(
+        client=client,
+        command='deploy', command_params={'force': True},
+        pr_number='1', config=c,
+        VCManager=TestVCManager, state_store=state_store)
+    test_handler.exec_command()
+
+    state_store.set.assert_called_once_with({'RUN_ID': '123'})
+
+@patch('package.kfops.handler.VersionControlMessenger')
+@patch('package.kfops.handler.IsvcDeployer')
+def test_vc_deploy_stores_batcher_tuning(isvc_deployer, messenger):
+    client = Mock()
+    TestVCManager = Mock()
+    state_store = Mock()
+    TestVCManager.return_value.merge_pr.return_value = True, None
+    TestVCManager.return_value.close_pr.return_value = True, None
+    stored = {'BATCHER_TUNING': json.dumps({'ns/sklearn-iris/122': {'run_id': '122'}})}
+    state_store.get.side_effect = lambda name: stored.get(name, '123')
+    isvc_deployer.side_effect = lambda run_id, namespace, **kwargs: Mock(
+        error=None, reports=[], inference_service_name=kwargs['model'].inference_service_name
+        if kwargs['model'] else 'sklearn-iris',
+        batcher_tuning={'run_id': run_id, 'namespace': namespace, 'selected': None, 'trials': [],
+                        'inference_service_name': kwargs['model'].inference_service_name
+                        if kwargs['model'] else 'sklearn-iris'})
+
+    c = ConfigOverride(validate_files=False, check_files_existence=False, config=yaml.safe_load(config_str_with_targets))
+    test_handler = VersionControlHandler(
+        client=client,
+        command='deploy', command_params={'force': True},
+        pr_number='1', config=c,
+        VCManager=TestVCManager, state_store=state_store)
+    test_handler.exec_command()
+
+    state_store.set.assert_called_once()
+    results = json.loads(state_store.set.call_args[0][0]['BATCHER_TUNING'])
+    assert sorted(results) == [
+        'my-production-namespace-eu/sklearn-iris-large/123', 'my-production-namespace-eu/sklearn-iris/123',
+        'my-production-namespace/sklearn-iris-large/123', 'my-production-namespace/sklearn-iris/123',
+        'ns/sklearn-iris/122']
+    assert results['my-production-namespace/sklearn-iris-large/123']['selected'] is None
+
+@patch('package.kfops.handler.VersionControlMessenger')
+@patch('package.kfops.handler.PipelineRunner')
+@patch('package.kfops.handler.PipelineBuilder')
+def test_vc_handler_build_run_stores_variables(pipeline_builder, pipeline_runner, messenger):
+    pipeline_builder.return_value.build.return_value = {'version_id': 'v1'}
+    pipeline_runner.return_value.run_pipeline.return_value = munchify({'run_info': {'id': '123'}})
+    pipeline_runner.return_value.wait_for_run_completion.return_value = munchify({'run_status': 'Succeeded', 'run_time': '1m'})
+    client = Mock()
+    TestVCManager = Mock()
+    state_store = Mock()
+
+    c = ConfigOverride(validate_files=False, check_files_existence=False, config=yaml.safe_load(config_str))
+    test_handler = VersionControlHandler(
+        client=client, command='build_run', pr_number='1', config=c,
+        VCManager=TestVCManager, state_store=state_store)
+    test_handler.exec_command()
+
+    state_store.set.assert_has_calls([call({'VERSION_ID': 'v1'}), call({'RUN_ID': '123'})])
+
+config_str_with_targets = config_str_with_prod_namespace + '''
+    additional_namespaces:
+      - my-production-namespace-eu
+  variants:
+    - inference_service_name: sklearn-iris-large
+  max_parallel_deployments: 2
+'''
+
+def fake_deployer(failing_namespace=None):
+    def create(run_id, namespace, config, sample_input, profile, model, history):
+        return Mock(
+            namespace=namespace, error='Not ready' if namespace == failing_namespace else None,
+            reports=[], batcher_tuning=None,
+            inference_service_name=model.inference_service_name if model else 'sklearn-iris')
+    return create
+
+@patch('package.kfops.handler.VersionControlMessenger')
+@patch('package.kfops.handler.IsvcDeployer')
+def test_vc_deploy_multiple_targets(isvc_deployer, messenger):
+    client = Mock()
+    TestVCManager = Mock()
+    TestVCManager.return_value.merge_pr.return_value = True, None
+    TestVCManager.return_value.close_pr.return_value = True, None
+    isvc_deployer.side_effect = fake_deployer()
+
+    c = ConfigOverride(validate_files=False, check_files_existence=False, config=yaml.safe_load(config_str_with_targets))
+    test_handler = VersionControlHandler(
+        client=client,
+        command='deploy', command_params={'force': True, 'run-id': '123'},
+        pr_number='1', config=c,
+        VCManager=TestVCManager)
+    test_handler.exec_command()
+
+    assert [(c[0][1], c[1]['model'] and c[1]['model'].inference_service_name)
+            for c in isvc_deployer.call_args_list] == [
+        ('my-production-namespace', None), ('my-production-namespace', 'sklearn-iris-large'),
+        ('my-production-namespace-eu', None), ('my-production-namespace-eu', 'sklearn-iris-large')]
+    message = messenger.return_value.generic_message.call_args[0][0]
+    assert 'successfuly deployed to 4 targets' in message
+    assert '<td>my-production-namespace-eu</td><td>sklearn-iris-large</td><td>Deployed</td>' in message
+    TestVCManager.return_value.add_label.assert_has_calls([
+        call('Deployed-to-my-production-namespace'), call('Deployed-to-my-production-namespace-eu')])
+    assert TestVCManager.return_value.merge_pr.call_count == 1
+
+@patch('package.kfops.handler.VersionControlMessenger')
+@patch('package.kfops.handler.IsvcDeployer')
+def test_vc_deploy_multiple_targets_partial_failure(isvc_deployer, messenger):
+    client = Mock()
+    TestVCManager = Mock()
+    isvc_deployer.side_effect = fake_deployer(failing_namespace='my-production-namespace-eu')
+    messenger.return_value.generic_error_message.side_effect = SystemExit()
+
+    c = ConfigOverride(validate_files=False, check_files_existence=False, config=yaml.safe_load(config_str_with_targets))
+    test_handler = VersionControlHandler(
+        client=client,
+        command='deploy', command_params={'force': True, 'run-id': '123'},
+        pr_number='1', config=c,
+        VCManager=TestVCManager)
+    with pytest.raises(SystemExit):
+        test_handler.exec_command()
+
+    message = messenger.return_value.generic_error_message.call_args[0][0]
+    assert 'failed for 2 of 4 targets' in message
+    assert '<b>my-production-namespace-eu/sklearn-iris</b><br/>Not ready' in message
+    assert TestVCManager.return_value.add_label.call_count == 0
+    assert TestVCManager.return_value.merge_pr.call_count == 0
+
+@patch('package.kfops.handler.VersionControlMessenger')
+@patch('package.kfops.handler.IsvcDeployer')
+def test_vc_rollback(isvc_deployer, messenger):
+    client = Mock()
+    TestVCManager = Mock()
+    history = Mock()
+    isvc_deployer.return_value.error = None
+    isvc_deployer.return_value.run_id = '122'
+    isvc_deployer.return_value.reports = ['Traffic routed back to revision sklearn-iris-predictor-00001']
+
+    c = ConfigOverride(validate_files=False, check_files_existence=False, config=yaml.safe_load(config_str_with_prod_namespace))
+    test_handler = VersionControlHandler(
+        client=client, command='rollback',
+        pr_number='1', config=c,
+        VCManager=TestVCManager, deployment_history=history)
+    test_handler.exec_command()
+
+    isvc_deployer.assert_called_with(None, 'my-production-namespace', config=c, sample_input=None,
+                                     profile=False, model=None, history=history)
+    isvc_deployer.return_value.rollback.assert_called_once_with(None)
+    isvc_deployer.return_value.deploy.assert_not_called()
+    message = messenger.return_value.generic_message.call_args[0][0]
+    assert 'rolled back to RUN_ID: 122' in message
+    assert TestVCManager.return_value.add_label.call_count == 0
+    assert TestVCManager.return_value.merge_pr.call_count == 0
+
+@patch('package.kfops.handler.VersionControlMessenger')
+@patch('package.kfops.handler.RawIsvcDeployer')
+@patch('package.kfops.handler.IsvcDeployer')
+def test_vc_deploy_raw_mode_variant(isvc_deployer, raw_isvc_deployer, messenger):
+    client = Mock()
+    TestVCManager = Mock()
+    TestVCManager.return_value.merge_pr.return_value = True, None
+    TestVCManager.return_value.close_pr.return_value = True, None
+    isvc_deployer.side_effect = fake_deployer()
+    raw_isvc_deployer.side_effect = fake_deployer()
+
+    c = ConfigOverride(validate_files=False, check_files_existence=False, config=yaml.safe_load(
+        config_str_with_prod_namespace + '''
+  variants:
+    - inference_service_name: sklearn-iris-raw
+      mode: raw
+'''))
+    test_handler = VersionControlHandler(
+        client=client,
+        command='deploy', command_params={'run-id': '123', 'force': True},
+        pr_number='1', config=c,
+        VCManager=TestVCManager)
+    test_handler.exec_command()
+
+    assert isvc_deployer.call_count == 1
+    assert raw_isvc_deployer.call_args[1]['model'].inference_service_name == 'sklearn-iris-raw'
+
+@pytest.mark.parametrize('command_params, extra_config, expected_namespace', [
+    ({}, '', 'my-production-namespace'),
+    ({}, '\n  staging:\n    namespace: my-staging-namespace\n', 'my-staging-namespace'),
+    ({'env': 'production'}, '\n  staging:\n    namespace: my-staging-namespace\n', 'my-production-namespace'),
+    ({}, '\n  profiling:\n    samples_path: samples.jsonl\n    environment: production\n'
+         '  staging:\n    namespace: my-staging-namespace\n', 'my-production-namespace'),
+])
+@patch('package.kfops.handler.VersionControlMessenger')
+@patch('package.kfops.handler.IsvcDeployer')
+def test_vc_profile_deploy_environment(isvc_deployer, messenger, command_params, extra_config, expected_namespace):
+    client = Mock()
+    TestVCManager = Mock()
+    TestVCManager.return_value.merge_pr.return_value = True, None
+    TestVCManager.return_value.close_pr.return_value = True, None
+    isvc_deployer.side_effect = fake_deployer()
+
+    c = ConfigOverride(validate_files=False, check_files_existence=False,
+                       config=yaml.safe_load(config_str_with_prod_namespace + extra_config))
+    test_handler = VersionControlHandler(
+        client=client,
+        command='profile_deploy', command_params=dict(command_params, **{'run-id': '123', 'force': True}),
+        pr_number='1', config=c,
+        VCManager=TestVCManager)
+    test_handler.exec_command()
+
+    assert isvc_deployer.call_args[0][1] == expected_namespace
+    assert isvc_deployer.call_args[1]['profile'] == True
+
+@patch('package.kfops.handler.VersionControlMessenger')
+@patch('package.kfops.handler.IsvcDeployer')
+def test_vc_profile_deploy_unknown_environment(isvc_deployer, messenger):
+    client = Mock()
+    TestVCManager = Mock()
+    messenger.return_value.generic_error_message.side_effect = SystemExit()
+
+    c = ConfigOverride(validate_files=False, check_files_existence=False, config=yaml.safe_load(config_str_with_prod_namespace))
+    test_handler = VersionControlHandler(
+        client=client,
+        command='profile_deploy', command_params={'run-id': '123', 'env': 'dev'},
+        pr_number='1', config=c,
+        VCManager=TestVCManager)
+    with pytest.raises(SystemExit):
+        test_handler.exec_command()
+
+    assert 'Unknown environment "dev"' in messenger.return_value.generic_error_message.call_args[0][0]
+    assert isvc_deployer.call_count == 0
+
+@patch('package.kfops.handler.VersionControlMessenger')
+@patch('package.kfops.handler.IsvcDeployer')
+def test_vc_staging_deploy_not_recorded_in_history(isvc_deployer, messenger):
+    client = Mock()
+    TestVCManager = Mock()
+    isvc_deployer.side_effect = fake_deployer()
+
+    c = ConfigOverride(validate_files=False, check_files_existence=False, config=yaml.safe_load(
+        config_str_with_prod_namespace + '  staging:\n    namespace: my-staging-namespace\n'))
+    test_handler = VersionControlHandler(
+        client=client,
+        command='staging_deploy', command_params={'run-id': '123', 'force': True},
+        pr_number='1', config=c,
+        VCManager=TestVCManager, deployment_history=Mock())
+    test_handler.exec_command()
+
+    assert isvc_deployer.call_args[0][1] == 'my-staging-namespace'
+    assert isvc_deployer.call_args[1]['history'] is None
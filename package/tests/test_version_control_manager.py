@@ -0,0 +1,198 @@
+import yaml
+import pytest
+from unittest.mock import patch, Mock, call
+from munch import munchify
+from package.kfops.config import Config
+from package.kfops.version_control_manager import GithubManager, last_page_number
+
+config_str = '''
+repository:
+  owner: my-repo-username
+  name: kfops-sample
+'''
+
+def link_header(last_page):
+    url = 'https://api.github.com/repositories/1/issues/1/comments?per_page=100&page=%s'
+    return '<%s>; rel="next", <%s>; rel="last"' % (url % 2, url % last_page)
+
+def comments_api(pages):
+    'Returns mocked `issues.list_comments` serving `pages` (list of lists of comment bodies)'
+    github_api = Mock()
+
+    def list_comments(issue_number, per_page, page):
+        github_api.recv_hdrs = {'Link': link_header(len(pages))} if len(pages) > 1 else {}
+        return [munchify({'id': (page - 1) * 100 + i + 1, 'body': b}) for i, b in enumerate(pages[page - 1])]
+
+    github_api.issues.list_comments.side_effect = list_comments
+    github_api.issues.list.return_value = []
+    github_api.return_value = snapshot_response()
+    return github_api
+
+def snapshot_response(mergeable='MERGEABLE', base_oid='b1', head_history=('h1', 'b1'),
+                      labels=(), comments=()):
+    'Returns mocked response of Pull Request snapshot GraphQL query'
+    return munchify({'data': {'repository': {
+        'pullRequest': {
+            'mergeable': mergeable,
+            'headRefName': 'feature',
+            'baseRefName': 'main',
+            'baseRef': {'target': {'oid': base_oid}},
+            'headRef': {'target': {'history': {'nodes': [{'oid': o} for o in head_history]}}},
+            'labels': {'nodes': [{'name': l} for l in labels]},
+            'comments': {'nodes': [{'body': b} for b in comments]}
+        }
+    }}})
+
+def get_manager(pages):
+    c = Config(validate_files=False, check_files_existence=False, config=yaml.safe_load(config_str))
+    manager = GithubManager(1, config=c)
+    manager.github_api = comments_api(pages)
+    return manager
+
+def test_last_page_number():
+    assert last_page_number(link_header(7)) == 7
+    assert last_page_number(None) == 1
+
+def test_get_comments():
+    manager = get_manager([['a', 'b'], ['c']])
+
+    assert [c.body for c in manager.get_comments()] == ['a', 'b', 'c']
+    assert manager.github_api.issues.list_comments.call_count == 2
+
+def test_iter_comments_newest_first():
+    manager = get_manager([['a', 'b'], ['c', 'd'], ['e']])
+
+    assert [c.body for c in manager.iter_comments(newest_first=True)] == ['e', 'd', 'c', 'b', 'a']
+
+def test_extract_hidden_variables_takes_last_occurrence():
+    manager = get_manager([[
+        '<!-- KFOPS_RUN_ID=1 -->',
+        '<!-- KFOPS_VERSION_ID=v1 -->',
+        '<!-- KFOPS_RUN_ID=2 --> <!-- KFOPS_RUN_ID=3 -->',
+    ]])
+
+    found = manager.extract_hidden_variables(['VERSION_ID', 'RUN_ID'], prefix='KFOPS')
+
+    assert found == {'VERSION_ID': 'v1', 'RUN_ID': '3'}
+
+def test_extract_hidden_variables_stops_when_all_found():
+    manager = get_manager([
+        ['<!-- KFOPS_RUN_ID=1 -->'],
+        ['foo'],
+        ['<!-- KFOPS_VERSION_ID=v2 --> <!-- KFOPS_RUN_ID=2 -->'],
+    ])
+
+    found = manager.extract_hidden_variables(['VERSION_ID', 'RUN_ID'], prefix='KFOPS')
+
+    assert found == {'VERSION_ID': 'v2', 'RUN_ID': '2'}
+    manager.github_api.issues.list_comments.assert_has_calls([
+        call(1, per_page=100, page=1),
+        call(1, per_page=100, page=3),
+    ])
+    assert manager.github_api.issues.list_comments.call_count == 2
+
+def test_snapshot_fetched_once():
+    manager = get_manager([[]])
+
+    assert manager.is_pr_diverged() is False
+    assert manager.is_pr_mergeable() is True
+    manager.extract_hidden_variables(['RUN_ID'], prefix='KFOPS')
+
+    assert manager.github_api.call_count == 1
+    assert manager.github_api.call_args[0][:2] == ('/graphql', 'POST')
+    manager.github_api.pulls.get.assert_not_called()
+    manager.github_api.repos.compare_commits.assert_not_called()
+
+def test_is_pr_diverged_falls_back_to_compare():
+    manager = get_manager([[]])
+    manager.github_api.return_value = snapshot_response(base_oid='b2')
+    manager.github_api.repos.compare_commits.return_value = munchify({'status': 'diverged'})
+
+    assert manager.is_pr_diverged() is True
+    manager.github_api.repos.compare_commits.assert_called_once_with('feature', 'main')
+
+def test_is_pr_mergeable_conflicting():
+    manager = get_manager([[]])
+    manager.github_api.return_value = snapshot_response(mergeable='CONFLICTING')
+
+    assert manager.is_pr_mergeable() is False
+
+def test_is_pr_mergeable_unknown_refetched():
+    manager = get_manager([[]])
+    manager.github_api.side_effect = [
+        snapshot_response(mergeable='UNKNOWN'), snapshot_response(mergeable='MERGEABLE')]
+
+    assert manager.is_pr_mergeable() is True
+    assert manager.github_api.call_count == 2
+
+def label_api(manager, label_id='L1', holders=()):
+    'Serves label holders query and records label mutations'
+    def graphql(path, verb, data):
+        if data['query'].startswith('mutation'):
+            return munchify({'data': {}})
+        return munchify({'data': {
+            'repository': {'label': {'id': label_id} if label_id else None, 'pullRequest': {'id': 'PR1'}},
+            'search': {'nodes': [{'id': 'PR%s' % n, 'number': n} for n in holders]}
+        }})
+    manager.github_api.side_effect = graphql
+
+def test_add_label_moves_label_in_single_mutation():
+    manager = get_manager([[]])
+    label_api(manager, holders=[5, 7, 1])
+
+    manager.add_label('Deployed-to-prod')
+
+    assert manager.github_api.call_count == 2
+    query = manager.github_api.call_args_list[0][1]['data']['variables']['search']
+    assert query == 'repo:my-repo-username/kfops-sample label:"Deployed-to-prod"'
+    mutation = manager.github_api.call_args_list[1][1]['data']['query']
+    assert mutation.count('removeLabelsFromLabelable') == 2
+    assert '"PR5"' in mutation and '"PR7"' in mutation
+    assert 'addLabelsToLabelable(input: {labelableId: "PR1", labelIds: ["L1"]})' in mutation
+    manager.github_api.issues.remove_label.assert_not_called()
+
+def test_add_label_creates_missing_label():
+    manager = get_manager([[]])
+    label_api(manager, label_id=None)
+    manager.github_api.issues.create_label.return_value = munchify({'node_id': 'L2'})
+
+    manager.add_label('Deployed-to-prod')
+
+    manager.github_api.issues.create_label.assert_called_once_with('Deployed-to-prod', color='d73a4a')
+    assert '["L2"]' in manager.github_api.call_args_list[1][1]['data']['query']
+
+def test_extract_hidden_variables_from_snapshot():
+    manager = get_manager([['<!-- KFOPS_RUN_ID=1 -->']])
+    manager.github_api.return_value = snapshot_response(comments=[
+        '<!-- KFOPS_VERSION_ID=v1 --> <!-- KFOPS_RUN_ID=1 -->', '<!-- KFOPS_RUN_ID=2 -->'])
+
+    found = manager.extract_hidden_variables(['VERSION_ID', 'RUN_ID'], prefix='KFOPS')
+
+    assert found == {'VERSION_ID': 'v1', 'RUN_ID': '2'}
+    manager.github_api.issues.list_comments.assert_not_called()
+
+def test_created_comment_added_to_snapshot():
+    manager = get_manager([[]])
+    manager.github_api.issues.create_comment.return_value = munchify({'id': 5})
+    manager.is_pr_mergeable()
+
+    manager.create_comment('<!-- KFOPS_RUN_ID=1 -->')
+    manager.update_comment(5, '<!-- KFOPS_RUN_ID=2 -->')
+
+    assert manager.extract_hidden_variables(['RUN_ID'], prefix='KFOPS') == {'RUN_ID': '2'}
+    assert manager.snapshot.recent_comments == ['<!-- KFOPS_RUN_ID=2 -->']
+
+def test_find_comment():
+    manager = get_manager([['a <!-- marker -->', 'b'], ['c']])
+
+    assert manager.find_comment('<!-- marker -->') == 1
+    assert manager.find_comment('<!-- other -->') is None
+
+def test_merge_pr_invalidates_snapshot():
+    manager = get_manager([[]])
+    manager.is_pr_mergeable()
+
+    manager.merge_pr()
+    manager.is_pr_mergeable()
+
+    assert manager.github_api.call_count == 2